@@ -2,27 +2,68 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import os
 import json
+import time
+import base64
+import binascii
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for,jsonify
+import jinja2
+from flask import Flask, render_template, request, Response, flash, redirect, url_for,jsonify, abort, stream_with_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import logging
+import click
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from datetime import datetime
+from search import CatalogSearch
+from autocomplete import Autocomplete
+from outbox import Outbox
+from geo import GeocodeTable, VenueLocator, parse_point
+from cache import PageCache, LRUCache, make_backend
+from templating import configure_templates, compile_templates
+from formatting import DateTimeFormatter
+from assets import Assets, BuildError
+import partitions
+from booking import BookingConflict, IntervalIndex, MAX_SHOW_DURATION, lock_bookings, overlapping, violated_constraint
+from upcoming import UpcomingShowCounts
+from instrumentation import Instrumentation
+from database import RoutingSQLAlchemy, statement_timeout_per_transaction, pool_stats
+from bulk import open_text, guess_format, read_records, batched, ImportReport, csv_chunks, jsonl_chunks, gzip_chunks
+from werkzeug.datastructures import MultiDict
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from itertools import groupby
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
 moment = Moment(app)
-app.config.from_object('config.DevelopmentConfig')
-db = SQLAlchemy(app)
+# FYYUR_CONFIG=config.ProductionConfig under gunicorn
+app.config.from_object(os.environ.get('FYYUR_CONFIG', 'config.DevelopmentConfig'))
+if not app.config['SECRET_KEY']:
+  # a key per process would make every worker reject the others' session cookies
+  raise RuntimeError('SECRET_KEY must be set (FYYUR_CONFIG=%s)' % os.environ.get('FYYUR_CONFIG'))
+# reads of the views marked @db.replica_reads go to the replica binds, if any
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app,db)
+instrumentation = Instrumentation(app)
+# url_for('static') points at the fingerprinted build of `flask build-assets`
+assets = Assets(app)
+if app.config['DB_PGBOUNCER'] and app.config['DB_STATEMENT_TIMEOUT_MS']:
+  statement_timeout_per_transaction(app.config['DB_STATEMENT_TIMEOUT_MS'])
+
+def database_pool_gauges():
+  # {'bind="primary",state="checked_out"': n, ...} for every configured engine
+  gauges = {}
+  for bind in [None] + sorted(app.config['SQLALCHEMY_BINDS'] or {}):
+    for state, value in pool_stats(db.get_engine(app, bind)).items():
+      gauges['bind="%s",state="%s"' % (bind or 'primary', state)] = value
+  return gauges
+
+instrumentation.gauge('fyyur_db_pool_connections', 'Connections per pool and state.', database_pool_gauges)
 
 # TODO: connect to a local postgresql database
 # [DONE]
@@ -30,22 +71,56 @@ migrate = Migrate(app,db)
 # Models.
 #----------------------------------------------------------------------------#
 
+class Genre(db.Model):
+    __tablename__ = 'genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+
+    def __repr__(self):
+      return f'<Genre {self.name}>'
+
+# genre links; the primary key serves "genres of X", the reversed index "X with genre"
+venue_genre = db.Table('venue_genre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Index('ix_venue_genre_genre_id', 'genre_id', 'venue_id'))
+
+artist_genre = db.Table('artist_genre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Index('ix_artist_genre_genre_id', 'genre_id', 'artist_id'))
+
 class Venue(db.Model):
     __tablename__ = 'venue'
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.String())
+    genres = db.relationship('Genre', secondary=venue_genre, order_by='Genre.name')
     address = db.Column(db.String(120))
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
+    # WGS 84 degrees, entered or from the geocoding table; on Postgres the
+    # indexed venue.location geography column is generated from them
+    latitude = db.Column(db.Float())
+    longitude = db.Column(db.Float())
     phone = db.Column(db.String(120))
     website_link = db.Column(db.String(),default='')
     facebook_link = db.Column(db.String(120))
     image_link = db.Column(db.String(500), default='https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60')
     seeking_talent = db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String(), default='')
+    # UTC, for incremental exports
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
     shows = db.relationship('Show',backref='venue', lazy=True, cascade='save-update,delete')
+    history = db.relationship('ShowHistory', lazy=True, cascade='save-update,delete')
+
+    __table_args__ = (
+      # /venues listing order (area first, then name)
+      db.Index('ix_venue_state_city_name', 'state', 'city', 'name', 'id'),
+      # export --since
+      db.Index('ix_venue_updated_at_id', 'updated_at', 'id'),
+    )
 
     def __repr__(self):
       return f'<Venue name:{self.name} genres:{self.genres} city:{self.city} address:{self.address}' \
@@ -57,7 +132,7 @@ class Artist(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.String())
+    genres = db.relationship('Genre', secondary=artist_genre, order_by='Genre.name')
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
@@ -66,7 +141,17 @@ class Artist(db.Model):
     website_link = db.Column(db.String(),default='')
     seeking_venue = db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String(), default='')
+    # UTC, for incremental exports
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
     shows = db.relationship('Show', backref='artist', lazy=True, cascade='save-update,delete')
+    history = db.relationship('ShowHistory', lazy=True, cascade='save-update,delete')
+
+    __table_args__ = (
+      # /artists listing order
+      db.Index('ix_artist_name_id', 'name', 'id'),
+      # export --since
+      db.Index('ix_artist_updated_at_id', 'updated_at', 'id'),
+    )
 
     def __repr__(self):
       return f'<Artist name:{self.name} genres:{self.genres} city:{self.city} ' \
@@ -78,34 +163,698 @@ class Artist(db.Model):
 class Show(db.Model):
   __tablename__ = 'show'
 
+  # on Postgres the table is partitioned by month of start_date (partitions.py),
+  # and its primary key is (id, start_date); ids still come from one sequence
   id = db.Column(db.Integer, primary_key=True)
   venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'))
   artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'))
-  start_date = db.Column(db.DateTime())
+  start_date = db.Column(db.DateTime(), nullable=False)
+  # the venue and the artist are booked for [start_date, end_date); the
+  # booking check runs under lock_bookings(), backed on Postgres by the
+  # ex_show_*_booking exclusion constraints (per month partition)
+  end_date = db.Column(db.DateTime(), nullable=False)
+  # UTC, for incremental exports
+  updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+  __table_args__ = (
+    # detail pages and upcoming-show counts of one venue / artist
+    db.Index('ix_show_venue_id_start_date', 'venue_id', 'start_date'),
+    db.Index('ix_show_artist_id_start_date', 'artist_id', 'start_date'),
+    # /shows listing order
+    db.Index('ix_show_start_date_id', 'start_date', 'id'),
+    # export --since
+    db.Index('ix_show_updated_at_id', 'updated_at', 'id'),
+  )
 
   def __repr__(self):
     return f'<SHOW VENUE:{self.venue_id}, ARTIST:{self.artist_id}, DATE:{self.start_date}>'
 
+class ShowHistory(db.Model):
+  # shows archived by `flask archive-shows`, summed per venue and artist pair
+  __tablename__ = 'show_history'
+
+  venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
+  artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
+  shows = db.Column(db.Integer, nullable=False)
+  first_date = db.Column(db.DateTime(), nullable=False)
+  last_date = db.Column(db.DateTime(), nullable=False)
+
+  __table_args__ = (
+    # the history section of a venue / artist page, latest first
+    db.Index('ix_show_history_venue_id_last_date', 'venue_id', 'last_date'),
+    db.Index('ix_show_history_artist_id_last_date', 'artist_id', 'last_date'),
+  )
+
+  def __repr__(self):
+    return f'<SHOW HISTORY VENUE:{self.venue_id}, ARTIST:{self.artist_id}, SHOWS:{self.shows}>'
+
+class OutboxEvent(db.Model):
+  # side effects of a write, committed with it; run by the outbox handlers
+  # (once) and listeners (in every process)
+  __tablename__ = 'outbox'
+
+  id = db.Column(db.Integer, primary_key=True)
+  # idempotency key, the same on every delivery of the event
+  key = db.Column(db.String(100), nullable=False, unique=True)
+  topic = db.Column(db.String(50), nullable=False)
+  payload = db.Column(db.Text(), nullable=False)
+  created_at = db.Column(db.DateTime(), nullable=False)
+  # not claimed before this time (the retry backoff)
+  available_at = db.Column(db.DateTime(), nullable=False)
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  # token and lease of the worker running it
+  claim = db.Column(db.String(32))
+  claimed_until = db.Column(db.DateTime())
+  # handled, or given up on when last_error is set
+  done_at = db.Column(db.DateTime())
+  last_error = db.Column(db.Text())
+
+  __table_args__ = (
+    # the workers' claim reads the due events in order; done ones are left out
+    db.Index('ix_outbox_pending', 'available_at', 'id',
+             postgresql_where=db.text('done_at IS NULL'), sqlite_where=db.text('done_at IS NULL')),
+  )
+
+  def __repr__(self):
+    return f'<OUTBOX {self.key} {self.topic} ATTEMPTS:{self.attempts}>'
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 # [DONE]
+# a user who just wrote reads around the page cache, as around the replicas,
+# while the outbox listeners apply the write's invalidations; misses are read
+# from the primary, so a lagging replica never fills the cache
+page_cache = PageCache(make_backend(app.config), ttl=app.config['CACHE_TTL'], bypass=db.wrote_recently,
+                       on_miss=db.read_primary, from_replica=db.reads_replica)
+outbox = Outbox(db, OutboxEvent, batch_size=app.config['OUTBOX_BATCH_SIZE'],
+                max_attempts=app.config['OUTBOX_MAX_ATTEMPTS'], lease_seconds=app.config['OUTBOX_LEASE_SECONDS'])
+
+venue_search = CatalogSearch(db, Venue, ['city'], tags=(venue_genre.c.venue_id, Genre.name),
+                             limit=app.config['SEARCH_LIMIT'])
+artist_search = CatalogSearch(db, Artist, ['city'], tags=(artist_genre.c.artist_id, Genre.name),
+                              limit=app.config['SEARCH_LIMIT'])
+venue_autocomplete = Autocomplete(db, Venue, limit=app.config['AUTOCOMPLETE_LIMIT'],
+                                  max_entries=app.config['AUTOCOMPLETE_MAX_ENTRIES'],
+                                  max_age=app.config['AUTOCOMPLETE_MAX_AGE'])
+artist_autocomplete = Autocomplete(db, Artist, limit=app.config['AUTOCOMPLETE_LIMIT'],
+                                   max_entries=app.config['AUTOCOMPLETE_MAX_ENTRIES'],
+                                   max_age=app.config['AUTOCOMPLETE_MAX_AGE'])
+geocoder = GeocodeTable(app.config['GEOCODE_TABLE'])
+venue_locator = VenueLocator(db, Venue)
+
+@app.before_first_request
+def start_outbox_workers():
+  # OUTBOX_WORKERS=0 runs the events in the request, after its commit
+  outbox.start(app, app.config['OUTBOX_WORKERS'], app.config['OUTBOX_POLL_SECONDS'])
+
+instrumentation.gauge('fyyur_outbox_events', 'Outbox events run by this process, per topic and outcome.',
+                      lambda: {'topic="%s",outcome="%s"' % key: value for key, value in outbox.counts.items()})
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  # date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(value, format)
+# parsed Babel patterns per (format, locale) and a memo of recent timestamps;
+# format_datetime.format_many() formats a whole result set in one call
+format_datetime = DateTimeFormatter(app.config['DATETIME_LOCALE'], app.config['DATETIME_MEMO_SIZE'])
 
 app.jinja_env.filters['datetime'] = format_datetime
+# bytecode cache shared by the workers, and {% cache %} for the show tiles and
+# venue/artist headers
+configure_templates(app, page_cache)
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+# sort keys of the paginated listings; each one is backed by an index
+VENUE_SORT = [Venue.state, Venue.city, Venue.name, Venue.id]
+ARTIST_SORT = [Artist.name, Artist.id]
+SHOW_SORT = [Show.start_date, Show.id]
+
+def venue_listing_query():
+  # upcoming-show counts come from upcoming_counts, so the listing only walks
+  # ix_venue_state_city_name and stops after one page
+  return db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)
+
+def upcoming_shows_query(now):
+  # what upcoming_counts loads: a range scan of ix_show_start_date_id
+  return db.session.query(Show.start_date, Show.venue_id, Show.artist_id).filter(Show.start_date > now)
+
+upcoming_counts = UpcomingShowCounts(upcoming_shows_query, max_age=app.config['UPCOMING_COUNTS_MAX_AGE'])
+
+def artist_listing_query():
+  return db.session.query(Artist.id, Artist.name)
+
+def show_listing_query():
+  return db.session.query(Show.id, Show.start_date, Show.venue_id, Venue.name.label('venue_name'),
+                          Show.artist_id, Artist.name.label('artist_name'),
+                          Artist.image_link.label('artist_image_link')) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id)
+
+def show_window_filters(start=None, end=None, city=None, genre=None):
+  # criteria of /shows?from=&to=&city=&genre=. the window is a plain range on
+  # start_date: ix_show_start_date_id serves it, and on Postgres it prunes the
+  # month partitions outside it. city and genre are venue / artist id subqueries
+  criteria = []
+  if start is not None:
+    criteria.append(Show.start_date >= start)
+  if end is not None:
+    criteria.append(Show.start_date < end)
+  if city:
+    criteria.append(Show.venue_id.in_(
+      db.session.query(Venue.id).filter(db.func.lower(Venue.city) == city.lower())))
+  if genre:
+    criteria.append(Show.artist_id.in_(
+      db.session.query(artist_genre.c.artist_id)
+        .join(Genre, Genre.id == artist_genre.c.genre_id)
+        .filter(Genre.name == genre)))
+  return criteria
+
+def with_genre(query, entity, link, genre):
+  # restrict an entity query to one genre, joined through the link table's
+  # (genre_id, <entity>_id) index
+  if not genre:
+    return query
+  return query.join(link.table, link == entity.id) \
+    .join(Genre, Genre.id == link.table.c.genre_id) \
+    .filter(Genre.name == genre)
+
+def show_counts_query(show_filter, now):
+  return db.session.query(
+    db.func.sum(db.case([(Show.start_date > now, 1)], else_=0)),
+    db.func.count(Show.id)).filter(show_filter)
+
+def entity_shows_query(counterpart, show_filter, now):
+  upcoming = db.case([(Show.start_date > now, True)], else_=False).label('upcoming')
+  return db.session.query(counterpart.id, counterpart.name, counterpart.image_link,
+                          Show.start_date, upcoming) \
+    .select_from(Show).join(counterpart) \
+    .filter(show_filter) \
+    .order_by(Show.start_date, Show.id)
+
+def history_query(counterpart, history_filter, limit):
+  # archived shows of one venue or artist, one row per counterpart, latest
+  # first; `archived` totals every row, as the window is computed before LIMIT
+  return db.session.query(counterpart.id, counterpart.name, counterpart.image_link,
+                          ShowHistory.shows, ShowHistory.first_date, ShowHistory.last_date,
+                          db.func.sum(ShowHistory.shows).over().label('archived')) \
+    .select_from(ShowHistory).join(counterpart) \
+    .filter(history_filter) \
+    .order_by(ShowHistory.last_date.desc()) \
+    .limit(limit)
+
+def genre_list(model, link):
+  # comma-joined genre names of each row of `model`, as a correlated subquery
+  if db.engine.dialect.name == 'postgresql':
+    names = db.func.string_agg(Genre.name, ',')
+  else:
+    names = db.func.group_concat(Genre.name, ',')
+  return db.select([names]) \
+    .select_from(link.table.join(Genre, Genre.id == link.table.c.genre_id)) \
+    .where(link == model.id) \
+    .correlate(model) \
+    .as_scalar()
+
+def export_query(kind, since=None):
+  # every exported column of `kind`, in the order the export writes them; with
+  # `since`, only the rows changed since then, walked along ix_<kind>_updated_at_id
+  if kind == 'shows':
+    model = Show
+    query = db.session.query(Show.id, Show.venue_id, Venue.name.label('venue'),
+                             Show.artist_id, Artist.name.label('artist'),
+                             Show.start_date.label('start_time'), Show.end_date.label('end_time'),
+                             Show.updated_at) \
+      .join(Venue, Show.venue_id == Venue.id) \
+      .join(Artist, Show.artist_id == Artist.id)
+  else:
+    model, link = (Venue, venue_genre.c.venue_id) if kind == 'venues' else (Artist, artist_genre.c.artist_id)
+    query = db.session.query(*model.__table__.columns, genre_list(model, link).label('genres'))
+  if since is None:
+    return query.order_by(model.id)
+  return query.filter(model.updated_at >= since).order_by(model.updated_at, model.id)
+
+EXPORT_MODELS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+def export_next_since(kind):
+  # the `since` of the next incremental export: the latest updated_at before
+  # this export reads, less EXPORT_OVERLAP_SECONDS for the rows stamped before
+  # it whose transaction had not committed yet. Exports overlap, so consumers
+  # dedupe on id (keeping the latest updated_at)
+  latest = db.session.query(db.func.max(EXPORT_MODELS[kind].updated_at)).scalar()
+  return (latest or datetime.utcnow()) - timedelta(seconds=app.config['EXPORT_OVERLAP_SECONDS'])
+
+# JSON API fields; the columns behind them are only selected when requested
+VENUE_API_FIELDS = ['id', 'name', 'genres', 'address', 'city', 'state', 'latitude', 'longitude', 'phone',
+                    'website_link', 'facebook_link', 'seeking_talent', 'seeking_description', 'image_link']
+ARTIST_API_FIELDS = ['id', 'name', 'genres', 'city', 'state', 'phone', 'website_link',
+                     'facebook_link', 'seeking_venue', 'seeking_description', 'image_link']
+SHOW_API_COLUMNS = {
+  'id': Show.id,
+  'venue_id': Show.venue_id,
+  'venue_name': Venue.name.label('venue_name'),
+  'artist_id': Show.artist_id,
+  'artist_name': Artist.name.label('artist_name'),
+  'artist_image_link': Artist.image_link.label('artist_image_link'),
+  'start_time': Show.start_date.label('start_time'),
+  'end_time': Show.end_date.label('end_time'),
+}
+
+def booked_show_query():
+  return db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_date, Show.end_date,
+                          Venue.name.label('venue_name'), Artist.name.label('artist_name')) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id)
+
+BOOKED_RESOURCES = [('venue', Show.venue_id, 'venue_id'), ('artist', Show.artist_id, 'artist_id')]
+
+def booking_conflict(show, resources=('venue', 'artist')):
+  # the first show booking the venue or the artist of `show` (a dict of
+  # venue_id, artist_id, start_date, end_date) as a BookingConflict, or None;
+  # one short range scan of ix_show_<resource>_id_start_date per resource
+  for resource, column, key in BOOKED_RESOURCES:
+    if resource in resources:
+      other = overlapping(booked_show_query().filter(column == show[key]), Show.start_date, Show.end_date,
+                          show['start_date'], show['end_date']) \
+        .order_by(Show.start_date).first()
+      if other is not None:
+        return BookingConflict(resource, other)
+  return None
+
+def booking_index(shows):
+  # IntervalIndex of the booked shows that could overlap a batch of new ones,
+  # keyed by (resource, id)
+  index = IntervalIndex()
+  start = min(show['start_date'] for show in shows)
+  end = max(show['end_date'] for show in shows)
+  for resource, column, key in BOOKED_RESOURCES:
+    ids = sorted({show[key] for show in shows})
+    for offset in range(0, len(ids), 500):
+      booked = overlapping(booked_show_query().filter(column.in_(ids[offset:offset + 500])),
+                           Show.start_date, Show.end_date, start, end)
+      for other in booked:
+        index.add((resource, getattr(other, key)), other.start_date, other.end_date, other)
+  return index
+
+def entity_api_query(model, link, fields, sort_columns=()):
+  # the requested `fields` of `model` (plus the sort key), genres aggregated in
+  # the same statement
+  columns = list(sort_columns)
+  for field in fields:
+    if field == 'genres':
+      columns.append(genre_list(model, link).label('genres'))
+    elif field in model.__table__.c and field not in [column.key for column in columns]:
+      columns.append(getattr(model, field))
+  return db.session.query(*columns)
+
+def show_api_query(fields):
+  # joins venue / artist only for the fields that need them
+  columns = list(SHOW_SORT) + [SHOW_API_COLUMNS[field] for field in fields if field not in ('id',)]
+  query = db.session.query(*columns)
+  if 'venue_name' in fields:
+    query = query.join(Venue, Show.venue_id == Venue.id)
+  if 'artist_name' in fields or 'artist_image_link' in fields:
+    query = query.join(Artist, Show.artist_id == Artist.id)
+  return query
 
 #----------------------------------------------------------------------------#
 # Helper Functions.
 #----------------------------------------------------------------------------#
 
+def show_counts(show_filter, now):
+  # (past, upcoming) show counts of one venue or artist, aggregated in the database
+  return split_counts(*show_counts_query(show_filter, now).one())
+
+def split_counts(upcoming, total):
+  upcoming = upcoming or 0
+  return total - upcoming, upcoming
+
+def split_shows(counterpart, prefix, show_filter, now):
+  # shows of one venue or artist joined with the columns of the other side in a
+  # single query; whether a show is upcoming is decided by the database
+  return split_show_rows(entity_shows_query(counterpart, show_filter, now).all(), prefix)
+
+def split_show_rows(rows, prefix):
+  past_shows = []
+  upcoming_shows = []
+  for row in rows:
+    show_data = {
+      prefix + "_id": row[0],
+      prefix + "_name": row[1],
+      prefix + "_image_link": row[2],
+      "start_time": row.start_date
+    }
+    if row.upcoming:
+      upcoming_shows.append(show_data)
+    else:
+      past_shows.append(show_data)
+  return past_shows, upcoming_shows
+
+def show_history(counterpart, prefix, history_filter):
+  return split_history_rows(
+    history_query(counterpart, history_filter, app.config['SHOW_HISTORY_LIMIT']).all(), prefix)
+
+def split_history_rows(rows, prefix):
+  # (entries, number of archived shows) of history_query() rows
+  entries = [{
+    prefix + "_id": row[0],
+    prefix + "_name": row[1],
+    prefix + "_image_link": row[2],
+    "shows": row.shows,
+    "first_time": row.first_date,
+    "last_time": row.last_date,
+  } for row in rows]
+  return entries, int(rows[0].archived) if rows else 0
+
+# page data of the read views, shared with the async entry point (asgi.py)
+
+def venue_areas(rows, num_upcoming_shows):
+  # rows come sorted by area, so the city grouping is a single pass
+  venues_data = []
+  for (city, state), rows in groupby(rows, key=lambda row: (row.city, row.state)):
+    venues_data.append({
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": row.id,
+        "name": row.name,
+        "num_upcoming_shows": num_upcoming_shows[row.id],
+      } for row in rows]
+    })
+  return venues_data
+
+def artist_tiles(rows):
+  return [{"id": artist.id, "name": artist.name} for artist in rows]
+
+def show_tiles(rows):
+  return [{
+    "venue_id": show.venue_id,
+    "venue_name": show.venue_name,
+    "artist_id": show.artist_id,
+    "artist_name": show.artist_name,
+    "artist_image_link": show.artist_image_link,
+    "start_time": show.start_date
+  } for show in rows]
+
+def venue_page_data(venue, genres, shows, counts, history=((), 0)):
+  # venue: Venue or a venue row; shows: split_show_rows(); counts: split_counts();
+  # history: split_history_rows(), whose shows count as past shows
+  return {
+    "id": venue.id,
+    "name": venue.name,
+    "genres": genres,
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "website": None if venue.website_link == '' else venue.website_link,
+    "facebook_link": venue.facebook_link,
+    "seeking_talent": venue.seeking_talent,
+    "seeking_description": venue.seeking_description,
+    "image_link": venue.image_link,
+    "past_shows": shows[0],
+    "upcoming_shows": shows[1],
+    "archived_shows": list(history[0]),
+    "past_shows_count": counts[0] + history[1],
+    "upcoming_shows_count": counts[1],
+    "archived_shows_count": history[1],
+  }
+
+def artist_page_data(artist, genres, shows, counts, history=((), 0)):
+  return {
+    "id": artist.id,
+    "name": artist.name,
+    "genres": genres,
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "website": None if artist.website_link == '' else artist.website_link,
+    "facebook_link": artist.facebook_link,
+    "seeking_venue": artist.seeking_venue,
+    "seeking_description": artist.seeking_description,
+    "image_link": artist.image_link,
+    "past_shows": shows[0],
+    "upcoming_shows": shows[1],
+    "archived_shows": list(history[0]),
+    "past_shows_count": counts[0] + history[1],
+    "upcoming_shows_count": counts[1],
+    "archived_shows_count": history[1],
+  }
+
+def genres_named(names):
+  # Genre rows for the given names, creating the ones not seen before
+  names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+  if not names:
+    return []
+  known = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))}
+  return [known.get(name) or Genre(name=name) for name in names]
+
+def venue_location(form, previous=None):
+  # (latitude, longitude) of a submitted venue: the coordinates entered, else
+  # the geocoding table's for its address. On an edit, coordinates left as
+  # they were follow a change of address
+  address, city, state = form.get('address'), form.get('city'), form.get('state')
+  try:
+    entered = (float(form['latitude']), float(form['longitude']))
+  except (KeyError, TypeError, ValueError):
+    entered = None
+  if entered is not None and previous is not None and entered == (previous.latitude, previous.longitude) \
+      and (address, city, state) != (previous.address, previous.city, previous.state):
+    entered = None
+  if entered is None:
+    return geocoder.lookup(address, city, state) or (None, None)
+  if not (-90 <= entered[0] <= 90 and -180 <= entered[1] <= 180):
+    raise ValueError('not a location: %r' % (entered,))
+  return entered
+
+def near_args():
+  # (latitude, longitude, radius in km) of ?near=lat,lon[&radius=km], or None
+  if not request.values.get('near'):
+    return None
+  try:
+    latitude, longitude = parse_point(request.values['near'])
+    radius = float(request.values.get('radius') or app.config['NEAR_RADIUS_KM'])
+  except ValueError:
+    abort(400)
+  if not 0 < radius <= app.config['MAX_NEAR_RADIUS_KM']:
+    abort(400)
+  return latitude, longitude, radius
+
+def suggestions(autocomplete, endpoint, id_arg):
+  # ?q= typed so far -> {"data": [{id, name, url}]}, at most ?limit= (capped at AUTOCOMPLETE_LIMIT)
+  found = autocomplete.suggest(request.args.get('q', ''), request.args.get('limit', type=int))
+  return api_response({"data": [{"id": id, "name": name, "url": url_for(endpoint, **{id_arg: id})}
+                                for id, name in found]})
+
+def window_bound(name, through_day=False):
+  # a ?from= / ?to= bound; a bare date as ?to= includes that whole day
+  value = request.args.get(name, '').strip()
+  if not value:
+    return None
+  try:
+    bound = dateutil.parser.parse(value)
+  except (ValueError, OverflowError):
+    abort(400)
+  if through_day and len(value) <= len('YYYY-MM-DD'):
+    bound += timedelta(days=1)
+  return bound
+
+def show_window():
+  # the show listing filters of the request, as show_window_filters() arguments
+  return {'start': window_bound('from'), 'end': window_bound('to', through_day=True),
+          'city': request.args.get('city', '').strip() or None,
+          'genre': request.args.get('genre', '').strip() or None}
+
+def show_end(start, minutes=None):
+  # end of a show starting at `start` and lasting `minutes` (default: SHOW_DURATION_MINUTES)
+  duration = timedelta(minutes=int(minutes or app.config['SHOW_DURATION_MINUTES']))
+  if not timedelta(0) < duration <= MAX_SHOW_DURATION:
+    raise ValueError('a show lasts between 1 minute and %s' % MAX_SHOW_DURATION)
+  return start + duration
+
+def catalog_changed(venue_ids=(), artist_ids=(), new_shows=(), deleted=False):
+  # bring this process's derived read structures in line with a committed
+  # write (run by its outbox listener, see record_catalog_change); new_shows
+  # are (venue_id, artist_id, start_date, written_at) tuples
+  shows_changed = bool(new_shows) or deleted
+  tags = [tag for tag, changed in [('venues', venue_ids), ('artists', artist_ids), ('shows', shows_changed)] if changed]
+  for venue_id, artist_id, start_date, written_at in new_shows:
+    upcoming_counts.show_added(venue_id, artist_id, start_date, written_at)
+  if deleted:
+    # deleting a venue or artist cascades to its shows
+    upcoming_counts.invalidate()
+  for venue_id in venue_ids:
+    if deleted:
+      venue_search.remove(venue_id)
+      venue_locator.remove(venue_id)
+      venue_autocomplete.remove(venue_id)
+    else:
+      venue_search.reindex(venue_id)
+      venue_locator.reindex(venue_id)
+      venue_autocomplete.reindex(venue_id)
+  for artist_id in artist_ids:
+    if deleted:
+      artist_search.remove(artist_id)
+      artist_autocomplete.remove(artist_id)
+    else:
+      artist_search.reindex(artist_id)
+      artist_autocomplete.reindex(artist_id)
+  # last, in every process: a 'local' cache is per process, and a shared one
+  # must not keep pages this process built from its indexes before the write
+  page_cache.invalidate(*tags)
+
+def record_catalog_change(venue_ids=(), artist_ids=(), new_shows=(), deleted=False):
+  # queue catalog_changed() in the transaction of the write; commit, then outbox.wake()
+  outbox.publish('catalog_changed', {
+    'venue_ids': list(venue_ids), 'artist_ids': list(artist_ids), 'deleted': deleted,
+    'new_shows': [[venue_id, artist_id, start_date.isoformat()] for venue_id, artist_id, start_date in new_shows],
+    'written_at': time.time(),
+  })
+
+def catalog_reloaded():
+  # after a bulk write: drop this process's derived read structures instead
+  # of patching them row by row, they are rebuilt on next use
+  upcoming_counts.invalidate()
+  venue_search.invalidate()
+  artist_search.invalidate()
+  venue_locator.invalidate()
+  venue_autocomplete.invalidate()
+  artist_autocomplete.invalidate()
+  page_cache.invalidate('venues', 'artists', 'shows')
+
+@outbox.listener('catalog_changed', resync=catalog_reloaded)
+def apply_catalog_changes(events):
+  # in every process, once per event: one catalog_changed() per kind of
+  # change for the whole batch. show_added() skips the shows the counts
+  # loaded after the write
+  changes = {False: (set(), set(), []), True: (set(), set(), [])}
+  for _, change in events:
+    venue_ids, artist_ids, new_shows = changes[change['deleted']]
+    venue_ids.update(change['venue_ids'])
+    artist_ids.update(change['artist_ids'])
+    new_shows += [(venue_id, artist_id, dateutil.parser.parse(start_date), change['written_at'])
+                  for venue_id, artist_id, start_date in change['new_shows']]
+  for deleted, (venue_ids, artist_ids, new_shows) in changes.items():
+    if venue_ids or artist_ids or new_shows:
+      catalog_changed(sorted(venue_ids), sorted(artist_ids), new_shows, deleted)
+
+def record_catalog_reload(connection=None):
+  # queue catalog_reloaded() in every process, in the transaction of the bulk
+  # write (of the session, or of `connection`)
+  outbox.publish('catalog_reloaded', {'written_at': time.time()}, connection=connection)
+
+@outbox.listener('catalog_reloaded', resync=catalog_reloaded)
+def apply_catalog_reload(events):
+  catalog_reloaded()
+
+def export_rows(kind, since=None, batch_size=1000):
+  # (column names, row iterator); rows are fetched `batch_size` at a time
+  # through a server-side cursor where the driver has one
+  query = export_query(kind, since)
+  return [column['name'] for column in query.column_descriptions], query.yield_per(batch_size)
+
+def export_chunks(kind, fmt, since=None):
+  columns, rows = export_rows(kind, since)
+  if fmt == 'csv':
+    return csv_chunks(columns, rows)
+  if kind != 'shows':
+    # genres as a JSON array rather than the comma-joined CSV cell
+    rows = (tuple(row[:-1]) + ((row[-1] or '') and row[-1].split(','),) for row in rows)
+  return jsonl_chunks(columns, rows)
+
+def api_fields(available, default=None):
+  # ?fields=a,b,c as a list, in the order asked; unknown names are a 400
+  if not request.args.get('fields'):
+    return list(default or available)
+  fields = list(dict.fromkeys(field.strip() for field in request.args['fields'].split(',') if field.strip()))
+  unknown = [field for field in fields if field not in available]
+  if unknown:
+    abort(400, 'unknown fields: ' + ', '.join(unknown))
+  return fields
+
+def api_record(row, fields, extra=None):
+  record = {}
+  for field in fields:
+    if extra and field in extra:
+      record[field] = extra[field]
+    elif field == 'genres':
+      record[field] = row.genres.split(',') if row.genres else []
+    else:
+      record[field] = getattr(row, field)
+  return record
+
+def api_response(payload):
+  # compact JSON; datetimes as ISO 8601
+  body = json.dumps(payload, separators=(',', ':'), default=lambda value: value.isoformat())
+  return Response(body, mimetype='application/json')
+
+def encode_cursor(values):
+  # opaque page cursor holding the sort key of the row a page starts after / ends before
+  values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+  return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token, parsers):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    if not isinstance(values, list) or len(values) != len(parsers):
+      raise ValueError(token)
+    return [None if value is None else parse(value) for parse, value in zip(parsers, values)]
+  except (binascii.Error, ValueError, TypeError, OverflowError):
+    abort(400)
+
+def keyset_page(query, sort_columns, parsers):
+  # one page of `query` ordered by sort_columns. pages are positioned with the
+  # ?after= / ?before= cursors (a row-value comparison the sort index can seek
+  # to) instead of OFFSET, so page N costs the same as page 1
+  return keyset_result(keyset_query(query, sort_columns, parsers).all(), sort_columns)
+
+def page_size():
+  size = request.args.get('per_page', app.config['PAGE_SIZE'], type=int)
+  return max(1, min(size, app.config['MAX_PAGE_SIZE']))
+
+def keyset_query(query, sort_columns, parsers):
+  # the statement of one page: seek to the cursor, read one row past the page
+  after = request.args.get('after')
+  before = request.args.get('before')
+  sort_key = db.tuple_(*sort_columns)
+
+  if before:
+    query = query.filter(sort_key < db.tuple_(*decode_cursor(before, parsers))) \
+      .order_by(*[column.desc() for column in sort_columns])
+  else:
+    if after:
+      query = query.filter(sort_key > db.tuple_(*decode_cursor(after, parsers)))
+    query = query.order_by(*sort_columns)
+  return query.limit(page_size() + 1)
+
+def keyset_result(rows, sort_columns):
+  # the page dict of the rows keyset_query() returned
+  after = request.args.get('after')
+  before = request.args.get('before')
+  size = page_size()
+  has_more = len(rows) > size
+  rows = list(rows[:size])
+  if before:
+    rows.reverse()
+
+  def key_of(row):
+    return [getattr(row, column.key) for column in sort_columns]
+
+  def page_url(**cursor):
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(cursor)
+    return url_for(request.endpoint, **dict(request.view_args, **args))
+
+  has_next = has_more if not before else True
+  has_prev = has_more if before else bool(after)
+  return {
+    "items": rows,
+    "next_url": page_url(after=encode_cursor(key_of(rows[-1]))) if rows and has_next else None,
+    "prev_url": page_url(before=encode_cursor(key_of(rows[0]))) if rows and has_prev else None,
+  }
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -119,93 +868,86 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@page_cache.cached('venues', 'shows')
+@db.replica_reads
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
+  # [DONE]
 
-  venues_data = []
-  distinct_cities = Venue.query.with_entities(Venue.city, Venue.state).distinct().all()
-  venue_tuples = Venue.query.all()
-  for city in distinct_cities:
-    city_dict = {
-      "city":city[0],
-      "state":city[1],
-      "venues":[]
-    }
-    for venue in venue_tuples:
-      if(venue.city == city[0]):
-        upcoming_shows = [show for show in venue.shows if show.start_date>datetime.now() ]
-        venue_dict = {
-          "id": venue.id,
-          "name": venue.name,
-          "num_upcoming_shows": len(upcoming_shows),
-        }
-        city_dict['venues'].append(venue_dict)
-
-    venues_data.append(city_dict)
-  return render_template('pages/venues.html', areas=venues_data);
+  # one query for a page of venues, already sorted by area so the city grouping
+  # below is a single pass over the rows; upcoming counts are looked up in memory
+  near = near_args()
+  if near is not None:
+    return nearby_venues(*near)
+  venue_query = with_genre(venue_listing_query(), Venue, venue_genre.c.venue_id,
+                           request.args.get('genre'))
+  page = keyset_page(venue_query, VENUE_SORT, [str, str, str, int])
+  num_upcoming_shows = upcoming_counts.venues([row.id for row in page['items']])
+  venues_data = venue_areas(page['items'], num_upcoming_shows)
+  return render_template('pages/venues.html', areas=venues_data, page=page, genre=request.args.get('genre'))
+
+def nearby_venues(latitude, longitude, radius):
+  # /venues?near=: the page_size() venues nearest the point within the radius,
+  # nearest first; the index (PostGIS or the in-process grid) stops there, so
+  # there is no next page
+  found = venue_locator.nearby(latitude, longitude, radius, page_size(), [Venue.city, Venue.state])
+  num_upcoming_shows = upcoming_counts.venues([row.id for _, row in found])
+  nearby = [{
+    "id": row.id,
+    "name": row.name,
+    "city": row.city,
+    "state": row.state,
+    "distance_km": distance,
+    "num_upcoming_shows": num_upcoming_shows[row.id],
+  } for distance, row in found]
+  return render_template('pages/venues.html', nearby=nearby, near=(latitude, longitude), radius=radius,
+                         page={'next_url': None, 'prev_url': None})
 
 @app.route('/venues/search', methods=['POST'])
+@db.replica_reads
 def search_venues():
   # TODO: implement search on venues with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  filtered_venues = Venue.query.filter(Venue.name.ilike('%'+request.form['search_term']+'%')).all()
+  # [DONE]
+  # near= / radius= (form fields or query args) keep the venues around a point
+  near = near_args()
+  count, found_venues = venue_search.search(request.form.get('search_term', ''),
+                                            tag=request.values.get('genre') or None,
+                                            ids=venue_locator.within(*near) if near else None)
+  num_upcoming_shows = upcoming_counts.venues([venue.id for venue in found_venues])
   search_result = {
-    "count":len(filtered_venues),
-    "data":[]
-  }
-  for venue in filtered_venues:
-    upcoming_shows = [show for show in venue.shows if show.start_date>datetime.now()]
-    search_result['data'].append({
+    "count": count,
+    "data": [{
       "id": venue.id,
       "name": venue.name,
-      "num_upcoming_shows": len(upcoming_shows),
-    })
+      "num_upcoming_shows": num_upcoming_shows[venue.id],
+    } for venue in found_venues]
+  }
+
+  return render_template('pages/search_venues.html', results=search_result, search_term=request.form.get('search_term', ''),
+                         genre=request.values.get('genre'), near=near)
 
-  return render_template('pages/search_venues.html', results=search_result, search_term=request.form.get('search_term', ''))
+@app.route('/venues/autocomplete')
+@db.replica_reads
+def autocomplete_venues():
+  # search-as-you-type suggestions of the venue search box
+  return suggestions(venue_autocomplete, 'show_venue', 'venue_id')
 
 @app.route('/venues/<int:venue_id>')
+@db.replica_reads
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   target_venue = Venue.query.get(venue_id)
   # render venue data only if venue exsists
   if(target_venue != None):
-    past_shows = []
-    upcoming_shows = []
-    show_data = {}
-    for show in target_venue.shows:
-      show_data = {
-        "artist_id": show.artist_id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_date
-      }
-      if show.start_date > datetime.now():
-        upcoming_shows.append(show_data)
-      else:
-        past_shows.append(show_data)
-      #  debug
-      print(show_data['start_time'])
-    target_venue_data = {
-      "id": target_venue.id,
-      "name": target_venue.name,
-      "genres": target_venue.genres.split(','),
-      "address": target_venue.address,
-      "city": target_venue.city,
-      "state": target_venue.state,
-      "phone": target_venue.phone,
-      "website": None if target_venue.website_link == '' else target_venue.website,
-      "facebook_link": target_venue.facebook_link,
-      "seeking_talent": target_venue.seeking_talent,
-      "seeking_description": target_venue.seeking_description,
-      "image_link": target_venue.image_link,
-      "past_shows": past_shows,
-      "upcoming_shows": upcoming_shows,
-      "past_shows_count": len(past_shows),
-      "upcoming_shows_count": len(upcoming_shows),
-    }
+    now = datetime.now()
+    target_venue_data = venue_page_data(target_venue, [genre.name for genre in target_venue.genres],
+                                        split_shows(Artist, 'artist', Show.venue_id == venue_id, now),
+                                        show_counts(Show.venue_id == venue_id, now),
+                                        show_history(Artist, 'artist', ShowHistory.venue_id == venue_id))
     return render_template('pages/show_venue.html', venue=target_venue_data)
   # if venue doesn't exist in the database render home page and show corresponding notifications
   else:
@@ -226,22 +968,23 @@ def create_venue_submission():
   # TODO: modify data to be the data object returned from db insertion
   # [DONE]
   try:
-    genres = request.form.getlist('genres')
-    genres = ','.join(genres)
-    # Debug
-    print(genres)
+    genres = genres_named(request.form.getlist('genres'))
 
+    latitude, longitude = venue_location(request.form)
     new_venue = Venue(name=request.form['name'], city=request.form['city'],
                         state=request.form['state'], phone=request.form['phone'],
                         address=request.form['address'],
+                        latitude=latitude, longitude=longitude,
                         genres=genres,
                         facebook_link=request.form['facebook_link'])
 
-    # Debug
-    print(new_venue)
 
     db.session.add(new_venue)
+    db.session.flush()
+    venue_id = new_venue.id
+    record_catalog_change(venue_ids=[venue_id])
     db.session.commit()
+    outbox.wake()
 
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
@@ -261,99 +1004,75 @@ def create_venue_submission():
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  error = False
   try:
     target_venue_record = Venue.query.filter_by(id=venue_id).first()
     db.session.delete(target_venue_record)
+    record_catalog_change(venue_ids=[int(venue_id)], deleted=True)
     db.session.commit()
+    outbox.wake()
   except:
+    error = True
     db.session.rollback()
   finally:
     db.session.close()
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+  return jsonify({'status': 'failed' if error else 'success'})
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@page_cache.cached('artists')
+@db.replica_reads
 def artists():
   # TODO: replace with real data returned from querying the database
-  artists_tuples = Artist.query.all()
-  artists_data = []
-  for artist in artists_tuples:
-    artists_data.append({
-      "id":artist.id,
-      "name":artist.name
-    })
-  return render_template('pages/artists.html', artists=artists_data)
+  artist_query = with_genre(artist_listing_query(), Artist, artist_genre.c.artist_id,
+                            request.args.get('genre'))
+  page = keyset_page(artist_query, ARTIST_SORT, [str, int])
+  artists_data = artist_tiles(page['items'])
+  return render_template('pages/artists.html', artists=artists_data, page=page, genre=request.args.get('genre'))
 
 @app.route('/artists/search', methods=['POST'])
+@db.replica_reads
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  filtered_artists = Artist.query.filter(Artist.name.ilike('%' + request.form['search_term'] + '%')).all()
+  # [DONE]
+  count, found_artists = artist_search.search(request.form.get('search_term', ''),
+                                              tag=request.values.get('genre') or None)
+  num_upcoming_shows = upcoming_counts.artists([artist.id for artist in found_artists])
   search_result = {
-    "count": len(filtered_artists),
-    "data": []
-  }
-  for artist in filtered_artists:
-    upcoming_shows = [show for show in artist.shows if show.start_date > datetime.now()]
-    search_result['data'].append({
+    "count": count,
+    "data": [{
       "id": artist.id,
       "name": artist.name,
-      "num_upcoming_shows": len(upcoming_shows),
-    })
-  response={
-    "count": 1,
-    "data": [{
-      "id": 4,
-      "name": "Guns N Petals",
-      "num_upcoming_shows": 0,
-    }]
+      "num_upcoming_shows": num_upcoming_shows[artist.id],
+    } for artist in found_artists]
   }
-  return render_template('pages/search_artists.html', results=search_result, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=search_result, search_term=request.form.get('search_term', ''),
+                         genre=request.values.get('genre'))
+
+@app.route('/artists/autocomplete')
+@db.replica_reads
+def autocomplete_artists():
+  # search-as-you-type suggestions of the artist search box
+  return suggestions(artist_autocomplete, 'show_artist', 'artist_id')
 
 @app.route('/artists/<int:artist_id>')
+@db.replica_reads
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   target_artist = Artist.query.get(artist_id)
   # render venue data only if venue exsists
   if (target_artist != None):
-    past_shows = []
-    upcoming_shows = []
-    show_data = {}
-    for show in target_artist.shows:
-      show_data = {
-        "venue_id": show.venue.id,
-        "venue_name": show.venue.name,
-        "venue_image_link": show.venue.image_link,
-        "start_time": show.start_date
-      }
-      if show.start_date > datetime.now():
-        upcoming_shows.append(show_data)
-      else:
-        past_shows.append(show_data)
-      #  debug
-      print(show_data['start_time'])
-    target_artist_data = {
-      "id": target_artist.id,
-      "name": target_artist.name,
-      "genres": target_artist.genres.split(','),
-      "city": target_artist.city,
-      "state": target_artist.state,
-      "phone": target_artist.phone,
-      "website": None if target_artist.website_link == '' else target_artist.website,
-      "facebook_link": target_artist.facebook_link,
-      "seeking_venue": target_artist.seeking_venue,
-      "seeking_description": target_artist.seeking_description,
-      "image_link": target_artist.image_link,
-      "past_shows": past_shows,
-      "upcoming_shows": upcoming_shows,
-      "past_shows_count": len(past_shows),
-      "upcoming_shows_count": len(upcoming_shows),
-    }
+    now = datetime.now()
+    target_artist_data = artist_page_data(target_artist, [genre.name for genre in target_artist.genres],
+                                          split_shows(Venue, 'venue', Show.artist_id == artist_id, now),
+                                          show_counts(Show.artist_id == artist_id, now),
+                                          show_history(Venue, 'venue', ShowHistory.artist_id == artist_id))
     return render_template('pages/show_artist.html', artist=target_artist_data)
   # if venue doesn't exist in the database render home page and show corresponding notifications
   else:
@@ -370,7 +1089,7 @@ def edit_artist(artist_id):
     artist_data={
       "id": artist_record.id,
       "name": artist_record.name,
-      "genres": artist_record.genres.split(','),
+      "genres": [genre.name for genre in artist_record.genres],
       "city": artist_record.city,
       "state": artist_record.state,
       "phone":artist_record.phone,
@@ -396,10 +1115,14 @@ def edit_artist_submission(artist_id):
     record.city = request.form['city']
     record.state = request.form['state']
     record.phone = request.form['phone']
-    record.genres = ','.join(request.form.getlist('genres'))
+    record.genres = genres_named(request.form.getlist('genres'))
     record.facebook_link = request.form ['facebook_link']
+    # a genres-only edit leaves the row itself unchanged
+    record.updated_at = datetime.utcnow()
 
+    record_catalog_change(artist_ids=[artist_id])
     db.session.commit()
+    outbox.wake()
   except:
     db.session.rollback()
   finally:
@@ -419,10 +1142,12 @@ def edit_venue(venue_id):
     venue={
       "id": venue_record.id,
       "name": venue_record.name,
-      "genres": venue_record.genres.split(','),
+      "genres": [genre.name for genre in venue_record.genres],
       "address":venue_record.address,
       "city": venue_record.city,
       "state": venue_record.state,
+      "latitude": venue_record.latitude,
+      "longitude": venue_record.longitude,
       "phone":venue_record.phone,
       "website": venue_record.website_link,
       "facebook_link": venue_record.facebook_link,
@@ -441,15 +1166,20 @@ def edit_venue_submission(venue_id):
   try:
     record = Venue.query.get(venue_id)
 
+    record.latitude, record.longitude = venue_location(request.form, record)
     record.name = request.form['name']
     record.city = request.form['city']
     record.state = request.form['state']
     record.address = request.form['address']
     record.phone = request.form['phone']
-    record.genres = ','.join(request.form.getlist('genres'))
+    record.genres = genres_named(request.form.getlist('genres'))
     record.facebook_link = request.form ['facebook_link']
+    # a genres-only edit leaves the row itself unchanged
+    record.updated_at = datetime.utcnow()
 
+    record_catalog_change(venue_ids=[venue_id])
     db.session.commit()
+    outbox.wake()
   except:
     db.session.rollback()
   finally:
@@ -478,15 +1208,17 @@ def create_artist_submission():
     artist_attributes = request.get_json()
     new_artist = Artist(name=artist_attributes['name'], city=artist_attributes['city'],
                         state=artist_attributes['state'], phone=artist_attributes['phone'],
-                        genres=artist_attributes['genres'],
+                        genres=genres_named(artist_attributes['genres'].split(',')),
                         facebook_link=artist_attributes['facebook_link'])
 
-    # Debug
-    print(new_artist)
 
 
     db.session.add(new_artist)
+    db.session.flush()
+    artist_id = new_artist.id
+    record_catalog_change(artist_ids=[artist_id])
     db.session.commit()
+    outbox.wake()
 
     # on successful db insert, flash success
     flash('Artist ' + request.get_json()['name'] + ' was successfully listed!')
@@ -509,60 +1241,17 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@page_cache.cached('shows', 'venues', 'artists')
+@db.replica_reads
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  show_tuples = Show.query.all()
-  shows_data = []
-  for show in show_tuples:
-    shows_data.append(
-      {
-        "venue_id": show.venue_id,
-        "venue_name": show.venue.name,
-        "artist_id": show.artist_id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_date
-      }
-    )
-  data=[{
-    "venue_id": 1,
-    "venue_name": "The Musical Hop",
-    "artist_id": 4,
-    "artist_name": "Guns N Petals",
-    "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "start_time": "2019-05-21T21:30:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 5,
-    "artist_name": "Matt Quevedo",
-    "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "start_time": "2019-06-15T23:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-01T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-08T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-15T20:00:00.000Z"
-  }]
-  return render_template('pages/shows.html', shows=shows_data)
+  # [DONE]
+  query = show_listing_query().filter(*show_window_filters(**show_window()))
+  page = keyset_page(query, SHOW_SORT, [dateutil.parser.parse, int])
+  shows_data = show_tiles(page['items'])
+  return render_template('pages/shows.html', shows=shows_data, page=page)
 
 
 # create show
@@ -579,12 +1268,32 @@ def create_show_submission():
   # TODO: insert form data as a new Show record in the db, instead
   # [DONE]
   try:
-    new_show = Show(venue_id=request.form['venue_id'], artist_id=request.form['artist_id'],
-                    start_date=request.form['start_time'])
-    db.session.add(new_show)
+    start_date = dateutil.parser.parse(request.form['start_time'])
+    show = {'venue_id': int(request.form['venue_id']), 'artist_id': int(request.form['artist_id']),
+            'start_date': start_date, 'end_date': show_end(start_date, request.form.get('duration'))}
+    # refuse a double booking of the venue or the artist; concurrent
+    # submissions for either wait for this transaction
+    lock_bookings(db.session, [('venue', show['venue_id']), ('artist', show['artist_id'])])
+    conflict = booking_conflict(show)
+    if conflict is not None:
+      raise conflict
+    db.session.add(Show(**show))
+    record_catalog_change(new_shows=[(show['venue_id'], show['artist_id'], show['start_date'])])
     db.session.commit()
+    outbox.wake()
     # on successful db insert, flash success
     flash('Show was successfully listed!')
+  except (BookingConflict, IntegrityError) as error:
+    db.session.rollback()
+    # an IntegrityError here may be a concurrent submission that booked the
+    # slot between the check and the commit, caught by the exclusion constraint
+    resource = violated_constraint(error) if isinstance(error, IntegrityError) else None
+    conflict = error if isinstance(error, BookingConflict) else resource and booking_conflict(show, [resource])
+    if conflict is None:
+      flash('An error occurred. Show could not be listed.')
+    else:
+      flash(str(conflict))
+      return render_template('forms/new_show.html', form=ShowForm(request.form)), 409
   except:
     db.session.rollback()
     # TODO: on unsuccessful db insert, flash an error instead.
@@ -594,13 +1303,152 @@ def create_show_submission():
     db.session.close()
   return render_template('pages/home.html')
 
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):kind>')
+def export(kind):
+  # streams the whole table (or, with ?since=, the rows changed since then) as
+  # csv or jsonl, optionally gzipped; X-Next-Since is the ?since= of the next
+  # incremental export, which repeats the rows of the overlap window
+  fmt = request.args.get('format', 'csv')
+  if fmt not in ('csv', 'jsonl'):
+    abort(400)
+  since = None
+  if request.args.get('since'):
+    try:
+      since = dateutil.parser.parse(request.args['since'])
+    except (ValueError, OverflowError):
+      abort(400)
+  next_since = export_next_since(kind)
+  chunks = export_chunks(kind, fmt, since)
+  filename = '%s.%s' % (kind, fmt)
+  mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+  if request.args.get('gzip'):
+    chunks = gzip_chunks(chunks)
+    filename += '.gz'
+    mimetype = 'application/gzip'
+  response = Response(stream_with_context(chunks), mimetype=mimetype)
+  response.headers['Content-Disposition'] = 'attachment; filename=' + filename
+  response.headers['X-Next-Since'] = next_since.isoformat()
+  return response
+
+
+#  API
+#  ----------------------------------------------------------------
+#  JSON mirrors of the read pages. ?fields= selects the fields returned (and
+#  the columns queried); listings page with ?after= / ?before= like the HTML
+#  ones. Responses carry a strong ETag, a matching If-None-Match is answered
+#  with 304 before any query runs.
+
+def entity_api_listing(model, link, fields_available, sort, parsers, counts):
+  fields = api_fields(fields_available + ['num_upcoming_shows'])
+  query = with_genre(entity_api_query(model, link, fields, sort), model, link, request.args.get('genre'))
+  page = keyset_page(query, sort, parsers)
+  num_upcoming_shows = counts([row.id for row in page['items']]) if 'num_upcoming_shows' in fields else {}
+  return api_response({
+    "data": [api_record(row, fields, {'num_upcoming_shows': num_upcoming_shows.get(row.id)})
+             for row in page['items']],
+    "next": page['next_url'],
+    "prev": page['prev_url'],
+  })
+
+def nearby_api_venues(latitude, longitude, radius):
+  # ?near=: the nearest venues first, each with its distance_km; no paging
+  fields = api_fields(VENUE_API_FIELDS + ['num_upcoming_shows', 'distance_km'])
+  distances = {row.id: distance for distance, row in
+               venue_locator.nearby(latitude, longitude, radius, page_size())}
+  rows = entity_api_query(Venue, venue_genre.c.venue_id, fields, [Venue.id]) \
+    .filter(Venue.id.in_(list(distances))).all() if distances else []
+  rows.sort(key=lambda row: (distances[row.id], row.id))
+  num_upcoming_shows = upcoming_counts.venues([row.id for row in rows]) if 'num_upcoming_shows' in fields else {}
+  return api_response({
+    "data": [api_record(row, fields, {'num_upcoming_shows': num_upcoming_shows.get(row.id),
+                                      'distance_km': round(distances[row.id], 3)}) for row in rows],
+    "next": None,
+    "prev": None,
+  })
+
+def entity_api_detail(model, link, fields_available, id, counterpart, prefix, show_filter, history_filter):
+  detail_fields = ['past_shows', 'upcoming_shows', 'archived_shows',
+                   'past_shows_count', 'upcoming_shows_count', 'archived_shows_count']
+  fields = api_fields(fields_available + detail_fields)
+  row = entity_api_query(model, link, fields, [model.id]).filter(model.id == id).first()
+  if row is None:
+    abort(404)
+  extra = {}
+  now = datetime.now()
+  if 'past_shows' in fields or 'upcoming_shows' in fields:
+    extra['past_shows'], extra['upcoming_shows'] = split_shows(counterpart, prefix, show_filter, now)
+  if 'past_shows_count' in fields or 'upcoming_shows_count' in fields:
+    extra['past_shows_count'], extra['upcoming_shows_count'] = show_counts(show_filter, now)
+  # archived shows count as past shows, like on the pages
+  if {'archived_shows', 'archived_shows_count', 'past_shows_count'} & set(fields):
+    extra['archived_shows'], extra['archived_shows_count'] = show_history(counterpart, prefix, history_filter)
+    extra['past_shows_count'] = extra.get('past_shows_count', 0) + extra['archived_shows_count']
+  return api_response({"data": api_record(row, fields, extra)})
+
+@app.route('/api/v1/venues')
+@page_cache.conditional('venues', 'shows', depends_on=upcoming_counts.next_crossing)
+@db.replica_reads
+def api_venues():
+  near = near_args()
+  if near is not None:
+    return nearby_api_venues(*near)
+  return entity_api_listing(Venue, venue_genre.c.venue_id, VENUE_API_FIELDS, VENUE_SORT,
+                            [str, str, str, int], upcoming_counts.venues)
+
+@app.route('/api/v1/venues/<int:venue_id>')
+@page_cache.conditional('venues', 'artists', 'shows', depends_on=upcoming_counts.next_crossing)
+@db.replica_reads
+def api_venue(venue_id):
+  return entity_api_detail(Venue, venue_genre.c.venue_id, VENUE_API_FIELDS, venue_id,
+                           Artist, 'artist', Show.venue_id == venue_id, ShowHistory.venue_id == venue_id)
+
+@app.route('/api/v1/artists')
+@page_cache.conditional('artists', 'shows', depends_on=upcoming_counts.next_crossing)
+@db.replica_reads
+def api_artists():
+  return entity_api_listing(Artist, artist_genre.c.artist_id, ARTIST_API_FIELDS, ARTIST_SORT,
+                            [str, int], upcoming_counts.artists)
+
+@app.route('/api/v1/artists/<int:artist_id>')
+@page_cache.conditional('venues', 'artists', 'shows', depends_on=upcoming_counts.next_crossing)
+@db.replica_reads
+def api_artist(artist_id):
+  return entity_api_detail(Artist, artist_genre.c.artist_id, ARTIST_API_FIELDS, artist_id,
+                           Venue, 'venue', Show.artist_id == artist_id, ShowHistory.artist_id == artist_id)
+
+@app.route('/api/v1/shows')
+@page_cache.conditional('shows', 'venues', 'artists')
+@db.replica_reads
+def api_shows():
+  fields = api_fields(list(SHOW_API_COLUMNS))
+  query = show_api_query(fields).filter(*show_window_filters(**show_window()))
+  page = keyset_page(query, SHOW_SORT, [dateutil.parser.parse, int])
+  return api_response({
+    "data": [api_record(row, fields) for row in page['items']],
+    "next": page['next_url'],
+    "prev": page['prev_url'],
+  })
+
+
+@app.errorhandler(400)
+def bad_request_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': error.description}), 400
+    return error
 
 @app.errorhandler(404)
 def not_found_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'not found'}), 404
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
 def server_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'internal server error'}), 500
     return render_template('errors/500.html'), 500
 
 
@@ -614,6 +1462,607 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 #----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+def explain(query):
+  # the database's plan for `query`, as text
+  statement = query.statement.compile(dialect=db.engine.dialect)
+  params = statement.construct_params()
+  if statement.positional:
+    params = [params[name] for name in statement.positiontup]
+  with db.engine.connect() as connection:
+    with connection.begin():
+      if db.engine.dialect.name == 'postgresql':
+        # a near-empty development table is cheaper to scan than to seek; we want
+        # to know whether the index is usable, not whether it is worth it yet
+        connection.execute('SET LOCAL enable_seqscan = off')
+        plan = connection.execute('EXPLAIN ' + str(statement), params)
+      else:
+        plan = connection.execute('EXPLAIN QUERY PLAN ' + str(statement),
+                                  *params if statement.positional else params)
+      return '\n'.join(str(row[-1]) for row in plan)
+
+@app.cli.command('check-indexes')
+@click.option('--verbose', is_flag=True, help='Print the full plan of every query.')
+def check_indexes(verbose):
+  """Run EXPLAIN on the queries the app issues and check they use their indexes."""
+  now = datetime.now()
+  page_size = app.config['PAGE_SIZE']
+  checks = [
+    ('venues listing', venue_listing_query().order_by(*VENUE_SORT).limit(page_size),
+     ['ix_venue_state_city_name']),
+    ('upcoming shows', upcoming_shows_query(now), ['ix_show_start_date_id']),
+    ('artists listing', artist_listing_query().order_by(*ARTIST_SORT).limit(page_size),
+     ['ix_artist_name_id']),
+    ('shows listing', show_listing_query().order_by(*SHOW_SORT).limit(page_size),
+     ['ix_show_start_date_id']),
+    ('venue page shows', entity_shows_query(Artist, Show.venue_id == 1, now),
+     ['ix_show_venue_id_start_date']),
+    ('venue page counts', show_counts_query(Show.venue_id == 1, now),
+     ['ix_show_venue_id_start_date']),
+    ('artist page shows', entity_shows_query(Venue, Show.artist_id == 1, now),
+     ['ix_show_artist_id_start_date']),
+    ('artist page counts', show_counts_query(Show.artist_id == 1, now),
+     ['ix_show_artist_id_start_date']),
+    ('venue booking check', overlapping(booked_show_query().filter(Show.venue_id == 1), Show.start_date,
+                                        Show.end_date, now, now + MAX_SHOW_DURATION),
+     ['ix_show_venue_id_start_date']),
+    ('artist booking check', overlapping(booked_show_query().filter(Show.artist_id == 1), Show.start_date,
+                                         Show.end_date, now, now + MAX_SHOW_DURATION),
+     ['ix_show_artist_id_start_date']),
+    ('venue page history', history_query(Artist, ShowHistory.venue_id == 1, app.config['SHOW_HISTORY_LIMIT']),
+     ['ix_show_history_venue_id_last_date']),
+    ('artist page history', history_query(Venue, ShowHistory.artist_id == 1, app.config['SHOW_HISTORY_LIMIT']),
+     ['ix_show_history_artist_id_last_date']),
+    ('outbox claim', outbox.due_query(now), ['ix_outbox_pending']),
+  ]
+  if db.engine.dialect.name == 'postgresql':
+    # a B-tree cannot serve a '%term%' match, only the pg_trgm GIN indexes can
+    checks += [
+      ('venue search', db.session.query(Venue.id).filter(Venue.name.ilike('%hop%')),
+       ['ix_venue_name_trgm']),
+      ('artist search', db.session.query(Artist.id).filter(Artist.name.ilike('%band%')),
+       ['ix_artist_name_trgm']),
+      # elsewhere the near queries run on the in-process grid
+      ('venues near', venue_locator.nearby_query(37.7749, -122.4194, app.config['NEAR_RADIUS_KM'], page_size),
+       ['ix_venue_location']),
+    ]
+
+  failed = False
+  for name, query, indexes in checks:
+    plan = explain(query)
+    missing = [index for index in indexes if index not in plan]
+    failed = failed or bool(missing)
+    click.echo('%-20s %s' % (name, 'missing ' + ', '.join(missing) if missing else 'ok'))
+    if verbose or missing:
+      click.echo('  ' + plan.replace('\n', '\n  '))
+  if failed:
+    raise click.ClickException('some queries do not use their indexes')
+
+# bulk import
+# ---------------------------------------------------------------------------------------
+
+def form_data(record, list_fields=()):
+  # a CSV/JSON record as the MultiDict a form POST would carry; list fields may
+  # be JSON arrays or comma-joined CSV cells
+  data = MultiDict()
+  for key, value in record.items():
+    if value is None:
+      continue
+    if key in list_fields:
+      values = value if isinstance(value, list) else str(value).split(',')
+      for item in values:
+        if str(item).strip():
+          data.add(key, str(item).strip())
+    else:
+      data.add(key, str(value))
+  return data
+
+def entity_row(model, form, record):
+  # column values for an insert; the form supplies what the create page asks
+  # for, the record any other column (website_link, seeking_*) and the model
+  # defaults the rest. Every row carries the same keys so a batch goes out as
+  # one executemany; computed defaults (updated_at) are left to the insert.
+  row = {}
+  for column in model.__table__.columns:
+    if column.primary_key or (column.default is not None and column.default.is_callable):
+      continue
+    if column.key in form:
+      value = form[column.key].data
+    else:
+      value = record.get(column.key)
+      if isinstance(column.type, db.Boolean) and isinstance(value, str):
+        value = value.strip().lower() in ('1', 'true', 'yes', 'y')
+    if value in (None, '') and column.default is not None:
+      value = column.default.arg
+    row[column.key] = value
+  return row
+
+def reserve_ids(model, count):
+  # primary keys for a batch, so entity rows and their genre links can both be
+  # inserted with executemany; None where the database cannot hand them out
+  if db.engine.dialect.name != 'postgresql':
+    return None
+  table = model.__table__.name
+  return [id for id, in db.session.execute(
+    "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)",
+    {'table': table, 'count': count})]
+
+def insert_entities(model, link_table, rows, genre_names):
+  ids = reserve_ids(model, len(rows))
+  if ids is None:
+    # one INSERT per row, still in the batch's transaction
+    db.session.bulk_insert_mappings(model, rows, return_defaults=True)
+    ids = [row['id'] for row in rows]
+  else:
+    for id, row in zip(ids, rows):
+      row['id'] = id
+    db.session.execute(model.__table__.insert(), rows)
+  genres = {genre.name: genre for genre in genres_named(sorted(set(sum(genre_names, []))))}
+  db.session.add_all(genres.values())
+  db.session.flush()
+  entity_key, genre_key = [column.key for column in link_table.columns]
+  links = [{entity_key: id, genre_key: genres[name].id}
+           for id, names in zip(ids, genre_names) for name in dict.fromkeys(names)]
+  if links:
+    db.session.execute(link_table.insert(), links)
+
+class ReferenceResolver(object):
+  # venue/artist natural key (name) -> id, memoized in a bounded LRU across batches
+
+  def __init__(self, model, maxsize=100000):
+    self.model = model
+    self.ids = LRUCache(maxsize=maxsize, ttl=0)
+
+  def prefetch(self, names):
+    missing = [name for name in set(names) if name and self.ids.get(name) is None]
+    for offset in range(0, len(missing), 500):
+      found = {}
+      for id, name in db.session.query(self.model.id, self.model.name) \
+          .filter(self.model.name.in_(missing[offset:offset + 500])):
+        found.setdefault(name, []).append(id)
+      for name, ids in found.items():
+        self.ids.set(name, ids[0] if len(ids) == 1 else 'ambiguous')
+
+  def __call__(self, name):
+    return self.ids.get(name)
+
+def resolve_show(record, venues, artists):
+  # fill venue_id/artist_id from venue/artist names; returns an error message or None
+  for key, resolver in [('venue', venues), ('artist', artists)]:
+    if record.get(key + '_id') in (None, '') and record.get(key):
+      id = resolver(record[key])
+      if id is None:
+        return '%s: no %s named %r' % (key, key, record[key])
+      if id == 'ambiguous':
+        return '%s: several %ss are named %r, use %s_id' % (key, key, record[key], key)
+      record[key + '_id'] = id
+  if record.get('start_time'):
+    # accept any unambiguous timestamp (e.g. ISO 8601 from JSON exports)
+    try:
+      start = dateutil.parser.parse(str(record['start_time']))
+      record['start_time'] = start.strftime('%Y-%m-%d %H:%M:%S')
+      if record.get('end_time') and record.get('duration') in (None, ''):
+        # exports carry the end, the form takes a duration
+        end = dateutil.parser.parse(str(record['end_time']))
+        record['duration'] = str(int((end - start).total_seconds() // 60))
+    except (ValueError, OverflowError):
+      pass
+  return None
+
+IMPORT_FORMS = {'venues': VenueForm, 'artists': ArtistForm, 'shows': ShowForm}
+
+def load_batch(kind, batch, resolvers=None):
+  # validate and insert one batch; returns [(line, error message)] of rejected rows
+  rejected = []
+  valid = []
+  for line_number, record in batch:
+    if '__error__' in record:
+      rejected.append((line_number, record['__error__']))
+      continue
+    if kind == 'shows':
+      problem = resolve_show(record, *resolvers)
+      if problem:
+        rejected.append((line_number, problem))
+        continue
+    form = IMPORT_FORMS[kind](formdata=form_data(record, ['genres']), meta={'csrf': False})
+    if not form.validate():
+      rejected.append((line_number, '; '.join('%s: %s' % (field, ', '.join(errors))
+                                             for field, errors in form.errors.items())))
+      continue
+    valid.append((line_number, form, record))
+  if not valid:
+    return rejected
+
+  if kind == 'shows':
+    shows = [(line_number, {'venue_id': int(form.venue_id.data), 'artist_id': int(form.artist_id.data),
+                            'start_date': form.start_time.data,
+                            'end_date': show_end(form.start_time.data, form.duration.data)})
+             for line_number, form, _ in valid]
+    # double bookings, against the booked shows and the earlier rows of the batch
+    lock_bookings(db.session)
+    index = booking_index([show for _, show in shows])
+    rows = []
+    for line_number, show in shows:
+      conflict = None
+      for resource, _, key in BOOKED_RESOURCES:
+        other = index.overlapping((resource, show[key]), show['start_date'], show['end_date'])
+        if other is not None:
+          conflict = 'the %s is already booked at that time by line %d' % (resource, other) \
+            if isinstance(other, int) else str(BookingConflict(resource, other))
+          break
+      if conflict:
+        rejected.append((line_number, conflict))
+        continue
+      for resource, _, key in BOOKED_RESOURCES:
+        index.add((resource, show[key]), show['start_date'], show['end_date'], line_number)
+      rows.append(show)
+    if rows:
+      db.session.execute(Show.__table__.insert(), rows)
+  else:
+    model, link_table = (Venue, venue_genre) if kind == 'venues' else (Artist, artist_genre)
+    rows = [entity_row(model, form, record) for _, form, record in valid]
+    if model is Venue:
+      for row in rows:
+        if row['latitude'] is None or row['longitude'] is None:
+          row['latitude'], row['longitude'] = geocoder.lookup(row['address'], row['city'], row['state']) or (None, None)
+    insert_entities(model, link_table, rows, [form.genres.data for _, form, _ in valid])
+  return rejected
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--errors', 'errors_path', help='Write every rejected row (line, reason) to this file.')
+def import_data(kind, path, fmt, batch_size, errors_path):
+  """Bulk-load venues, artists or shows from a CSV or JSON-lines file ('-' for stdin).
+
+  Rows are validated with the same form rules as the create pages and
+  inserted in batches; a rejected row is reported and skipped, the rest of
+  the load carries on. Shows may reference their venue and artist by id
+  (venue_id, artist_id) or by name (venue, artist).
+  """
+  resolvers = (ReferenceResolver(Venue), ReferenceResolver(Artist))
+  report = ImportReport()
+  errors_file = open_text(errors_path, 'w') if errors_path else None
+
+  with open_text(path) as stream:
+    records = read_records(stream, fmt or guess_format(path))
+    for number, batch in enumerate(batched(records, batch_size), 1):
+      if kind == 'shows':
+        resolvers[0].prefetch([record.get('venue') for _, record in batch])
+        resolvers[1].prefetch([record.get('artist') for _, record in batch])
+      try:
+        rejected = load_batch(kind, batch, resolvers)
+        db.session.commit()
+      except Exception:
+        # a database error fails the whole batch: retry its rows one by one so
+        # only the offending ones are rejected
+        db.session.rollback()
+        rejected = []
+        for row in batch:
+          try:
+            rejected += load_batch(kind, [row], resolvers)
+            db.session.commit()
+          except Exception as error:
+            db.session.rollback()
+            rejected.append((row[0], str(getattr(error, 'orig', error)).strip()))
+      for line_number, message in rejected:
+        report.error(line_number, message)
+        if errors_file:
+          errors_file.write('%d\t%s\n' % (line_number, message))
+      report.loaded += len(batch) - len(rejected)
+      if number % 10 == 0:
+        click.echo(report.summary(), err=True)
+
+  if errors_file:
+    errors_file.close()
+  record_catalog_reload()
+  db.session.commit()
+  for line_number, message in report.errors[:20]:
+    click.echo('line %d: %s' % (line_number, message), err=True)
+  if report.failed > 20:
+    click.echo('... %d more rejected rows' % (report.failed - 20), err=True)
+  click.echo(report.summary())
+
+
+@app.cli.command('export-data')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--since', help='Only rows changed since this UTC timestamp.')
+def export_data(kind, path, fmt, since):
+  """Stream venues, artists or shows to a CSV or JSON-lines file ('-' for stdout, .gz compresses).
+
+  With --since only the rows changed since then are written; the timestamp to
+  pass to the next incremental export is printed when done. Successive
+  exports overlap by EXPORT_OVERLAP_SECONDS, so a row can come twice: keep the
+  latest per id. Deleted rows are not reported, a full export picks them up.
+  """
+  if since:
+    try:
+      since = dateutil.parser.parse(since)
+    except (ValueError, OverflowError):
+      raise click.BadParameter('not a timestamp: %s' % since, param_hint='--since')
+  started = datetime.utcnow()
+  next_since = export_next_since(kind)
+  with open_text(path, 'w') as stream:
+    for chunk in export_chunks(kind, fmt or guess_format(path, 'csv'), since):
+      stream.write(chunk)
+  click.echo('%s exported in %.1fs; next --since %s' % (
+    kind, (datetime.utcnow() - started).total_seconds(), next_since.isoformat()), err=True)
+
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+  """Compile every template into TEMPLATE_CACHE_DIR, for the workers to load at start.
+
+  Run at deploy, after the templates are in place; a template that does not
+  compile fails the command.
+  """
+  if not app.config['TEMPLATE_CACHE_DIR']:
+    raise click.ClickException('TEMPLATE_CACHE_DIR is not set')
+  started = datetime.utcnow()
+  try:
+    names = compile_templates(app)
+  except jinja2.TemplateSyntaxError as error:
+    raise click.ClickException('%s:%s: %s' % (error.name, error.lineno, error.message))
+  click.echo('%d templates compiled into %s in %.2fs' % (
+    len(names), app.config['TEMPLATE_CACHE_DIR'], (datetime.utcnow() - started).total_seconds()))
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove the previous build first.')
+def build_assets(clean):
+  """Bundle, minify, fingerprint and precompress static/ into static/dist.
+
+  Old builds are kept unless --clean is given, so workers still running the
+  previous release can serve the files their pages reference.
+  """
+  started = datetime.utcnow()
+  try:
+    build = assets.build(clean)
+  except BuildError as error:
+    raise click.ClickException(str(error))
+  click.echo('%d files, %d precompressed, %d responsive images built into %s in %.1fs' % (
+    len(build.files), len(build.encodings), len(build.srcset), build.output,
+    (datetime.utcnow() - started).total_seconds()))
+
+# venue locations
+# ---------------------------------------------------------------------------------------
+
+@app.cli.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True, help='Also relocate the venues that have coordinates.')
+@click.option('--table', help='Geocoding table to read (default: GEOCODE_TABLE).')
+@click.option('--batch-size', default=1000, show_default=True)
+def geocode_venues(everything, table, batch_size):
+  """Fill in venue coordinates from the offline geocoding table.
+
+  Venues are matched on address, city and state, then on city and state. The
+  ones the table does not know keep no coordinates and are counted.
+  """
+  table = GeocodeTable(table) if table else geocoder
+  started = datetime.utcnow()
+  query = db.session.query(Venue.id, Venue.address, Venue.city, Venue.state)
+  if not everything:
+    query = query.filter(db.or_(Venue.latitude.is_(None), Venue.longitude.is_(None)))
+  updates, unknown = [], 0
+  for row in query.yield_per(batch_size):
+    location = table.lookup(row.address, row.city, row.state)
+    if location is None:
+      unknown += 1
+    else:
+      updates.append({'venue_id': row.id, 'latitude': location[0], 'longitude': location[1]})
+  statement = Venue.__table__.update() \
+    .where(Venue.id == db.bindparam('venue_id')) \
+    .values(latitude=db.bindparam('latitude'), longitude=db.bindparam('longitude'), updated_at=datetime.utcnow())
+  for batch in batched(updates, batch_size):
+    db.session.execute(statement, batch)
+  record_catalog_reload()
+  db.session.commit()
+  click.echo('%d venues located, %d not in the table (%d places) in %.1fs' % (
+    len(updates), unknown, len(table), (datetime.utcnow() - started).total_seconds()))
+
+# show partitions
+# ---------------------------------------------------------------------------------------
+
+def month_arg(value):
+  try:
+    return datetime.strptime(value, '%Y-%m')
+  except ValueError:
+    raise click.BadParameter('expected YYYY-MM, got %r' % value)
+
+def partitioned_connection():
+  connection = db.engine.connect()
+  if not partitions.is_partitioned(connection):
+    connection.close()
+    raise click.ClickException('the show table is not partitioned (Postgres, after migration 3f1c8a9d6e27)')
+  return connection
+
+@app.cli.group('partitions')
+def partitions_command():
+  """Monthly partitions of the show table (Postgres)."""
+
+@partitions_command.command('list')
+def list_partitions():
+  """List the attached month partitions."""
+  connection = partitioned_connection()
+  try:
+    for month, name in sorted(partitions.month_partitions(connection).items()):
+      click.echo('%s %s' % (month.strftime('%Y-%m'), name))
+  finally:
+    connection.close()
+
+@partitions_command.command('create')
+@click.option('--ahead', default=12, show_default=True, help='Months after the current one to create.')
+def create_partitions(ahead):
+  """Create the month partitions through --ahead months from now.
+
+  Run it monthly (or from the deploy): shows past the last month partition
+  land in show_default, which every query has to scan. Rows already in the
+  default partition move to their new month.
+  """
+  through = partitions.month_of(datetime.utcnow())
+  for _ in range(ahead):
+    through = partitions.next_month(through)
+  connection = partitioned_connection()
+  try:
+    with connection.begin():
+      created = partitions.create_partitions(connection, through)
+  finally:
+    connection.close()
+  click.echo('%d partitions created through %s' % (len(created), through.strftime('%Y-%m')))
+
+@partitions_command.command('detach')
+@click.option('--before', required=True, help='Detach the months before this one (YYYY-MM).')
+@click.option('--schema', help='Move the detached tables to this schema.')
+@click.option('--tablespace', help='Move the detached tables to this tablespace.')
+def detach_partitions(before, schema, tablespace):
+  """Detach the past month partitions from show, to archive them.
+
+  Their shows are summed into show_history first, like `flask archive-shows`
+  does, so the pages keep counting them. The tables themselves stay, as plain
+  tables in --schema / --tablespace, to be dumped or dropped; attaching one
+  again would count its shows twice.
+  """
+  before = month_arg(before)
+  if before > partitions.month_of(datetime.utcnow()):
+    raise click.BadParameter('only past months can be detached', param_hint='--before')
+  connection = partitioned_connection()
+  try:
+    with connection.begin():
+      archived, detached = archive_shows(connection, before, keep=True, schema=schema, tablespace=tablespace)
+      record_catalog_reload(connection)
+  except ValueError as error:
+    raise click.BadParameter(str(error))
+  finally:
+    connection.close()
+  for name in detached:
+    click.echo('detached %s' % name)
+  click.echo('%d partitions detached, %d shows archived' % (len(detached), archived))
+
+# show archival
+# ---------------------------------------------------------------------------------------
+
+# merges the shows that started before :before into show_history, one row per
+# venue and artist pair; {0}/{1} are the dialect's two-argument min and max
+HISTORY_MERGE = """
+  INSERT INTO show_history (venue_id, artist_id, shows, first_date, last_date)
+  SELECT venue_id, artist_id, count(*), min(start_date), max(start_date) FROM show
+  WHERE start_date < :before AND venue_id IS NOT NULL AND artist_id IS NOT NULL
+  GROUP BY venue_id, artist_id
+  ON CONFLICT (venue_id, artist_id) DO UPDATE SET
+    shows = show_history.shows + excluded.shows,
+    first_date = {0}(show_history.first_date, excluded.first_date),
+    last_date = {1}(show_history.last_date, excluded.last_date)
+"""
+
+def archive_shows(connection, before, keep=False, schema=None, tablespace=None):
+  # moves the shows that started before `before` into show_history, within the
+  # caller's transaction; returns (shows archived, month partitions detached).
+  # on a partitioned table the months entirely before `before` are detached
+  # (and dropped, unless kept or moved), the rest of the shows are deleted.
+  # shows without a venue or an artist have no history row to go to, so they
+  # are refused rather than deleted uncounted
+  orphans = connection.execute(db.select([db.func.count()]).where(
+    db.and_(Show.start_date < before, db.or_(Show.venue_id.is_(None), Show.artist_id.is_(None))))).scalar()
+  if orphans:
+    raise ValueError('%d shows before %s have no venue or no artist; delete them or set both first'
+                     % (orphans, before.strftime('%Y-%m-%d')))
+  archived = connection.execute(db.select([db.func.count()]).where(Show.start_date < before)).scalar()
+  functions = ('least', 'greatest') if connection.dialect.name == 'postgresql' else ('min', 'max')
+  connection.execute(db.text(HISTORY_MERGE.format(*functions)), before=before)
+  detached = []
+  if partitions.is_partitioned(connection):
+    detached = partitions.detach_partitions(connection, before, schema, tablespace)
+    if not (keep or schema or tablespace):
+      for name in detached:
+        connection.execute('DROP TABLE %s' % name)
+  connection.execute(Show.__table__.delete().where(Show.start_date < before))
+  return archived, detached
+
+@app.cli.command('archive-shows')
+@click.option('--before', help='Archive the shows that started before this date '
+                               '(default: SHOW_ARCHIVE_AFTER_DAYS days ago).')
+@click.option('--schema', help='Postgres: keep the detached month partitions in this schema instead of dropping them.')
+@click.option('--tablespace', help='Postgres: keep the detached month partitions in this tablespace.')
+def archive_shows_command(before, schema, tablespace):
+  """Move past shows into the show_history summary.
+
+  Each venue and artist pair keeps one history row (number of shows, first
+  and last date), which the detail pages and the API list under their live
+  past shows and add to past_shows_count. Run it periodically (fab archive):
+  the pages then only read a bounded window of shows, however many years are
+  kept. Archived shows are no longer exported.
+  """
+  if before:
+    try:
+      before = dateutil.parser.parse(before)
+    except (ValueError, OverflowError):
+      raise click.BadParameter('not a date: %r' % before, param_hint='--before')
+  else:
+    before = datetime.now() - timedelta(days=app.config['SHOW_ARCHIVE_AFTER_DAYS'])
+  if before > datetime.now():
+    raise click.BadParameter('only past shows can be archived', param_hint='--before')
+  started = datetime.utcnow()
+  connection = db.engine.connect()
+  try:
+    with connection.begin():
+      archived, detached = archive_shows(connection, before, schema=schema, tablespace=tablespace)
+      record_catalog_reload(connection)
+  except ValueError as error:
+    raise click.BadParameter(str(error))
+  finally:
+    connection.close()
+  click.echo('%d shows before %s archived (%d month partitions detached) in %.1fs' % (
+    archived, before.strftime('%Y-%m-%d %H:%M'), len(detached), (datetime.utcnow() - started).total_seconds()))
+
+# outbox
+# ---------------------------------------------------------------------------------------
+
+@app.cli.group('outbox')
+def outbox_command():
+  """Post-write events of the outbox table."""
+
+@outbox_command.command('status')
+def outbox_status():
+  """Count the pending events per topic and list the latest abandoned ones."""
+  pending = outbox.pending()
+  for topic, (due, waiting) in sorted(pending.items()):
+    click.echo('%-20s %d due, %d waiting for a retry' % (topic, due, waiting))
+  if not pending:
+    click.echo('no pending events')
+  for key, topic, attempts, done_at, error in outbox.abandoned():
+    click.echo('abandoned %s after %d attempts at %s: %s' % (key, attempts, done_at.isoformat(' '), error))
+
+@outbox_command.command('drain')
+@click.option('--limit', type=int, help='Stop after this many events.')
+def drain_outbox(limit):
+  """Run the due events now, in this process.
+
+  The web processes run them in their worker threads; this is for a
+  deployment with OUTBOX_WORKERS=0 or to catch up after an outage.
+  """
+  started = datetime.utcnow()
+  handled = outbox.drain(limit)
+  click.echo('%d events run in %.1fs' % (handled, (datetime.utcnow() - started).total_seconds()))
+
+@outbox_command.command('retry')
+@click.option('--key', 'keys', multiple=True, help='Retry only this event (repeatable).')
+def retry_outbox(keys):
+  """Make abandoned events due again."""
+  click.echo('%d events due again' % outbox.retry(keys))
+
+@outbox_command.command('prune')
+@click.option('--days', type=int, help='Keep the events handled in the last DAYS days '
+                                       '(default: OUTBOX_RETENTION_DAYS).')
+def prune_outbox(days):
+  """Delete the handled events; abandoned ones are kept."""
+  days = app.config['OUTBOX_RETENTION_DAYS'] if days is None else days
+  click.echo('%d events deleted' % outbox.prune(datetime.utcnow() - timedelta(days=days)))
+
+#----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
@@ -0,0 +1,361 @@
+"""ASGI entry point serving the catalog read pages on an async database driver.
+
+    hypercorn -w 4 asgi:application
+
+The listing and detail pages (``venues``, ``show_venue``, ``artists``,
+``show_artist``, ``shows``) are answered by async views. They build the same
+queries as app.py, run the statements through ``databases`` (asyncpg on
+Postgres, aiosqlite on SQLite) and render app.py's templates, so a request
+waiting on the database holds no worker thread. Every other request -- forms,
+writes, searches, the API, ``/venues?near=`` -- is passed to the WSGI app
+unchanged.
+
+The async views go through the same layers as the Flask ones: the page cache
+(a hit is answered before anything is awaited), the replica routing of
+``db.replica_reads`` (one ``Database`` per bind) and the request hooks, so
+the instrumentation counts their statements and the session is saved. The
+async views run a fixed set of statements each, so their statements are
+counted and timed but left out of the N+1 check.
+
+Flask keeps its context stacks per thread, and every request on the event
+loop shares one thread. Each request therefore builds its Flask contexts once
+(``FlaskContext``) and enters them around the synchronous steps of its view,
+never across an ``await``; ``g``, the session and the request stats carry
+over from one step to the next.
+"""
+import asyncio
+import io
+import sys
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+from functools import wraps
+
+import dateutil.parser
+from asgiref.wsgi import WsgiToAsgi
+from databases import Database
+from flask import flash, g, render_template, request, request_started
+from werkzeug.exceptions import HTTPException
+
+from app import (app, db, instrumentation, page_cache, Artist, Genre, Show, ShowHistory, Venue, artist_genre,
+                 venue_genre, ARTIST_SORT, SHOW_SORT, VENUE_SORT, artist_listing_query, artist_page_data,
+                 artist_tiles, entity_shows_query, history_query, keyset_query, keyset_result, show_counts_query,
+                 show_listing_query, show_tiles, show_window, show_window_filters, split_counts, split_history_rows,
+                 split_show_rows, upcoming_counts, venue_areas, venue_listing_query, venue_page_data, with_genre)
+
+
+def async_database_url(url):
+    # databases picks its driver from the scheme and only knows 'postgresql'
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def async_database(url):
+    if url.startswith('sqlite'):
+        return Database(url)
+    return Database(async_database_url(url), min_size=1,
+                    max_size=app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pool_size', 10))
+
+
+# the primary (None) and the replica binds of db.replica_reads
+databases = {None: async_database(app.config['SQLALCHEMY_DATABASE_URI'])}
+databases.update({bind: async_database(app.config['SQLALCHEMY_BINDS'][bind]) for bind in db.replica_binds(app)})
+# statements running per bind, the load of DB_REPLICA_SELECTION=least_loaded
+in_flight = Counter()
+
+
+def wsgi_environ(scope):
+    # the PEP 3333 environ of a bodiless ASGI HTTP request
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info[len(script_name):] if path_info.startswith(script_name) else path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def rows_of(records):
+    # attribute and index access, like the rows of a Query
+    if not records:
+        return []
+    Row = namedtuple('Row', list(records[0].keys()), rename=True)
+    return [Row(*[record[key] for key in record.keys()]) for record in records]
+
+
+class FlaskContext(object):
+    """The Flask app and request contexts of one ASGI request.
+
+    Entered with ``with`` around each synchronous step of an async view;
+    ``database`` is the ``Database`` its statements run on.
+    """
+
+    def __init__(self, scope):
+        self.app_context = app.app_context()
+        self.request_context = app.request_context(wsgi_environ(scope))
+        self.database = databases[None]
+        self.bind = None
+        self.stats = None
+
+    def __enter__(self):
+        self.app_context.push()
+        self.request_context.push()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.request_context.pop()
+        self.app_context.pop()
+
+    async def run(self, method, query):
+        statement = query.statement
+        in_flight[self.bind] += 1
+        started = time.perf_counter()
+        try:
+            return await getattr(self.database, method)(statement)
+        finally:
+            in_flight[self.bind] -= 1
+            if self.stats is not None:
+                # without its SQL: databases compiles the statement itself, and
+                # compiling it a second time would cost more than running it
+                instrumentation.count_statement(self.stats, None, time.perf_counter() - started)
+
+    async def fetch_all(self, query):
+        return rows_of(await self.run('fetch_all', query))
+
+    async def fetch_one(self, query):
+        record = await self.run('fetch_one', query)
+        return rows_of([record])[0] if record is not None else None
+
+
+async def in_app_thread(function, *args):
+    # app.py code that may still run a blocking query (the upcoming-count
+    # reload), off the event loop
+    def call():
+        with app.app_context():
+            return function(*args)
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+def cached(*tags):
+    """``page_cache.cached`` for the async views."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(context, **kwargs):
+            with context:
+                key = page_cache.key(tags) if page_cache.cacheable() else None
+                hit = page_cache.fetch(key) if key else None
+                if key is not None and hit is None:
+                    page_cache.on_miss()
+            if hit is not None:
+                return hit
+            response = await view(context, **kwargs)
+            if key is None:
+                return response
+            with context:
+                return page_cache.store(key, app.make_response(response))
+        return wrapper
+    return decorator
+
+
+def replica_reads(view):
+    """``db.replica_reads`` for the async views: the statements go to the bind's ``Database``."""
+    @wraps(view)
+    async def wrapper(context, **kwargs):
+        with context:
+            context.bind = db.choose_replica(app, load=in_flight.__getitem__)
+            g._db_route = context.bind or 'primary'
+            context.stats = g.get('_request_stats')
+        context.database = databases[context.bind]
+        if context.database.url.dialect != 'sqlite':
+            return await view(context, **kwargs)
+        # the SQLite backend opens a connection (and its thread) per acquire,
+        # and SQLite runs one statement at a time anyway: one per request
+        async with context.database.connection():
+            return await view(context, **kwargs)
+    return wrapper
+
+
+@cached('venues', 'shows')
+@replica_reads
+async def venues(context):
+    with context:
+        genre = request.args.get('genre')
+        query = keyset_query(with_genre(venue_listing_query(), Venue, venue_genre.c.venue_id, genre),
+                             VENUE_SORT, [str, str, str, int])
+    rows = await context.fetch_all(query)
+    num_upcoming_shows = await in_app_thread(upcoming_counts.venues, [row.id for row in rows])
+    with context:
+        page = keyset_result(rows, VENUE_SORT)
+        return render_template('pages/venues.html', areas=venue_areas(page['items'], num_upcoming_shows),
+                               page=page, genre=genre)
+
+
+@cached('artists')
+@replica_reads
+async def artists(context):
+    with context:
+        genre = request.args.get('genre')
+        query = keyset_query(with_genre(artist_listing_query(), Artist, artist_genre.c.artist_id, genre),
+                             ARTIST_SORT, [str, int])
+    rows = await context.fetch_all(query)
+    with context:
+        page = keyset_result(rows, ARTIST_SORT)
+        return render_template('pages/artists.html', artists=artist_tiles(page['items']), page=page, genre=genre)
+
+
+@cached('shows', 'venues', 'artists')
+@replica_reads
+async def shows(context):
+    with context:
+        query = keyset_query(show_listing_query().filter(*show_window_filters(**show_window())),
+                             SHOW_SORT, [dateutil.parser.parse, int])
+    rows = await context.fetch_all(query)
+    with context:
+        page = keyset_result(rows, SHOW_SORT)
+        return render_template('pages/shows.html', shows=show_tiles(page['items']), page=page)
+
+
+async def entity_page(context, model, link, id, counterpart, prefix, show_filter, history_filter, template,
+                      page_data, missing):
+    # the five statements of a detail page, run concurrently; `prefix` names
+    # the counterpart, as in split_shows()
+    with context:
+        now = datetime.now()
+        statements = [
+            db.session.query(model).filter(model.id == id),
+            db.session.query(Genre.name).join(link.table, link.table.c.genre_id == Genre.id)
+              .filter(link == id).order_by(Genre.name),
+            entity_shows_query(counterpart, show_filter, now),
+            show_counts_query(show_filter, now),
+            history_query(counterpart, history_filter, app.config['SHOW_HISTORY_LIMIT']),
+        ]
+    entity, genres, show_rows, counts, history_rows = await asyncio.gather(
+        context.fetch_one(statements[0]), context.fetch_all(statements[1]), context.fetch_all(statements[2]),
+        context.fetch_one(statements[3]), context.fetch_all(statements[4]))
+    with context:
+        if entity is None:
+            flash(missing)
+            return render_template('pages/home.html')
+        data = page_data(entity, [row.name for row in genres], split_show_rows(show_rows, prefix),
+                         split_counts(*counts), split_history_rows(history_rows, prefix))
+        return render_template(template, **{model.__tablename__: data})
+
+
+@replica_reads
+async def show_venue(context, venue_id):
+    return await entity_page(context, Venue, venue_genre.c.venue_id, venue_id, Artist, 'artist',
+                             Show.venue_id == venue_id, ShowHistory.venue_id == venue_id,
+                             'pages/show_venue.html', venue_page_data,
+                             'The Venue with id:' + str(venue_id) + ' Doesnot Exist')
+
+
+@replica_reads
+async def show_artist(context, artist_id):
+    return await entity_page(context, Artist, artist_genre.c.artist_id, artist_id, Venue, 'venue',
+                             Show.artist_id == artist_id, ShowHistory.artist_id == artist_id,
+                             'pages/show_artist.html', artist_page_data,
+                             'The Artist with id:' + str(artist_id) + ' Doesnot Exist')
+
+
+ASYNC_VIEWS = {view.__name__: view for view in [venues, show_venue, artists, show_artist, shows]}
+
+# query arguments whose variant of a page stays with the Flask view
+SYNC_ARGUMENTS = {'venues': [b'near']}
+
+wsgi = WsgiToAsgi(app)
+urls = app.url_map.bind('')
+
+
+def async_route(scope):
+    # (view, arguments) of a request for an async view, or None
+    if scope['method'] not in ('GET', 'HEAD'):
+        return None
+    try:
+        endpoint, arguments = urls.match(scope['path'], method='GET')
+    except HTTPException:
+        return None
+    names = {pair.split(b'=', 1)[0] for pair in scope.get('query_string', b'').split(b'&')}
+    if endpoint not in ASYNC_VIEWS or names.intersection(SYNC_ARGUMENTS.get(endpoint, ())):
+        return None
+    return ASYNC_VIEWS[endpoint], arguments
+
+
+async def dispatch(context, view, arguments):
+    # Flask.full_dispatch_request and the error handling of Flask.wsgi_app,
+    # around an async view
+    try:
+        try:
+            with context:
+                request_started.send(app)
+                response = app.preprocess_request()
+            if response is None:
+                response = await view(context, **arguments)
+        except Exception as error:
+            with context:
+                response = app.handle_user_exception(error)
+        with context:
+            return app.finalize_request(response)
+    except Exception as error:
+        with context:
+            return app.handle_exception(error)
+
+
+async def serve(scope, send, view, arguments):
+    response = await dispatch(FlaskContext(scope), view, arguments)
+    body = response.get_data() if scope['method'] != 'HEAD' else b''
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                    for name, value in response.headers.to_wsgi_list()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+    response.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            for database in databases.values():
+                await database.connect()
+            # the outbox workers and listener, which the WSGI app starts on its
+            # first request; a process may only ever serve async views
+            with app.app_context():
+                app.try_trigger_before_first_request_functions()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for database in databases.values():
+                await database.disconnect()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    route = async_route(scope) if scope['type'] == 'http' else None
+    if route is None:
+        return await wsgi(scope, receive, send)
+    await serve(scope, send, *route)
@@ -0,0 +1,275 @@
+"""Static asset build and serving.
+
+``flask build-assets`` writes a build of ``static/`` to ``static/dist/``:
+
+* the CSS and JS of the layout are concatenated into the ``BUNDLES`` and
+  minified (``rcssmin``/``rjsmin``, keeping the ``/*! license */`` comments);
+* every file gets a content hash in its name (``site.3f9c2a1b0d4e.css``),
+  and ``url()`` references inside CSS are rewritten to the hashed names;
+* text files are precompressed next to the original (``.gz`` and ``.br``);
+* the ``RESPONSIVE_IMAGES`` are resized to each width and saved as JPEG and
+  WebP (with Pillow);
+* ``manifest.json`` maps each source name to its hashed build name. It is
+  written last, so a running app never sees half a build.
+
+``brotli`` and Pillow are in requirements.txt. The build stops with
+``BuildError`` when one is missing, rather than leaving out the ``.br`` files
+or the responsive images.
+
+``Assets(app)`` loads the manifest (when ``ASSETS_BUILD`` is on) and makes
+``url_for('static', filename=...)`` point at the hashed files. The
+``asset_urls(bundle)`` template global returns the bundle, or its member files
+when there is no build. ``asset_srcset(image)`` returns the responsive
+variants. Hashed files are served with far-future immutable caching, and in
+their precompressed form when the client accepts it.
+"""
+import gzip
+import hashlib
+import importlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+from flask import request, send_from_directory, url_for
+
+OUTPUT = 'dist'
+MANIFEST = 'manifest.json'
+
+# the layout's stylesheets and scripts, in page order; js/site.js replaces the
+# deferred scripts, so it runs after jQuery like they did
+BUNDLES = {
+    'css/site.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+                     'css/main.responsive.css', 'css/main.quickfix.css'],
+    'js/head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    'js/site.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js'],
+}
+# widths (px) of the resized copies; widths above the original's are skipped
+RESPONSIVE_IMAGES = {
+    'img/front-splash.jpg': [640, 1280, 1920, 2560],
+}
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.eot', '.ttf', '.otf')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_css_urls = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+class BuildError(Exception):
+    pass
+
+
+def _require(module, package):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise BuildError('the asset build needs %s (pip install -r requirements.txt)' % package)
+
+
+def fingerprint(name, content):
+    base, extension = posixpath.splitext(name)
+    return '%s.%s%s' % (base, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+class Build(object):
+    """One run of the asset build from `source` (the static folder)."""
+
+    def __init__(self, source, url_path):
+        self.source = source
+        self.output = os.path.join(source, OUTPUT)
+        self.url_path = url_path
+        self.files = {}
+        self.srcset = {}
+        self.encodings = {}
+
+    def run(self, clean=False):
+        # before anything is written: no build without its .br files and images
+        self._brotli = _require('brotli', 'brotli')
+        self._image = _require('PIL.Image', 'Pillow')
+        if clean and os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        os.makedirs(self.output, exist_ok=True)
+        names = self._source_files()
+        # stylesheets last, so their url() references resolve to hashed names
+        for name in sorted(names, key=lambda name: name.endswith('.css')):
+            with open(os.path.join(self.source, name), 'rb') as source:
+                content = source.read()
+            if name.endswith('.css'):
+                content = self._rewrite_css(name, content.decode('utf-8')).encode('utf-8')
+            self._write(name, content)
+        for bundle, members in BUNDLES.items():
+            self._write(bundle, self._bundle(bundle, members))
+        self._images()
+        self._write_manifest()
+        return self
+
+    def _source_files(self):
+        names = []
+        for directory, subdirectories, files in os.walk(self.source):
+            if directory == self.source and OUTPUT in subdirectories:
+                subdirectories.remove(OUTPUT)
+            for filename in files:
+                if not filename.startswith('.'):
+                    path = os.path.relpath(os.path.join(directory, filename), self.source)
+                    names.append(path.replace(os.sep, '/'))
+        return names
+
+    def _write(self, name, content):
+        hashed = fingerprint(name, content)
+        path = os.path.join(self.output, *hashed.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as built:
+            built.write(content)
+        self.files[name] = hashed
+        self._precompress(hashed, path, content)
+        return hashed
+
+    def _precompress(self, hashed, path, content):
+        if not hashed.endswith(COMPRESSIBLE) or len(content) < 1024:
+            return
+        encodings = []
+        compressed = gzip.compress(content, 9, mtime=0)
+        if len(compressed) < len(content):
+            with open(path + '.gz', 'wb') as variant:
+                variant.write(compressed)
+            encodings.append('gzip')
+        compressed = self._brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            with open(path + '.br', 'wb') as variant:
+                variant.write(compressed)
+            encodings.append('br')
+        if encodings:
+            self.encodings[hashed] = encodings
+
+    def _rewrite_css(self, name, css):
+        # relative url()s point at their hashed build names, as absolute URLs
+        # so they stay valid from any output directory
+        def rewrite(match):
+            quote, reference = match.groups()
+            reference = reference.strip()
+            if re.match(r'(?:[a-z]+:|/|#)', reference):
+                return match.group(0)
+            # keep the '?#iefix' / '#font-id' suffixes of the font references
+            split = re.search(r'[?#]', reference)
+            path, suffix = (reference[:split.start()], reference[split.start():]) if split else (reference, '')
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+            if target in self.files:
+                target = OUTPUT + '/' + self.files[target]
+            return 'url(%s%s/%s%s%s)' % (quote, self.url_path, target, suffix, quote)
+        return _css_urls.sub(rewrite, css)
+
+    def _bundle(self, bundle, members):
+        parts = []
+        for member in members:
+            with open(os.path.join(self.source, member), encoding='utf-8') as source:
+                content = source.read()
+            if bundle.endswith('.css'):
+                parts.append(self._rewrite_css(member, content))
+            else:
+                parts.append(content)
+        if bundle.endswith('.css'):
+            import rcssmin
+            return rcssmin.cssmin('\n'.join(parts), keep_bang_comments=True).encode('utf-8')
+        import rjsmin
+        # members end without a newline or a semicolon often enough
+        return ';\n'.join(rjsmin.jsmin(part, keep_bang_comments=True).rstrip().rstrip(';') for part in parts).encode('utf-8') + b';\n'
+
+    def _images(self):
+        Image = self._image
+        for name, widths in RESPONSIVE_IMAGES.items():
+            original = Image.open(os.path.join(self.source, name))
+            original.load()
+            base = posixpath.splitext(name)[0]
+            variants = {'image/webp': [], 'image/jpeg': []}
+            for width in [width for width in widths if width < original.width] or [original.width]:
+                image = original.resize((width, round(original.height * width / original.width)), Image.LANCZOS)
+                for mimetype, extension, options in [
+                        ('image/webp', 'webp', {'quality': 80, 'method': 6}),
+                        ('image/jpeg', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True})]:
+                    variant = tempfile.SpooledTemporaryFile()
+                    image.convert('RGB').save(variant, extension.replace('jpg', 'jpeg'), **options)
+                    variant.seek(0)
+                    variant_name = '%s-%dw.%s' % (base, width, extension)
+                    variants[mimetype].append((self._write(variant_name, variant.read()), width))
+            self.srcset[name] = variants
+
+    def _write_manifest(self):
+        manifest = {'files': self.files, 'srcset': self.srcset, 'encodings': self.encodings}
+        descriptor, temporary = tempfile.mkstemp(dir=self.output)
+        with os.fdopen(descriptor, 'w') as built:
+            json.dump(manifest, built, indent=1, sort_keys=True)
+        os.replace(temporary, os.path.join(self.output, MANIFEST))
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self.files = {}
+        self.srcsets = {}
+        self.encodings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_BUILD', True)
+        self.app = app
+        if app.config['ASSETS_BUILD']:
+            self.load()
+        app.url_defaults(self._hashed_filename)
+        app.view_functions['static'] = self.send_static
+        app.jinja_env.globals.update(asset_urls=self.urls, asset_srcset=self.srcset)
+
+    def load(self):
+        try:
+            with open(os.path.join(self.app.static_folder, OUTPUT, MANIFEST)) as manifest:
+                manifest = json.load(manifest)
+        except (OSError, ValueError):
+            return False
+        self.files = manifest['files']
+        self.srcsets = manifest['srcset']
+        self.encodings = manifest['encodings']
+        return True
+
+    def build(self, clean=False):
+        build = Build(self.app.static_folder, self.app.static_url_path).run(clean)
+        if self.app.config['ASSETS_BUILD']:
+            self.load()
+        return build
+
+    def urls(self, bundle):
+        """URLs of a bundle: the built file, or its members without a build."""
+        if bundle in self.files:
+            return [url_for('static', filename=bundle)]
+        return [url_for('static', filename=member) for member in BUNDLES[bundle]]
+
+    def srcset(self, name):
+        """[(mimetype, srcset)] of the resized copies of an image; [] without a build."""
+        return [(mimetype, ', '.join('%s %dw' % (url_for('static', filename=OUTPUT + '/' + hashed), width)
+                                     for hashed, width in variants))
+                for mimetype, variants in sorted(self.srcsets.get(name, {}).items(), reverse=True)]
+
+    def _hashed_filename(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = OUTPUT + '/' + self.files[values['filename']]
+
+    def send_static(self, filename):
+        # hashed names never change content: cache them for good, and send the
+        # precompressed variant the client accepts
+        hashed = filename[len(OUTPUT) + 1:] if filename.startswith(OUTPUT + '/') else None
+        if hashed is None or hashed == MANIFEST:
+            return self.app.send_static_file(filename)
+        encoding = next((encoding for encoding in ('br', 'gzip')
+                         if encoding in self.encodings.get(hashed, ()) and request.accept_encodings[encoding]), None)
+        if encoding is None:
+            response = send_from_directory(self.app.static_folder, filename)
+        else:
+            response = send_from_directory(self.app.static_folder, filename + ('.br' if encoding == 'br' else '.gz'),
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+        if self.encodings.get(hashed):
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.headers.pop('Expires', None)
+        return response
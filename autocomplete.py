@@ -0,0 +1,195 @@
+"""Search-as-you-type suggestions of venue and artist names.
+
+Each worker keeps the names of one model in sorted arrays and answers a
+prefix with two binary searches (``bisect``), so a suggestion never reaches
+the database. A name is filed under its whole text and under each later word
+(``"the musical hop"``, ``"musical hop"``, ``"hop"``). Suggestions list the
+names starting with the prefix first, then names with a later word starting
+with it, alphabetically.
+
+Memory is bounded by ``max_entries`` keys per index, each cut to
+``key_length`` characters. A catalog with more keys than that is indexed up
+to the bound, and the prefixes the index cannot fully answer fall back to a
+``name ILIKE 'prefix%'`` query (served by the pg_trgm index on Postgres).
+Like the trigram index of search.py, the index is built on first use and
+kept current with ``reindex``/``remove``. Like the upcoming counts, it is
+also rebuilt every ``max_age`` seconds, so a change this process was not
+told about (a missed event, a write outside the app) does not last.
+"""
+import time
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+from search import like_escape
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def name_keys(name, words, key_length):
+    # the name from each of its first `words` word starts
+    name = normalize(name)
+    if not name:
+        return []
+    keys, start = [], 0
+    while start >= 0 and len(keys) < words:
+        keys.append(name[start:start + key_length])
+        start = name.find(' ', start)
+        if start >= 0:
+            start += 1
+    return keys
+
+
+class PrefixIndex(object):
+    """Sorted (key, id) arrays: name starts and later-word starts."""
+
+    def __init__(self, max_entries=200000, key_length=32, words=4):
+        self.max_entries = max_entries
+        self.key_length = key_length
+        self.words = words
+        self.names = {}
+        # [keys, ids] of whole names and of later words
+        self.starts = [[], []]
+        self.inner = [[], []]
+        self.entries = 0
+        # False once a name was left out for the bound
+        self.complete = True
+
+    def __len__(self):
+        return len(self.names)
+
+    def _file(self, id, name):
+        # the keys of a name, if it fits in the bound
+        keys = name_keys(name, self.words, self.key_length)
+        if self.entries + len(keys) > self.max_entries:
+            self.complete = False
+            return []
+        self.names[id] = (name, keys)
+        self.entries += len(keys)
+        return keys
+
+    def load(self, rows):
+        # bulk build from (id, name) rows: append, then sort once
+        for id, name in rows:
+            for position, key in enumerate(self._file(id, name)):
+                array = self.inner if position else self.starts
+                array[0].append(key)
+                array[1].append(id)
+        for array in (self.starts, self.inner):
+            pairs = sorted(zip(*array))
+            array[:] = [[key for key, _ in pairs], [id for _, id in pairs]]
+
+    def add(self, id, name):
+        self.remove(id)
+        for position, key in enumerate(self._file(id, name)):
+            self._insert(self.inner if position else self.starts, key, id)
+
+    def remove(self, id):
+        name = self.names.pop(id, None)
+        if name is None:
+            return
+        keys = name[1]
+        self.entries -= len(keys)
+        for position, key in enumerate(keys):
+            self._delete(self.inner if position else self.starts, key, id)
+
+    @staticmethod
+    def _insert(array, key, id):
+        keys, ids = array
+        # ids of one key stay in id order
+        i = bisect_right(keys, key)
+        while i > 0 and keys[i - 1] == key and ids[i - 1] > id:
+            i -= 1
+        keys.insert(i, key)
+        ids.insert(i, id)
+
+    @staticmethod
+    def _delete(array, key, id):
+        keys, ids = array
+        i = bisect_left(keys, key)
+        while keys[i] != key or ids[i] != id:
+            i += 1
+        del keys[i]
+        del ids[i]
+
+    def suggest(self, prefix, limit):
+        """[(id, name)] of up to `limit` names matching `prefix`, best first."""
+        prefix = normalize(prefix)[:self.key_length]
+        found, seen = [], set()
+        for keys, ids in (self.starts, self.inner):
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+                if ids[i] not in seen:
+                    seen.add(ids[i])
+                    found.append((ids[i], self.names[ids[i]][0]))
+                i += 1
+        return found
+
+
+class Autocomplete(object):
+    """Name suggestions of one catalog model, from a per-worker PrefixIndex."""
+
+    def __init__(self, db, model, limit=10, max_entries=200000, key_length=32, max_age=600):
+        self.db = db
+        self.model = model
+        self.limit = limit
+        self.max_entries = max_entries
+        self.key_length = key_length
+        self.max_age = max_age
+        self._index = None
+        self._built_at = None
+        self._lock = Lock()
+
+    def suggest(self, prefix, limit=None):
+        """[(id, name)] of up to `limit` names matching `prefix`, best first."""
+        limit = min(limit or self.limit, self.limit)
+        if not prefix.strip():
+            return []
+        with self._lock:
+            if self._index is None or (self.max_age and time.time() - self._built_at > self.max_age):
+                self._index = self._build()
+                self._built_at = time.time()
+            found = self._index.suggest(prefix, limit)
+            complete = self._index.complete
+        if len(found) < limit and not complete:
+            found += self._suggest_database(prefix, limit - len(found), [id for id, _ in found])
+        return found
+
+    def reindex(self, id):
+        if self._index is None:
+            return
+        row = self.db.session.query(self.model.name).filter(self.model.id == id).first()
+        with self._lock:
+            if row is None:
+                self._index.remove(id)
+            else:
+                self._index.add(id, row.name)
+
+    def remove(self, id):
+        if self._index is not None:
+            with self._lock:
+                self._index.remove(id)
+
+    def invalidate(self):
+        # drop the in-process index, it is rebuilt by the next suggestion
+        with self._lock:
+            self._index = None
+
+    def stats(self):
+        """(names, keys, complete) of the index, None before it is built."""
+        index = self._index
+        return None if index is None else (len(index), index.entries, index.complete)
+
+    def _suggest_database(self, prefix, limit, exclude):
+        # names left out of the index; whole-name prefixes only
+        query = self.db.session.query(self.model.id, self.model.name) \
+            .filter(self.model.name.ilike(like_escape(prefix.strip()) + '%', escape='/'))
+        if exclude:
+            query = query.filter(self.model.id.notin_(exclude))
+        return [(row.id, row.name) for row in query.order_by(self.model.name, self.model.id).limit(limit)]
+
+    def _build(self):
+        index = PrefixIndex(self.max_entries, self.key_length)
+        index.load(self.db.session.query(self.model.id, self.model.name).yield_per(1000))
+        return index
@@ -0,0 +1,357 @@
+"""Route benchmark: seed a synthetic catalog and time every route.
+
+    python benchmark.py                                  # SQLite, default volumes
+    python benchmark.py --venues 10000 --artists 100000 --shows 5000000
+    python benchmark.py --database-url postgresql://localhost/fyyur_bench
+    python benchmark.py --save-baseline                  # record .benchmarks/baseline.json
+    python benchmark.py --baseline .benchmarks/baseline.json   # exit 1 on regression
+
+The database is brought to the current schema with the migrations and seeded
+once (deterministically, from --seed) when it holds no venues; later runs reuse
+it. Each route is then requested through the Flask test client: latency
+percentiles come from --requests timed requests after --warmup untimed ones,
+queries per request from the instrumentation headers, and peak Python memory
+from one extra request traced with tracemalloc (kept out of the timed runs).
+The page cache is off unless --cache is given, so the numbers are those of
+the handlers themselves.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from booking import IntervalIndex
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+          'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+          'Rock n Roll', 'Soul', 'Other']
+STATES = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'MA', 'CO', 'GA', 'OR']
+WORDS = ['Blue', 'Hop', 'Musical', 'Park', 'Square', 'Live', 'Coffee', 'Hall', 'Room', 'Club',
+         'Sax', 'Wild', 'Band', 'Petals', 'Dueling', 'Pianos', 'Bar', 'Garden', 'Stage', 'House']
+CITIES = ['San Francisco', 'New York', 'Austin', 'Seattle', 'Chicago', 'Miami', 'Boston',
+          'Denver', 'Atlanta', 'Portland']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.join(basedir, '.benchmarks', 'fyyur.db'))
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--shows', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the generated data.')
+    parser.add_argument('--reseed', action='store_true', help='Empty the database and seed it again.')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per route.')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per route first.')
+    parser.add_argument('--cache', action='store_true', help='Leave the page cache on.')
+    parser.add_argument('--only', help='Comma-separated route names to run.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with this results file; exit 1 on a regression.')
+    parser.add_argument('--save-baseline', nargs='?', const=os.path.join(basedir, '.benchmarks', 'baseline.json'),
+                        help='Store the results as the baseline (default .benchmarks/baseline.json).')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown of p50/p99 and growth of peak memory.')
+    return parser.parse_args(argv)
+
+
+def load_app(args):
+    # configuration the app module reads at import time
+    os.environ['DATABASE_URL'] = args.database_url
+    if not args.cache:
+        os.environ['FYYUR_CACHE_TYPE'] = 'null'
+    import app as fyyur
+    fyyur.app.config.update(
+        WTF_CSRF_ENABLED=False,
+        INSTRUMENTATION_HEADERS=True,
+        TESTING=True,
+    )
+    return fyyur
+
+
+def batches(rows, size=10000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def name(rng, words=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(fyyur, args):
+    """Fill the catalog with args.venues / artists / shows rows, in executemany batches."""
+    db = fyyur.db
+    rng = random.Random(args.seed)
+    now = datetime.now().replace(microsecond=0)
+    stamp = datetime.utcnow()
+    connection = db.engine.connect()
+
+    def insert(table, rows):
+        for batch in batches(rows):
+            connection.execute(table.insert(), batch)
+
+    with connection.begin():
+        insert(fyyur.Genre.__table__, ({'id': i, 'name': genre} for i, genre in enumerate(GENRES, 1)))
+        for model, link, count, seeking in [(fyyur.Venue, fyyur.venue_genre, args.venues, 'seeking_talent'),
+                                            (fyyur.Artist, fyyur.artist_genre, args.artists, 'seeking_venue')]:
+            key = link.columns.keys()[0]
+
+            def entities():
+                for id in range(1, count + 1):
+                    city = rng.randrange(len(CITIES))
+                    row = {'id': id, 'name': '%s %d' % (name(rng), id), 'city': CITIES[city],
+                           'state': STATES[city], 'phone': '01%09d' % id, 'website_link': '',
+                           'facebook_link': 'https://www.facebook.com/%d' % id,
+                           'image_link': 'https://example.com/%d.jpg' % id,
+                           seeking: rng.random() < 0.3, 'seeking_description': '', 'updated_at': stamp}
+                    if model is fyyur.Venue:
+                        row['address'] = '%d %s St' % (rng.randrange(1, 999), rng.choice(WORDS))
+                        # scattered around the city centre (sigma ~17 km)
+                        latitude, longitude = fyyur.geocoder.lookup(None, CITIES[city], STATES[city])
+                        row['latitude'] = latitude + rng.gauss(0, 0.15)
+                        row['longitude'] = longitude + rng.gauss(0, 0.15)
+                    yield row
+            insert(model.__table__, entities())
+            insert(link, ({key: id, 'genre_id': genre_id}
+                          for id in range(1, count + 1)
+                          for genre_id in rng.sample(range(1, len(GENRES) + 1), rng.randint(1, 3))))
+        # two years either side of now, so both past and upcoming shows exist;
+        # no venue or artist is booked twice at once (Postgres would refuse it)
+        booked = IntervalIndex()
+
+        def shows():
+            for _ in range(args.shows):
+                while True:
+                    venue_id, artist_id = rng.randint(1, args.venues), rng.randint(1, args.artists)
+                    start = now + timedelta(minutes=rng.randint(-1051200, 1051200))
+                    end = start + timedelta(minutes=rng.choice([60, 90, 120, 180]))
+                    if booked.overlapping(('venue', venue_id), start, end) is None and \
+                            booked.overlapping(('artist', artist_id), start, end) is None:
+                        break
+                booked.add(('venue', venue_id), start, end, True)
+                booked.add(('artist', artist_id), start, end, True)
+                yield {'venue_id': venue_id, 'artist_id': artist_id, 'start_date': start, 'end_date': end,
+                       'updated_at': stamp}
+        insert(fyyur.Show.__table__, shows())
+    connection.close()
+    if db.engine.dialect.name == 'postgresql':
+        # explicit ids bypassed the sequences
+        for table in ('genre', 'venue', 'artist'):
+            db.engine.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT max(id) FROM %s))"
+                              % (table, table))
+    # planner statistics for the fresh tables
+    db.engine.execute('ANALYZE')
+
+
+def prepare(fyyur, args):
+    from flask_migrate import upgrade
+    if args.database_url.startswith('sqlite:///'):
+        directory = os.path.dirname(args.database_url[len('sqlite:///'):])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    with fyyur.app.app_context():
+        db = fyyur.db
+        if args.reseed:
+            db.drop_all()
+            db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+        upgrade(directory=os.path.join(basedir, 'migrations'))
+        volumes = {'venues': fyyur.Venue.query.count()}
+        if volumes['venues'] == 0:
+            started = time.time()
+            seed(fyyur, args)
+            print('seeded in %.1fs' % (time.time() - started), file=sys.stderr)
+        volumes = {'venues': fyyur.Venue.query.count(), 'artists': fyyur.Artist.query.count(),
+                   'shows': fyyur.Show.query.count()}
+        sample = {
+            'venue_id': db.session.query(db.func.min(fyyur.Venue.id)).scalar(),
+            'artist_id': db.session.query(db.func.min(fyyur.Artist.id)).scalar(),
+            'busy_venue_id': db.session.query(fyyur.Show.venue_id).group_by(fyyur.Show.venue_id)
+                               .order_by(db.func.count().desc()).limit(1).scalar(),
+        }
+        db.session.remove()
+    return volumes, sample
+
+
+def routes(sample):
+    # (name, method, url, form data or a callable returning it per request)
+    venue, artist, busy = sample['venue_id'], sample['artist_id'], sample['busy_venue_id']
+    # every created show takes the next free slot, so each request inserts
+    # instead of hitting the double-booking check
+    slots = itertools.count()
+    future = datetime.now().replace(microsecond=0) + timedelta(days=3650)
+    artist_form = {'name': 'Benchmark Artist', 'city': 'Austin', 'state': 'TX', 'phone': '01000000000',
+                   'genres': ['Jazz', 'Soul'], 'facebook_link': 'https://www.facebook.com/bench'}
+    venues_created = itertools.count(1)
+    venue_form = dict(artist_form, address='1 Benchmark Street')
+    return [
+        ('index', 'GET', '/', None),
+        ('venues', 'GET', '/venues', None),
+        ('venues_page2', 'GET', 'next:/venues', None),
+        ('venues_genre', 'GET', '/venues?genre=Jazz', None),
+        ('venues_near', 'GET', '/venues?near=37.7749,-122.4194&radius=10', None),
+        ('venue', 'GET', '/venues/%d' % venue, None),
+        ('venue_busy', 'GET', '/venues/%d' % busy, None),
+        ('search_venues', 'POST', '/venues/search', {'search_term': 'hop'}),
+        ('autocomplete_venues', 'GET', '/venues/autocomplete?q=musical h', None),
+        ('artists', 'GET', '/artists', None),
+        ('artists_page2', 'GET', 'next:/artists', None),
+        ('artist', 'GET', '/artists/%d' % artist, None),
+        ('search_artists', 'POST', '/artists/search', {'search_term': 'band'}),
+        ('autocomplete_artists', 'GET', '/artists/autocomplete?q=wi', None),
+        ('shows', 'GET', '/shows', None),
+        ('shows_page2', 'GET', 'next:/shows', None),
+        ('shows_window', 'GET', '/shows?from=%s&to=%s&genre=Jazz' % (
+            datetime.now().date(), datetime.now().date() + timedelta(days=30)), None),
+        ('edit_venue_form', 'GET', '/venues/%d/edit' % venue, None),
+        ('edit_artist_form', 'GET', '/artists/%d/edit' % artist, None),
+        ('create_venue_form', 'GET', '/venues/create', None),
+        ('create_artist_form', 'GET', '/artists/create', None),
+        ('create_show_form', 'GET', '/shows/create', None),
+        ('api_venues', 'GET', '/api/v1/venues', None),
+        ('api_venues_near', 'GET', '/api/v1/venues?near=40.7128,-74.0060&radius=25', None),
+        ('api_venue', 'GET', '/api/v1/venues/%d' % busy, None),
+        ('api_artists', 'GET', '/api/v1/artists?fields=id,name', None),
+        ('api_artist', 'GET', '/api/v1/artists/%d' % artist, None),
+        ('api_shows', 'GET', '/api/v1/shows', None),
+        # writes last, they change what the reads see
+        ('edit_artist', 'POST', '/artists/%d/edit' % artist, artist_form),
+        ('create_venue', 'POST', '/venues/create',
+         lambda: dict(venue_form, name='Benchmark Venue %d' % next(venues_created))),
+        ('create_show', 'POST', '/shows/create',
+         lambda: {'venue_id': str(venue), 'artist_id': str(artist),
+                  'start_time': str(future + timedelta(hours=3 * next(slots)))}),
+    ]
+
+
+def resolve(client, url):
+    # 'next:<url>' is the second page of a listing, a keyset cursor away
+    if not url.startswith('next:'):
+        return url
+    body = client.get(url[len('next:'):]).get_data(as_text=True)
+    marker = 'href="'
+    for line in body.splitlines():
+        if 'after=' in line and marker in line:
+            start = line.index(marker) + len(marker)
+            return line[start:line.index('"', start)].replace('&amp;', '&')
+    return url[len('next:'):]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(fyyur, args, sample):
+    client = fyyur.app.test_client()
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    for route, method, url, data in routes(sample):
+        if only and route not in only:
+            continue
+        url = resolve(client, url)
+
+        def request():
+            return client.open(url, method=method, data=data() if callable(data) else data)
+
+        for _ in range(args.warmup):
+            request()
+        latencies = []
+        queries = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(int(response.headers.get('X-DB-Queries', 0)))
+        if response.status_code >= 400:
+            print('%s: HTTP %d' % (route, response.status_code), file=sys.stderr)
+
+        tracemalloc.start()
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[route] = {
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024.0, 1),
+        }
+    return results
+
+
+def report(results, baseline=None):
+    print('%-20s %9s %9s %8s %10s' % ('route', 'p50 ms', 'p99 ms', 'queries', 'peak KiB'))
+    for route, result in results.items():
+        line = '%-20s %9.2f %9.2f %8d %10.1f' % (route, result['p50_ms'], result['p99_ms'],
+                                                 result['queries'], result['peak_kib'])
+        if baseline and route in baseline:
+            line += '   (p50 %+.0f%%)' % (100.0 * (result['p50_ms'] / max(baseline[route]['p50_ms'], 1e-6) - 1))
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    """Human-readable list of the measures worse than the baseline allows."""
+    found = []
+    for route, result in results.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        for measure in ('p50_ms', 'p99_ms', 'peak_kib'):
+            if result[measure] > before[measure] * (1 + tolerance):
+                found.append('%s %s: %.2f -> %.2f' % (route, measure, before[measure], result[measure]))
+        if result['queries'] > before['queries']:
+            found.append('%s queries: %d -> %d' % (route, before['queries'], result['queries']))
+    return found
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fyyur = load_app(args)
+    volumes, sample = prepare(fyyur, args)
+    print('%s: %s' % (args.database_url, ', '.join('%d %s' % (n, kind) for kind, n in volumes.items())),
+          file=sys.stderr)
+    results = run(fyyur, args, sample)
+    document = {'database': fyyur.app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0], 'volumes': volumes,
+                'requests': args.requests, 'routes': results}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as stored:
+            baseline = json.load(stored)
+        # the write routes add a few rows per run, hence the slack
+        stored = baseline.get('volumes', {})
+        if any(abs(volumes[kind] - stored.get(kind, 0)) > 0.01 * volumes[kind] for kind in volumes):
+            print('warning: baseline was taken with %s' % baseline.get('volumes'), file=sys.stderr)
+    report(results, baseline and baseline['routes'])
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as out:
+            json.dump(document, out, indent=2, sort_keys=True)
+
+    if baseline:
+        found = regressions(results, baseline['routes'], args.tolerance)
+        if found:
+            print('\nregressions against %s:' % args.baseline, file=sys.stderr)
+            for line in found:
+                print('  ' + line, file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
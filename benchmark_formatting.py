@@ -0,0 +1,78 @@
+"""Microbenchmark of the `datetime` template filter.
+
+    python benchmark_formatting.py [--tiles 5000] [--distinct 500] [--repeat 5]
+
+Formats the start times of a page of show tiles (--tiles values, --distinct of
+them different) with the formats the templates use, three ways: Babel called
+per value (the filter as it was), the memoized filter per value (with a cold
+memo, and warm as on the next request), and ``format_many`` on the whole
+list. Every way must give the same strings; the best of --repeat runs is
+reported.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+
+from formatting import PATTERNS, DateTimeFormatter
+
+
+def babel_per_value(values, format, locale):
+    pattern = PATTERNS.get(format, format)
+    return [babel.dates.format_datetime(value, pattern, locale=locale) for value in values]
+
+
+def best_of(repeat, setup, run):
+    timings = []
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        result = run(state)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tiles', type=int, default=5000)
+    parser.add_argument('--distinct', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--locale', default='en_US')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    start = datetime(2030, 1, 1, 19, 0)
+    times = [start + timedelta(days=rng.randrange(365), minutes=30 * rng.randrange(8))
+             for _ in range(args.distinct)]
+    values = [rng.choice(times) for _ in range(args.tiles)]
+
+    print('%d values, %d distinct, locale %s' % (len(values), len(set(values)), args.locale))
+    print('%-8s %-22s %10s %9s' % ('format', 'method', 'ms', 'speedup'))
+    for format in ['full', 'medium']:
+        def warm():
+            formatter = DateTimeFormatter(args.locale)
+            [formatter(value, format) for value in values]
+            return formatter
+
+        methods = [
+            ('babel per value', lambda: None, lambda _: babel_per_value(values, format, args.locale)),
+            ('filter, cold memo', lambda: DateTimeFormatter(args.locale),
+             lambda formatter: [formatter(value, format) for value in values]),
+            ('filter, warm memo', warm, lambda formatter: [formatter(value, format) for value in values]),
+            ('format_many', lambda: DateTimeFormatter(args.locale),
+             lambda formatter: formatter.format_many(values, format)),
+        ]
+        baseline = expected = None
+        for name, setup, run in methods:
+            elapsed, result = best_of(args.repeat, setup, run)
+            if expected is None:
+                baseline, expected = elapsed, result
+            elif result != expected:
+                raise SystemExit('%s gives different output for %r' % (name, format))
+            print('%-8s %-22s %10.2f %8.1fx' % (format, name, elapsed * 1000, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Microbenchmark of the in-process venue grid (geo.GridIndex).
+
+    python benchmark_geo.py [--venues 100000] [--queries 200] [--radius 25] [--limit 50]
+
+Scatters --venues points around the cities of the geocoding table, builds the
+grid, and answers --queries radius and nearest queries on it, and by measuring
+every point (what a scan of the venue table amounts to). Both ways must give
+the same venues; the time per query is reported.
+"""
+import argparse
+import heapq
+import random
+import time
+
+from geo import GeocodeTable, GridIndex, haversine_km
+from config import Config
+
+
+def scan_within(points, latitude, longitude, radius):
+    return sorted((distance, id) for distance, id in
+                  ((haversine_km(latitude, longitude, *point), id) for id, point in points.items())
+                  if distance <= radius)
+
+
+def scan_nearest(points, latitude, longitude, limit, radius):
+    return heapq.nsmallest(limit, [(distance, id) for distance, id in
+                                   ((haversine_km(latitude, longitude, *point), id) for id, point in points.items())
+                                   if distance <= radius])
+
+
+def timed(run, queries):
+    started = time.perf_counter()
+    results = [run(*query) for query in queries]
+    return (time.perf_counter() - started) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--venues', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=25, help='km')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--cell', type=float, default=0.25, help='Grid cell size in degrees.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    centres = list(GeocodeTable(Config.GEOCODE_TABLE).places.values())
+    points = {}
+    for id in range(1, args.venues + 1):
+        latitude, longitude = rng.choice(centres)
+        points[id] = (latitude + rng.gauss(0, 0.15), longitude + rng.gauss(0, 0.15))
+    queries = []
+    for _ in range(args.queries):
+        latitude, longitude = rng.choice(centres)
+        queries.append((latitude + rng.gauss(0, 0.1), longitude + rng.gauss(0, 0.1)))
+
+    started = time.perf_counter()
+    index = GridIndex(args.cell)
+    for id, (latitude, longitude) in points.items():
+        index.add(id, latitude, longitude)
+    print('%d venues around %d places, grid of %d cells built in %.2fs' % (
+        len(points), len(centres), len(index.cells), time.perf_counter() - started))
+
+    print('%-30s %12s %12s %9s %10s' % ('query', 'scan ms', 'grid ms', 'speedup', 'avg found'))
+    for name, scan, grid in [
+            ('within %g km' % args.radius,
+             lambda latitude, longitude: scan_within(points, latitude, longitude, args.radius),
+             lambda latitude, longitude: sorted(index.within(latitude, longitude, args.radius))),
+            ('nearest %d within %g km' % (args.limit, args.radius),
+             lambda latitude, longitude: scan_nearest(points, latitude, longitude, args.limit, args.radius),
+             lambda latitude, longitude: index.nearest(latitude, longitude, args.limit, args.radius)),
+            ('nearest %d, any distance' % args.limit,
+             lambda latitude, longitude: scan_nearest(points, latitude, longitude, args.limit, float('inf')),
+             lambda latitude, longitude: index.nearest(latitude, longitude, args.limit))]:
+        scan_time, expected = timed(scan, queries[:max(1, args.queries // 10)])
+        grid_time, found = timed(grid, queries)
+        if found[:len(expected)] != expected:
+            raise SystemExit('%s: the grid gives different venues than the scan' % name)
+        print('%-30s %12.3f %12.3f %8.0fx %10.1f' % (name, scan_time * 1000, grid_time * 1000,
+                                                    scan_time / grid_time, sum(map(len, found)) / len(found)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Double-booking checks for shows.
+
+A show books its venue and its artist for ``[start_date, end_date)``. A new
+show is rejected when it overlaps a show of the same venue or the same
+artist, and the error carries the show it collides with.
+
+* ``overlapping(...)`` filters a query down to the shows overlapping a range.
+  Show durations are capped at ``MAX_SHOW_DURATION``, so ``start_date`` is
+  bounded on both sides and the check is a short range scan of
+  ``ix_show_venue_id_start_date`` / ``ix_show_artist_id_start_date``, not a
+  scan of every show of the venue.
+* ``lock_bookings(session, resources)`` makes the check and the insert of
+  concurrent submissions take turns. On SQLite it starts the transaction with
+  ``BEGIN IMMEDIATE``, taking the database's write lock before the check. On
+  Postgres it takes a transaction-level advisory lock per venue and artist
+  before the check. The
+  ``ex_show_venue_booking`` / ``ex_show_artist_booking`` exclusion constraints
+  (``btree_gist``) are only per month partition, so they miss two shows that
+  overlap across a month boundary. They still back the check, and
+  ``violated_constraint`` recognises their error so that it is reported as a
+  conflict too.
+* ``IntervalIndex`` does the same check in memory, for a batch of new shows
+  checked against each other and against the shows already booked.
+"""
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import text
+
+MAX_SHOW_DURATION = timedelta(hours=24)
+CONSTRAINTS = {'ex_show_venue_booking': 'venue', 'ex_show_artist_booking': 'artist'}
+# first key of the pg_advisory_xact_lock(key, id) of a resource; (0, 0) covers
+# all bookings, taken shared by single bookings and exclusive by bulk ones
+LOCK_KEYS = {'venue': 1, 'artist': 2}
+
+
+class BookingConflict(Exception):
+    """The `resource` ('venue' or 'artist') is booked by `show` at that time.
+
+    `show` has ``id``, ``start_date``, ``end_date``, ``venue_name`` and
+    ``artist_name`` (a query row or an equivalent object).
+    """
+
+    def __init__(self, resource, show):
+        self.resource = resource
+        self.show = show
+        super(BookingConflict, self).__init__(str(self))
+
+    def __str__(self):
+        show = self.show
+        return 'The %s is already booked from %s to %s: %s at %s (show %s).' % (
+            self.resource, show.start_date.strftime('%Y-%m-%d %H:%M'), show.end_date.strftime('%Y-%m-%d %H:%M'),
+            show.artist_name, show.venue_name, show.id)
+
+
+def overlapping(query, start_column, end_column, start, end):
+    # [start_column, end_column) overlaps [start, end); the lower bound on
+    # start_column is implied by the overlap and the duration cap, and lets an
+    # index on (resource, start) serve the whole check
+    return query.filter(start_column < end, end_column > start, start_column > start - MAX_SHOW_DURATION)
+
+
+def lock_bookings(session, resources=None):
+    """Hold off the booking checks of `resources` in other transactions until this one ends.
+
+    `resources` are ('venue' | 'artist', id) pairs; None locks every booking,
+    for a bulk import. Call it before the overlap check.
+    """
+    connection = session.connection()
+    if connection.dialect.name == 'sqlite':
+        # the driver begins a transaction at the first write, after the check;
+        # once one is open, this connection holds the write lock already
+        if not connection.connection.in_transaction:
+            connection.execute(text('BEGIN IMMEDIATE'))
+        return
+    if connection.dialect.name != 'postgresql':
+        return
+    if resources is None:
+        connection.execute(text('SELECT pg_advisory_xact_lock(0, 0)'))
+        return
+    connection.execute(text('SELECT pg_advisory_xact_lock_shared(0, 0)'))
+    # in one order everywhere, so two submissions cannot deadlock
+    for resource, id in sorted(set(resources)):
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key, :id)'), key=LOCK_KEYS[resource], id=id)
+
+
+def violated_constraint(error):
+    # 'venue' / 'artist' when an IntegrityError comes from an exclusion constraint
+    message = str(getattr(error, 'orig', error))
+    for constraint, resource in CONSTRAINTS.items():
+        if constraint in message:
+            return resource
+    return None
+
+
+class IntervalIndex(object):
+    """Half-open intervals per key, sorted by start.
+
+    With durations capped at `max_duration`, the intervals overlapping
+    ``[start, end)`` all start within ``(start - max_duration, end)``, so a
+    lookup is a bisect plus the few intervals in that window.
+    """
+
+    def __init__(self, max_duration=MAX_SHOW_DURATION):
+        self.max_duration = max_duration
+        self.starts = defaultdict(list)
+        self.intervals = defaultdict(list)
+
+    def add(self, key, start, end, value):
+        position = bisect.bisect_right(self.starts[key], start)
+        self.starts[key].insert(position, start)
+        self.intervals[key].insert(position, (start, end, value))
+
+    def overlapping(self, key, start, end):
+        starts = self.starts.get(key)
+        if not starts:
+            return None
+        low = bisect.bisect_right(starts, start - self.max_duration)
+        high = bisect.bisect_left(starts, end)
+        for other_start, other_end, value in self.intervals[key][low:high]:
+            if other_end > start and other_start < end:
+                return value
+        return None
@@ -0,0 +1,150 @@
+"""Streaming helpers for the bulk import and export commands.
+
+Records are read and written one at a time, so a load or a dump holds at
+most one batch in memory whatever the size of the file.
+"""
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+import zlib
+from datetime import date, datetime
+from itertools import islice
+
+
+class _Standard(object):
+    # stdin/stdout, usable in a `with` block without being closed by it
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.stream.flush()
+
+
+def open_text(path, mode='r'):
+    # '-' is stdin/stdout; a .gz suffix is (de)compressed on the fly
+    if path == '-':
+        return _Standard(sys.stdin if 'r' in mode else sys.stdout)
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, mode.replace('t', '') + 'b'), encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def guess_format(path, default='jsonl'):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return 'jsonl'
+    return default
+
+
+def read_records(stream, fmt):
+    """Yield (line number, record dict) pairs from a CSV or JSON-lines stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            record = {'__error__': 'invalid JSON: %s' % error}
+        yield line_number, record
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _plain(value, csv=False):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if csv and isinstance(value, (list, tuple)):
+        return ','.join(value)
+    return value
+
+
+def csv_chunks(columns, rows, chunk_size=500):
+    """Yield the CSV text of `rows` (header first), `chunk_size` rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for number, row in enumerate(rows, 1):
+        writer.writerow([_plain(value, csv=True) for value in row])
+        if number % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(columns, rows, chunk_size=500):
+    """Yield `rows` as JSON lines, one object per row, `chunk_size` rows at a time."""
+    lines = []
+    for row in rows:
+        record = {column: _plain(value) for column, value in zip(columns, row)}
+        lines.append(json.dumps(record, separators=(',', ':')) + '\n')
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def gzip_chunks(chunks):
+    # incremental gzip of a text stream, for streamed HTTP responses
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ImportReport(object):
+    """Row counts, throughput and per-row errors of one load."""
+
+    def __init__(self, max_errors=1000):
+        self.started = time.time()
+        self.loaded = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, message))
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return (self.loaded + self.failed) / elapsed if elapsed else 0.0
+
+    def summary(self):
+        return '%d loaded, %d failed in %.1fs (%.0f rows/s)' % (
+            self.loaded, self.failed, time.time() - self.started, self.rate)
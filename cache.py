@@ -0,0 +1,280 @@
+"""Read-through cache for rendered pages.
+
+Entries are keyed per route and query string and carry the current version
+token of every tag (``venues``, ``artists``, ``shows``) the page was built
+from. After a write commits, ``PageCache.invalidate`` is called with the tags
+it touched; that swaps the tag's token so every page built from the old data
+stops matching at once, without scanning or deleting keys. The app calls it
+from the outbox listener of every process (see outbox.py), so a write made in
+one worker also reaches the ``LRUCache`` of the others, within the listener's
+poll interval. Elsewhere, an ``invalidate`` only reaches the process that
+calls it, unless the backend is shared. The same tokens give the JSON API
+its ETags (``PageCache.conditional``).
+Requests for which ``bypass()`` is true, such as those of a user whose write
+may not have been applied yet, neither read nor fill the cache. A miss calls
+``on_miss()`` before the view runs; the app uses it to read the page from the
+primary, since a replica may still serve the data an invalidation replaced.
+As a safeguard, nothing is stored while ``from_replica()`` is true.
+
+Backends share a get/set/delete interface:
+
+* ``LRUCache``  -- bounded in-process LRU with TTL (default); every worker
+  has its own copy of the pages and tags
+* ``FileSystemCache`` -- local stand-in for a shared cache, visible to every
+  worker process on the host
+* ``RedisCache`` -- shared across hosts, needs the optional ``redis`` package
+* ``NullCache`` -- caching disabled
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import Response, make_response, request, session
+
+
+class NullCache(object):
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class LRUCache(object):
+    """Thread-safe LRU holding at most `maxsize` entries, each for `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache(object):
+    """One pickle file per key under `directory`, written atomically.
+
+    Stands in for a shared cache during local multi-worker runs; once the
+    directory holds more than `maxsize` files the oldest are pruned.
+    """
+
+    def __init__(self, directory, maxsize=10000, ttl=60):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as entry:
+                expires, value = pickle.load(entry)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as entry:
+            pickle.dump((expires, value), entry, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _prune(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.is_file()]
+        if len(entries) > self.maxsize:
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.maxsize]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+class RedisCache(object):
+
+    def __init__(self, url, ttl=60, prefix='fyyur:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def make_backend(config):
+    # CACHE_TYPE: 'local' (default), 'filesystem', 'redis' or 'null'
+    kind = config.get('CACHE_TYPE', 'local')
+    ttl = config.get('CACHE_TTL', 60)
+    if kind == 'null':
+        return NullCache()
+    if kind == 'filesystem':
+        return FileSystemCache(config['CACHE_DIR'], config.get('CACHE_MAX_ENTRIES', 1024), ttl)
+    if kind == 'redis':
+        return RedisCache(config['CACHE_REDIS_URL'], ttl)
+    return LRUCache(config.get('CACHE_MAX_ENTRIES', 1024), ttl)
+
+
+class PageCache(object):
+
+    def __init__(self, backend, ttl=60, bypass=None, on_miss=None, from_replica=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.bypass = bypass or (lambda: False)
+        self.on_miss = on_miss or (lambda: None)
+        self.from_replica = from_replica or (lambda: False)
+
+    def tag_version(self, tag):
+        # tokens are never reused, so a tag evicted from a bounded backend
+        # comes back as a new version instead of re-validating old pages
+        version = self.backend.get('tag:' + tag)
+        if version is None:
+            version = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, version, 0)
+        return version
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.set('tag:' + tag, uuid.uuid4().hex, 0)
+
+    def key(self, tags):
+        versions = ','.join(self.tag_version(tag) for tag in tags)
+        return 'page:%s:%s' % (request.full_path, versions)
+
+    def etag(self, tags, *extra):
+        # strong validator of the data behind a URL: the tag versions it was
+        # built from, plus whatever else it depends on (e.g. the clock)
+        parts = [request.full_path] + [self.tag_version(tag) for tag in tags] + [str(value) for value in extra]
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+
+    def conditional(self, *tags, **options):
+        """Answer a matching If-None-Match with 304 before the view runs.
+
+        The ETag is derived from the versions of `tags` (and the value of the
+        optional `depends_on()` callable), so revalidating an unchanged
+        resource costs neither a query nor a payload. It is computed before
+        the view, so a write racing the request can only make it
+        conservative.
+        """
+        depends_on = options.get('depends_on')
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.bypass():
+                    return view(*args, **kwargs)
+                etag = self.etag(tags, depends_on() if depends_on else None)
+                if request.if_none_match.contains(etag):
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    return response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    response.set_etag(etag)
+                return response
+            return wrapper
+        return decorator
+
+    def cacheable(self):
+        # the layout renders (and consumes) pending flash messages, so
+        # pages carrying them are neither served from nor stored in the cache
+        return request.method == 'GET' and not session.get('_flashes') and not self.bypass()
+
+    def fetch(self, key):
+        """The cached response under `key`, or None."""
+        hit = self.backend.get(key)
+        if hit is None:
+            return None
+        body, mimetype = hit
+        response = Response(body, mimetype=mimetype)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    def store(self, key, response):
+        """Keep a rendered `response` under `key`, unless it is an error, a stream or replica data."""
+        if response.status_code == 200 and not response.direct_passthrough and not self.from_replica():
+            self.backend.set(key, (response.get_data(), response.mimetype), self.ttl)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def cached(self, *tags):
+        """Serve a GET view from the cache, keyed on its URL and the versions of `tags`."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.cacheable():
+                    return view(*args, **kwargs)
+                key = self.key(tags)
+                hit = self.fetch(key)
+                if hit is not None:
+                    return hit
+                self.on_miss()
+                return self.store(key, make_response(view(*args, **kwargs)))
+            return wrapper
+        return decorator
@@ -1,4 +1,5 @@
 import os
+from sqlalchemy.pool import NullPool
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 # Database URI parameters
@@ -8,17 +9,149 @@ IP_ADDRESS = 'localhost'
 PORT_NUMBER = '5432'
 DATABASE_NAME = 'fyyur'
 
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def replica_binds(urls):
+    # DATABASE_REPLICA_URLS (comma-separated) as SQLALCHEMY_BINDS entries
+    # replica_1, replica_2, ...
+    urls = [url.strip() for url in (urls or '').split(',') if url.strip()]
+    return {'replica_%d' % number: url for number, url in enumerate(urls, 1)}
+
+def engine_options(uri, statement_timeout_ms=0, pgbouncer=False):
+    """create_engine() arguments for `uri` from the DB_* environment variables.
+
+    SQLite gets none (it does not pool). Behind PgBouncer in transaction mode
+    the pooling is left to PgBouncer (NullPool) and the statement timeout is
+    set per transaction by the app, since PgBouncer rejects startup options.
+    """
+    if uri.startswith('sqlite'):
+        return {}
+    options = {'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800))}
+    if pgbouncer:
+        options['poolclass'] = NullPool
+        return options
+    options.update(
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        pool_pre_ping=env_flag('DB_POOL_PRE_PING', True),
+    )
+    if statement_timeout_ms and uri.startswith('postgres'):
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout_ms}
+    return options
+
 class Config():
     DEBUG = False
     SECRET_KEY = os.urandom(32)
     # TODO IMPLEMENT DATABASE URL
     # [DONE]
-    SQLALCHEMY_DATABASE_URI = f'{DATABASE_MANAGEMENT_SYSTEM}://{USER_NAME}@{IP_ADDRESS}:{PORT_NUMBER}/{DATABASE_NAME}'
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', f'{DATABASE_MANAGEMENT_SYSTEM}://{USER_NAME}@{IP_ADDRESS}:{PORT_NUMBER}/{DATABASE_NAME}')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas, as binds (see replica_binds)
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get('DATABASE_REPLICA_URLS'))
+    # Connection pooling (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    # DB_POOL_RECYCLE, DB_POOL_PRE_PING), a per-statement timeout in ms (0: none)
+    # and PgBouncer transaction-mode compatibility (DB_PGBOUNCER)
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    DB_PGBOUNCER = env_flag('DB_PGBOUNCER')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, DB_STATEMENT_TIMEOUT_MS, DB_PGBOUNCER)
+    # Replica choice for read-only views ('round_robin' or 'least_loaded', by
+    # checked-out connections) and how long after a user's own write their
+    # reads stay on the primary
+    DB_REPLICA_SELECTION = os.environ.get('DB_REPLICA_SELECTION', 'round_robin')
+    DB_READ_AFTER_WRITE_SECONDS = int(os.environ.get('DB_READ_AFTER_WRITE_SECONDS', 10))
+    # How far the next incremental export's --since / X-Next-Since reaches back
+    # from the latest updated_at of an export: rows stamped before it whose
+    # transaction committed after the export are picked up next time, as long
+    # as their transaction took less than this
+    EXPORT_OVERLAP_SECONDS = int(os.environ.get('FYYUR_EXPORT_OVERLAP_SECONDS', 300))
+    # Length of a show listed without a duration; the venue and the artist are
+    # booked for that long (at most booking.MAX_SHOW_DURATION)
+    SHOW_DURATION_MINUTES = int(os.environ.get('FYYUR_SHOW_DURATION_MINUTES', 120))
+    # `flask archive-shows` moves shows that started more than this many days
+    # ago into show_history; a venue/artist page lists the latest
+    # SHOW_HISTORY_LIMIT of its archived counterparts
+    SHOW_ARCHIVE_AFTER_DAYS = int(os.environ.get('FYYUR_SHOW_ARCHIVE_AFTER_DAYS', 365))
+    SHOW_HISTORY_LIMIT = int(os.environ.get('FYYUR_SHOW_HISTORY_LIMIT', 20))
+    # Outbox of post-write side effects: worker threads per process (0 runs the
+    # events in the write request, after its commit; more than one only pays
+    # on Postgres, SQLite serializes their commits with the requests'), how
+    # often they and the process's listener look for other processes' events,
+    # events per batch, attempts before an event is given up on, how long a
+    # claim lasts, and days handled events are kept
+    OUTBOX_WORKERS = int(os.environ.get('FYYUR_OUTBOX_WORKERS', 1))
+    OUTBOX_POLL_SECONDS = float(os.environ.get('FYYUR_OUTBOX_POLL_SECONDS', 1))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('FYYUR_OUTBOX_BATCH_SIZE', 100))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('FYYUR_OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('FYYUR_OUTBOX_LEASE_SECONDS', 60))
+    OUTBOX_RETENTION_DAYS = int(os.environ.get('FYYUR_OUTBOX_RETENTION_DAYS', 7))
+    # Offline geocoding table of venue locations (CSV: city,state,latitude,
+    # longitude[,address]), and the default / largest radius of ?near= queries
+    GEOCODE_TABLE = os.environ.get('FYYUR_GEOCODE_TABLE', os.path.join(basedir, 'data', 'places.csv'))
+    NEAR_RADIUS_KM = float(os.environ.get('FYYUR_NEAR_RADIUS_KM', 25))
+    MAX_NEAR_RADIUS_KM = 500
+    # Listing pagination (?per_page= is capped at MAX_PAGE_SIZE)
+    PAGE_SIZE = int(os.environ.get('FYYUR_PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = 200
+    # Most results a venue/artist search returns
+    SEARCH_LIMIT = int(os.environ.get('FYYUR_SEARCH_LIMIT', 50))
+    # Search-as-you-type: most suggestions per request, and the most name keys
+    # (a name and up to three of its later words) each worker indexes per model
+    AUTOCOMPLETE_LIMIT = int(os.environ.get('FYYUR_AUTOCOMPLETE_LIMIT', 10))
+    AUTOCOMPLETE_MAX_ENTRIES = int(os.environ.get('FYYUR_AUTOCOMPLETE_MAX_ENTRIES', 200000))
+    # Seconds before a worker rebuilds its autocomplete index from the
+    # database (0: only on invalidation)
+    AUTOCOMPLETE_MAX_AGE = int(os.environ.get('FYYUR_AUTOCOMPLETE_MAX_AGE', 600))
+    # Rendered page cache: 'local' (per-process LRU; each worker's outbox
+    # listener applies the invalidations of the others' writes), 'filesystem'
+    # (shared by the workers of one host), 'redis' (shared, needs
+    # CACHE_REDIS_URL) or 'null'
+    CACHE_TYPE = os.environ.get('FYYUR_CACHE_TYPE', 'local')
+    CACHE_TTL = int(os.environ.get('FYYUR_CACHE_TTL', 60))
+    CACHE_MAX_ENTRIES = int(os.environ.get('FYYUR_CACHE_MAX_ENTRIES', 1024))
+    CACHE_DIR = os.environ.get('FYYUR_CACHE_DIR', os.path.join(basedir, '.cache', 'pages'))
+    CACHE_REDIS_URL = os.environ.get('FYYUR_CACHE_REDIS_URL')
+    # Locale of the dates in the pages (default: the LC_TIME of the process)
+    # and how many formatted timestamps each worker remembers
+    DATETIME_LOCALE = os.environ.get('FYYUR_DATETIME_LOCALE')
+    DATETIME_MEMO_SIZE = int(os.environ.get('FYYUR_DATETIME_MEMO_SIZE', 4096))
+    # Compiled templates shared by the workers of one host (filled at deploy by
+    # `flask compile-templates`; empty to disable) and the rendered {% cache %}
+    # fragments each worker keeps (0: fragment caching off), for as long as
+    # the pages by default
+    TEMPLATE_CACHE_DIR = os.environ.get('FYYUR_TEMPLATE_CACHE_DIR', os.path.join(basedir, '.cache', 'templates'))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FYYUR_FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FYYUR_FRAGMENT_CACHE_TTL', CACHE_TTL))
+    # Serve the fingerprinted build of `flask build-assets` (static/dist) when
+    # one exists; development serves the source files unless this is set
+    ASSETS_BUILD = env_flag('FYYUR_ASSETS_BUILD', True)
+    # Seconds before a worker reloads its upcoming-show counts to pick up
+    # other workers' writes (0: only on local invalidation)
+    UPCOMING_COUNTS_MAX_AGE = int(os.environ.get('FYYUR_UPCOMING_COUNTS_MAX_AGE', 60))
+    # Request instrumentation: per-response X-DB-* / Server-Timing headers, the
+    # per-endpoint metrics URL (None to disable) and the repeat count of one
+    # statement shape within a request that is logged as a likely N+1
+    INSTRUMENTATION_HEADERS = False
+    METRICS_ENDPOINT = os.environ.get('FYYUR_METRICS_ENDPOINT', '/metrics') or None
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('FYYUR_N_PLUS_ONE_THRESHOLD', 5))
 class DevelopmentConfig(Config):
     DEBUG = True
     DEVELOPMENT = True
+    INSTRUMENTATION_HEADERS = True
+    ASSETS_BUILD = env_flag('FYYUR_ASSETS_BUILD')
 class ProductionConfig(Config):
-    DevelopmentConfig = False
+    DEBUG = False
+    DEVELOPMENT = False
+    # shared by every worker, so sessions, flashed messages and the
+    # read-after-write timestamp survive a request landing on another one;
+    # required, the app refuses to start without it
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(Config.SQLALCHEMY_DATABASE_URI, DB_STATEMENT_TIMEOUT_MS,
+                                               Config.DB_PGBOUNCER)
 
 
 
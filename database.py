@@ -0,0 +1,149 @@
+"""Engine-level helpers: read replica routing, per-transaction statement
+timeouts and pool health.
+
+``RoutingSQLAlchemy`` is a drop-in ``SQLAlchemy`` whose sessions send the
+statements of views decorated with ``db.replica_reads`` to one of the
+``replica_*`` binds (see ``config.replica_binds``). Everything else -- writes,
+flushes, CLI commands, undecorated views -- uses the primary. After a user's
+session commits a write, their reads stay on the primary for
+``DB_READ_AFTER_WRITE_SECONDS`` so they see their own changes despite
+replication lag. A request can also move its remaining reads to the
+primary with ``db.read_primary()``; the page cache does so on a miss, so it
+is never filled with a replica's lagging copy of the data.
+"""
+import time
+from functools import wraps
+from itertools import count
+from threading import Lock
+
+from flask import g, has_request_context, session as user_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.orm import Session
+
+LAST_WRITE_KEY = '_db_last_write'
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context():
+            replica = g.get('_db_replica')
+            if replica is not None:
+                return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        user_session[LAST_WRITE_KEY] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        self._turn = count()
+        self._turn_lock = Lock()
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        app.config.setdefault('DB_REPLICA_SELECTION', 'round_robin')
+        app.config.setdefault('DB_READ_AFTER_WRITE_SECONDS', 10)
+        super(RoutingSQLAlchemy, self).init_app(app)
+
+        @app.after_request
+        def route_header(response):
+            if app.config.get('INSTRUMENTATION_HEADERS') and g.get('_db_route'):
+                response.headers['X-DB-Route'] = g._db_route
+            return response
+
+    def replica_binds(self, app):
+        return sorted(bind for bind in (app.config.get('SQLALCHEMY_BINDS') or {}) if bind.startswith('replica_'))
+
+    def wrote_recently(self, app=None):
+        """Whether the user committed a write in the last DB_READ_AFTER_WRITE_SECONDS."""
+        if not has_request_context():
+            return False
+        app = app or self.get_app()
+        last_write = user_session.get(LAST_WRITE_KEY)
+        return bool(last_write) and time.time() - last_write < app.config['DB_READ_AFTER_WRITE_SECONDS']
+
+    def read_primary(self):
+        """Send the reads of the rest of this request to the primary."""
+        g._db_primary = True
+
+    def reads_replica(self):
+        """Whether this request's reads go to a replica."""
+        return has_request_context() and g.get('_db_route', 'primary') != 'primary'
+
+    def choose_replica(self, app, load=None):
+        """Bind name of the replica for this request, or None for the primary.
+
+        `load(bind)` is how busy a replica is, for ``least_loaded``; it
+        defaults to the connections checked out of the bind's pool.
+        """
+        binds = self.replica_binds(app)
+        if not binds:
+            return None
+        if self.wrote_recently(app) or (has_request_context() and g.get('_db_primary')):
+            return None
+        with self._turn_lock:
+            turn = next(self._turn)
+        # rotate so that ties (and pools without stats) still alternate
+        binds = binds[turn % len(binds):] + binds[:turn % len(binds)]
+        if app.config['DB_REPLICA_SELECTION'] == 'least_loaded':
+            load = load or (lambda bind: pool_stats(self.get_engine(app, bind)).get('checked_out', 0))
+            return min(binds, key=load)
+        return binds[0]
+
+    def replica_reads(self, view):
+        """Serve a read-only view from a replica (see the module docstring)."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            app = self.get_app()
+            bind = self.choose_replica(app)
+            g._db_route = bind or 'primary'
+            if bind is not None:
+                g._db_replica = self.get_engine(app, bind)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                g.pop('_db_replica', None)
+        return wrapper
+
+
+def statement_timeout_per_transaction(timeout_ms):
+    # PgBouncer in transaction mode gives each transaction whichever server
+    # connection is free, so a session-level SET would leak to other clients;
+    # SET LOCAL lasts exactly one transaction
+    @event.listens_for(Session, 'after_begin')
+    def set_statement_timeout(session, transaction, connection):
+        if connection.dialect.name == 'postgresql':
+            connection.execute('SET LOCAL statement_timeout = %d' % timeout_ms)
+
+
+def pool_stats(engine):
+    """Checked-out / idle / overflow connections of a QueuePool, {} for pools without them."""
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+    }
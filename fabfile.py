@@ -5,14 +5,57 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    with settings(warn_only=True):
+        result = local("python -m pytest tests", capture=True)
+    if result.failed and not confirm("Tests failed. Continue?"):
+        abort("Aborted at user request.")
+
+
+def benchmark():
+    # route benchmark against the local baseline (see benchmark.py); record
+    # one first with `fab baseline`
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python benchmark.py --baseline .benchmarks/baseline.json", capture=True
         )
-    if result.failed and not confirm("Tests failed. Continue?"):
+    if result.failed and not confirm("Benchmark regressed. Continue?"):
         abort("Aborted at user request.")
 
 
+def baseline():
+    local("python benchmark.py --save-baseline")
+
+
+def templates():
+    # compile the templates into the cache the workers share
+    local("flask compile-templates")
+
+
+def assets():
+    # bundle, minify, fingerprint and precompress static/ into static/dist
+    local("flask build-assets")
+
+
+def partitions():
+    # create the show month partitions for the year ahead (Postgres)
+    local("flask partitions create")
+
+
+def archive():
+    # move shows past SHOW_ARCHIVE_AFTER_DAYS into show_history
+    local("flask archive-shows")
+
+
+def geocode():
+    # locate the venues that have no coordinates yet
+    local("flask geocode-venues")
+
+
+def prune_outbox():
+    # delete the outbox events handled more than OUTBOX_RETENTION_DAYS ago
+    local("flask outbox prune")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
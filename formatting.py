@@ -0,0 +1,79 @@
+"""Memoized date/time formatting for the templates.
+
+``babel.dates.format_datetime`` resolves its locale and format pattern on
+every call. A page with thousands of show tiles formats the same few patterns,
+and mostly the same few hundred start times, over and over.
+
+``DateTimeFormatter`` resolves each (format, locale) pair to a parsed Babel
+pattern once, and keeps the most recent results per (value, format, locale) in
+a bounded memo. ``format_many`` formats a whole result set in one call,
+resolving the pattern once and formatting each distinct value once. The output
+is the same as ``babel.dates.format_datetime``, naive datetimes included
+(Babel treats them as UTC and does not convert them).
+"""
+from functools import lru_cache
+
+import babel.dates
+from babel import Locale
+
+# the app's format names; any other format is used as a Babel pattern, except
+# Babel's own 'short'/'long' names, which are passed through to Babel
+PATTERNS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+BABEL_FORMATS = ('short', 'long')
+
+
+class DateTimeFormatter(object):
+
+    def __init__(self, locale=None, memo_size=4096):
+        self.locale = locale or babel.dates.LC_TIME or 'en_US'
+        self.format = lru_cache(maxsize=memo_size)(self._format)
+        self.pattern = lru_cache(maxsize=256)(self._pattern)
+
+    def __call__(self, value, format='medium', locale=None):
+        if value is None:
+            return ''
+        return self.format(value, format, locale or self.locale)
+
+    def format_many(self, values, format='medium', locale=None):
+        """Format every value of a result set; returns a list in the same order."""
+        locale = locale or self.locale
+        pattern, parsed_locale = self.pattern(format, locale)
+        formatted = {}
+        results = []
+        for value in values:
+            if value is None:
+                results.append('')
+                continue
+            if value not in formatted:
+                if pattern is None:
+                    formatted[value] = self.format(value, format, locale)
+                else:
+                    formatted[value] = pattern.apply(self._aware(value), parsed_locale)
+            results.append(formatted[value])
+        return results
+
+    def cache_info(self):
+        return {'values': self.format.cache_info(), 'patterns': self.pattern.cache_info()}
+
+    def _pattern(self, format, locale):
+        # (parsed pattern or None for Babel's named formats, Locale)
+        parsed_locale = Locale.parse(locale)
+        if format in BABEL_FORMATS:
+            return None, parsed_locale
+        return babel.dates.parse_pattern(PATTERNS.get(format, format)), parsed_locale
+
+    def _format(self, value, format, locale):
+        pattern, parsed_locale = self.pattern(format, locale)
+        if pattern is None:
+            return babel.dates.format_datetime(value, format, locale=parsed_locale)
+        return pattern.apply(self._aware(value), parsed_locale)
+
+    @staticmethod
+    def _aware(value):
+        # what babel.dates.format_datetime does to a value without a tzinfo
+        if value.tzinfo is None:
+            return value.replace(tzinfo=babel.dates.UTC)
+        return value
@@ -1,8 +1,9 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, ValidationError
-from wtforms.validators import DataRequired, AnyOf, URL,regexp
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField, FloatField, ValidationError
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange, Optional, regexp
 import re
+from booking import MAX_SHOW_DURATION
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -18,6 +19,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # minutes; the venue and the artist are booked until start_time + duration
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION // timedelta(minutes=1))]
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -85,6 +91,13 @@ class VenueForm(Form):
     address = StringField(
         'address', validators=[DataRequired()]
     )
+    # left empty, the venue is located from the geocoding table (geo.py)
+    latitude = FloatField(
+        'latitude', validators=[Optional(), NumberRange(min=-90, max=90)]
+    )
+    longitude = FloatField(
+        'longitude', validators=[Optional(), NumberRange(min=-180, max=180)]
+    )
     phone = StringField(
         'phone',
         validators=[DataRequired(),regexp(regex='^01([0-9]{9})$',message="The Phone number must be in the format(01*********)")]
@@ -0,0 +1,238 @@
+"""Venue coordinates and "venues near a point" queries.
+
+Venues get a latitude/longitude from the offline geocoding table
+(``GeocodeTable``, a CSV of places: ``city,state,latitude,longitude`` and
+optionally ``address`` for street-level rows), unless they were given
+coordinates of their own.
+
+On Postgres, ``venue.location`` is a PostGIS geography point generated from
+the coordinates, with a GiST index. A radius query is ``ST_DWithin`` on it,
+and the nearest-first order is the index's KNN ``<->`` operator, so a query
+reads about as many index entries as it returns. Other databases, such as the
+SQLite files used for local runs, fall back to an in-process ``GridIndex``.
+It is built on first use and kept current with ``reindex``/``remove``, like
+the trigram index of search.py.
+"""
+import csv
+import heapq
+import math
+from collections import defaultdict
+from threading import Lock
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def haversine_km(latitude, longitude, other_latitude, other_longitude):
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude))
+    a = math.sin((other_latitude - latitude) / 2) ** 2 + \
+        math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_point(value):
+    """(latitude, longitude) of a ``"lat,lon"`` string; ValueError if it is not one."""
+    latitude, longitude = [float(part) for part in value.split(',')]
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('not a point: %r' % value)
+    return latitude, longitude
+
+
+def _place_key(address, city, state):
+    return (' '.join((address or '').lower().split()), ' '.join((city or '').lower().split()),
+            (state or '').strip().upper())
+
+
+class GeocodeTable(object):
+    """Places of a CSV file, looked up by address, city and state.
+
+    An address row wins over the city row; a venue whose city is not in the
+    table is not located. The file is read on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._places = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.places)
+
+    @property
+    def places(self):
+        with self._lock:
+            if self._places is None:
+                self._places = self._load()
+            return self._places
+
+    def _load(self):
+        places = {}
+        if not self.path:
+            return places
+        with open(self.path, newline='', encoding='utf-8') as table:
+            for row in csv.DictReader(table):
+                places[_place_key(row.get('address'), row['city'], row['state'])] = \
+                    (float(row['latitude']), float(row['longitude']))
+        return places
+
+    def lookup(self, address, city, state):
+        places = self.places
+        return places.get(_place_key(address, city, state)) or places.get(_place_key(None, city, state))
+
+
+class GridIndex(object):
+    """Points bucketed in `cell_degrees`-wide latitude/longitude cells.
+
+    A radius query visits the cells of the circle's bounding box and measures
+    the points in them. A nearest query widens the radius until it has
+    enough points: any point outside the searched circle is farther away
+    than every point inside it.
+    """
+
+    def __init__(self, cell_degrees=0.25):
+        self.cell_degrees = cell_degrees
+        self.columns = int(math.ceil(360 / cell_degrees))
+        self.points = {}
+        self.cells = defaultdict(dict)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_degrees)),
+                int(math.floor((longitude + 180) / self.cell_degrees)) % self.columns)
+
+    def add(self, id, latitude, longitude):
+        self.remove(id)
+        self.points[id] = (latitude, longitude)
+        self.cells[self._cell(latitude, longitude)][id] = (latitude, longitude)
+
+    def remove(self, id):
+        point = self.points.pop(id, None)
+        if point is not None:
+            cell = self._cell(*point)
+            self.cells[cell].pop(id, None)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def within(self, latitude, longitude, radius_km):
+        """[(distance in km, id)] of the points within `radius_km`, unordered."""
+        latitude_span = radius_km / KM_PER_DEGREE
+        lowest, highest = max(-90.0, latitude - latitude_span), min(90.0, latitude + latitude_span)
+        # the widest longitude span is at the latitude nearest a pole
+        widest = math.cos(math.radians(max(abs(lowest), abs(highest))))
+        longitude_span = 180.0 if widest < 1e-9 else min(180.0, latitude_span / widest)
+        first_row, last_row = self._cell(lowest, 0)[0], self._cell(highest, 0)[0]
+        if longitude_span >= 180:
+            columns = range(self.columns)
+        else:
+            first_column = int(math.floor((longitude - longitude_span + 180) / self.cell_degrees))
+            last_column = int(math.floor((longitude + longitude_span + 180) / self.cell_degrees))
+            columns = sorted({column % self.columns for column in range(first_column, last_column + 1)})
+        found = []
+        for row in range(first_row, last_row + 1):
+            for column in columns:
+                for id, point in self.cells.get((row, column), {}).items():
+                    distance = haversine_km(latitude, longitude, *point)
+                    if distance <= radius_km:
+                        found.append((distance, id))
+        return found
+
+    def nearest(self, latitude, longitude, limit, radius_km=None):
+        """[(distance in km, id)] of the `limit` nearest points (within `radius_km`), nearest first."""
+        maximum = radius_km if radius_km is not None else math.pi * EARTH_RADIUS_KM
+        radius = min(maximum, self.cell_degrees * KM_PER_DEGREE)
+        while True:
+            found = self.within(latitude, longitude, radius)
+            if len(found) >= limit or radius >= maximum:
+                return heapq.nsmallest(limit, found)
+            radius = min(maximum, radius * 4)
+
+
+class VenueLocator(object):
+    """Nearest-first venue queries, in PostGIS or on a GridIndex."""
+
+    def __init__(self, db, model, cell_degrees=0.25):
+        self.db = db
+        self.model = model
+        self.cell_degrees = cell_degrees
+        self._index = None
+        self._lock = Lock()
+
+    @property
+    def in_database(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def _location(self):
+        return self.db.literal_column('%s.location' % self.model.__tablename__)
+
+    def _point(self, latitude, longitude):
+        return self.db.func.ST_GeogFromText('SRID=4326;POINT(%r %r)' % (float(longitude), float(latitude)))
+
+    def nearby(self, latitude, longitude, radius_km, limit, columns=()):
+        """[(distance in km, row)] of the `limit` venues nearest the point, within `radius_km`.
+
+        Rows carry ``id``, ``name`` and the extra `columns`.
+        """
+        if self.in_database:
+            rows = self.nearby_query(latitude, longitude, radius_km, limit, columns).all()
+            return [(row.distance_km, row) for row in rows]
+        found = self._search('nearest', latitude, longitude, limit, radius_km)
+        if not found:
+            return []
+        rows = {row.id: row for row in self.db.session.query(self.model.id, self.model.name, *columns)
+                .filter(self.model.id.in_([id for _, id in found]))}
+        return [(distance, rows[id]) for distance, id in found if id in rows]
+
+    def nearby_query(self, latitude, longitude, radius_km, limit, columns=()):
+        # the PostGIS statement of nearby(): a KNN scan of ix_venue_location
+        db, model = self.db, self.model
+        point = self._point(latitude, longitude)
+        return db.session.query(model.id, model.name, *columns) \
+            .add_columns((db.func.ST_Distance(self._location(), point) / 1000).label('distance_km')) \
+            .filter(db.func.ST_DWithin(self._location(), point, radius_km * 1000)) \
+            .order_by(self._location().op('<->')(point)) \
+            .limit(limit)
+
+    def within(self, latitude, longitude, radius_km):
+        """The venue ids within `radius_km`: a subquery on Postgres, a set otherwise."""
+        if self.in_database:
+            return self.db.session.query(self.model.id).filter(
+                self.db.func.ST_DWithin(self._location(), self._point(latitude, longitude), radius_km * 1000))
+        return {id for _, id in self._search('within', latitude, longitude, radius_km)}
+
+    def reindex(self, id):
+        if self._index is None:
+            return
+        row = self.db.session.query(self.model.latitude, self.model.longitude).filter(self.model.id == id).first()
+        with self._lock:
+            if row is None or row.latitude is None or row.longitude is None:
+                self._index.remove(id)
+            else:
+                self._index.add(id, row.latitude, row.longitude)
+
+    def remove(self, id):
+        if self._index is not None:
+            with self._lock:
+                self._index.remove(id)
+
+    def invalidate(self):
+        # drop the in-process index, it is rebuilt by the next query
+        with self._lock:
+            self._index = None
+
+    def _search(self, method, *args):
+        with self._lock:
+            if self._index is None:
+                self._index = self._build()
+            return getattr(self._index, method)(*args)
+
+    def _build(self):
+        index = GridIndex(self.cell_degrees)
+        rows = self.db.session.query(self.model.id, self.model.latitude, self.model.longitude) \
+            .filter(self.model.latitude.isnot(None), self.model.longitude.isnot(None)) \
+            .yield_per(1000)
+        for id, latitude, longitude in rows:
+            index.add(id, latitude, longitude)
+        return index
@@ -0,0 +1,201 @@
+"""Per-request SQL and render timing, aggregated per endpoint.
+
+``Instrumentation(app)`` hooks the SQLAlchemy cursor events and Flask's
+request hooks and template signals (the signals need ``blinker``). For every
+request it records the number of statements, the time spent in the database
+and in templates, and warns when the same statement shape runs over and over
+within one request -- the usual sign of an N+1 query pattern.
+
+With ``INSTRUMENTATION_HEADERS`` set (the development config does) each
+response carries the figures as ``X-DB-Queries`` / ``X-DB-Time`` /
+``X-Render-Time`` and a ``Server-Timing`` header. ``METRICS_ENDPOINT`` serves
+the per-endpoint totals in the Prometheus text format.
+"""
+import heapq
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+
+from flask import Response, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_in_lists = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)')
+_whitespace = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    # the statement with literals and IN lists folded, so repeats of one query
+    # with different values count as the same shape
+    shape = _literals.sub('?', statement)
+    shape = _in_lists.sub('(?)', shape)
+    return _whitespace.sub(' ', shape).strip()
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.shapes = Counter()
+        self.statements = []
+        self._render_started = []
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self.n_plus_one = 0
+        # (seconds, statement shape) of the slowest statements seen
+        self.slowest = []
+
+
+class Instrumentation(object):
+
+    def __init__(self, app=None):
+        self.endpoints = defaultdict(EndpointStats)
+        self.gauges = []
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION_HEADERS', False)
+        app.config.setdefault('METRICS_ENDPOINT', '/metrics')
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('SLOWEST_STATEMENTS', 5)
+        self.app = app
+
+        # the engine is created lazily, so listen on the class
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if app.config['METRICS_ENDPOINT']:
+            app.add_url_rule(app.config['METRICS_ENDPOINT'], 'metrics', self.metrics)
+
+    def gauge(self, name, help, collect):
+        """Add a gauge to the metrics; collect() returns {label string: value}."""
+        self.gauges.append((name, help, collect))
+
+    @staticmethod
+    def _current():
+        return g.get('_request_stats') if has_request_context() else None
+
+    def _before_request(self):
+        g._request_stats = RequestStats()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is not None:
+            conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        started = conn.info.get('_query_started')
+        if stats is None or not started:
+            return
+        self.count_statement(stats, statement, time.perf_counter() - started.pop())
+
+    @staticmethod
+    def count_statement(stats, statement, elapsed):
+        """Add one statement to a request's `stats`, for drivers the engine events miss.
+
+        A `statement` of None (SQL not at hand) counts toward the totals but
+        not toward the N+1 check or the slowest statements.
+        """
+        stats.queries += 1
+        stats.db_time += elapsed
+        if statement is None:
+            return
+        shape = statement_shape(statement)
+        stats.shapes[shape] += 1
+        stats.statements.append((elapsed, shape))
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats._render_started.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None and stats._render_started:
+            stats.render_time += time.perf_counter() - stats._render_started.pop()
+
+    def _after_request(self, response):
+        stats = g.pop('_request_stats', None)
+        if stats is None or request.endpoint == 'metrics':
+            return response
+        total = time.perf_counter() - stats.started
+        endpoint = request.endpoint or '<unmatched>'
+        threshold = self.app.config['N_PLUS_ONE_THRESHOLD']
+        repeated = [(shape, count) for shape, count in stats.shapes.items() if count >= threshold]
+        for shape, count in repeated:
+            logger.warning('possible N+1 in %s: %d x %s', endpoint, count, shape[:300])
+
+        keep = self.app.config['SLOWEST_STATEMENTS']
+        with self._lock:
+            endpoint_stats = self.endpoints[endpoint]
+            endpoint_stats.requests += 1
+            endpoint_stats.queries += stats.queries
+            endpoint_stats.db_time += stats.db_time
+            endpoint_stats.render_time += stats.render_time
+            endpoint_stats.total_time += total
+            endpoint_stats.n_plus_one += len(repeated)
+            slowest = {shape: elapsed for elapsed, shape in endpoint_stats.slowest}
+            for elapsed, shape in stats.statements:
+                slowest[shape] = max(elapsed, slowest.get(shape, 0))
+            endpoint_stats.slowest = heapq.nlargest(keep, [(elapsed, shape) for shape, elapsed in slowest.items()])
+
+        if self.app.config['INSTRUMENTATION_HEADERS']:
+            response.headers['X-DB-Queries'] = str(stats.queries)
+            response.headers['X-DB-Time'] = '%.1fms' % (stats.db_time * 1000)
+            response.headers['X-Render-Time'] = '%.1fms' % (stats.render_time * 1000)
+            if repeated:
+                response.headers['X-N-Plus-One'] = str(sum(count for _, count in repeated))
+            response.headers['Server-Timing'] = 'db;dur=%.1f, render;dur=%.1f, total;dur=%.1f' % (
+                stats.db_time * 1000, stats.render_time * 1000, total * 1000)
+        return response
+
+    def metrics(self):
+        """Per-endpoint totals in the Prometheus text exposition format."""
+        series = [
+            ('fyyur_requests_total', 'counter', 'Requests served.', 'requests'),
+            ('fyyur_db_queries_total', 'counter', 'SQL statements executed.', 'queries'),
+            ('fyyur_db_seconds_total', 'counter', 'Time spent in SQL statements.', 'db_time'),
+            ('fyyur_render_seconds_total', 'counter', 'Time spent rendering templates.', 'render_time'),
+            ('fyyur_request_seconds_total', 'counter', 'Time spent handling requests.', 'total_time'),
+            ('fyyur_n_plus_one_total', 'counter', 'Repeated statement shapes flagged as N+1.', 'n_plus_one'),
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = []
+            for name, kind, help, attribute in series:
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for endpoint, stats in endpoints:
+                    lines.append('%s{endpoint="%s"} %s' % (name, endpoint, getattr(stats, attribute)))
+            for name, help, collect in self.gauges:
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s gauge' % name)
+                for labels, value in sorted(collect().items()):
+                    lines.append('%s{%s} %s' % (name, labels, value))
+            # the slowest statement shapes, as comments scrapers ignore
+            for endpoint, stats in endpoints:
+                for elapsed, shape in stats.slowest:
+                    lines.append('# slowest endpoint="%s" %.4fs %s' % (endpoint, elapsed, shape[:500]))
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,83 @@
+"""Concurrent HTTP load test, for comparing the WSGI and ASGI serving modes.
+
+    gunicorn -w 4 -b 127.0.0.1:8000 app:app
+    hypercorn -w 4 -b 127.0.0.1:8001 asgi:application
+    python loadtest.py http://127.0.0.1:8000 http://127.0.0.1:8001 --concurrency 10,50,200
+
+Each target is driven by `concurrency` clients that request the --paths in
+turn for --duration seconds; the table lists throughput, latency percentiles
+and failures per target and concurrency level. Only the standard library is
+used, so the client itself does not favour either server.
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+
+async def get(host, port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(('GET %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: close\r\n\r\n' % (path, host, port)).encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def client(target, paths, deadline, timeout, latencies, failures, offset):
+    parts = urlsplit(target)
+    host, port = parts.hostname, parts.port or 80
+    turn = offset
+    while time.perf_counter() < deadline:
+        path = paths[turn % len(paths)]
+        turn += 1
+        started = time.perf_counter()
+        try:
+            status = await get(host, port, path, timeout)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            failures.append(status)
+
+
+async def run(target, paths, concurrency, duration, timeout):
+    latencies, failures = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[client(target, paths, deadline, timeout, latencies, failures, offset)
+                           for offset in range(concurrency)])
+    return latencies, failures
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('targets', nargs='+', help='Base URLs of the servers to compare.')
+    parser.add_argument('--paths', default='/venues,/artists,/shows,/venues/1,/artists/1')
+    parser.add_argument('--concurrency', default='10,50,200', help='Comma-separated client counts.')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds per target and level.')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+    paths = args.paths.split(',')
+
+    print('%-28s %6s %9s %9s %9s %8s' % ('target', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'failed'))
+    for concurrency in [int(level) for level in args.concurrency.split(',')]:
+        for target in args.targets:
+            latencies, failures = asyncio.run(run(target, paths, concurrency, args.duration, args.timeout))
+            print('%-28s %6d %9.1f %9.1f %9.1f %8d' % (
+                target, concurrency, len(latencies) / args.duration,
+                percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, len(failures)))
+
+
+if __name__ == '__main__':
+    main()
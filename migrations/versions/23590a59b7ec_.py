@@ -0,0 +1,113 @@
+"""normalize genres into a lookup table
+
+Revision ID: 23590a59b7ec
+Revises: ae1b2960274b
+Create Date: 2026-10-18 11:20:53.004127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '23590a59b7ec'
+down_revision = 'ae1b2960274b'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+genre = sa.table('genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+
+
+def upgrade():
+    op.create_table('genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genre',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genre_genre_id', 'venue_genre', ['genre_id', 'venue_id'])
+    op.create_table('artist_genre',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genre_genre_id', 'artist_genre', ['genre_id', 'artist_id'])
+
+    # move the comma-joined genres into the link tables
+    bind = op.get_bind()
+    genre_ids = {}
+    for table, key in [('venue', 'venue_id'), ('artist', 'artist_id')]:
+        source = sa.table(table, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        link = sa.table(table + '_genre', sa.column(key, sa.Integer), sa.column('genre_id', sa.Integer))
+        last_id = 0
+        while True:
+            rows = bind.execute(sa.select([source.c.id, source.c.genres])
+                                .where(source.c.id > last_id)
+                                .order_by(source.c.id)
+                                .limit(BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            links = []
+            for id, genres in rows:
+                names = dict.fromkeys(name.strip() for name in (genres or '').split(',') if name.strip())
+                for name in names:
+                    if name not in genre_ids:
+                        bind.execute(genre.insert().values(name=name))
+                        genre_ids[name] = bind.execute(
+                            sa.select([genre.c.id]).where(genre.c.name == name)).scalar()
+                    links.append({key: id, 'genre_id': genre_ids[name]})
+            if links:
+                op.bulk_insert(link, links)
+
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_venue_genres_trgm', table_name='venue')
+        op.drop_index('ix_artist_genres_trgm', table_name='artist')
+    with op.batch_alter_table('venue') as batch_op:
+        batch_op.drop_column('genres')
+    with op.batch_alter_table('artist') as batch_op:
+        batch_op.drop_column('genres')
+
+
+def downgrade():
+    with op.batch_alter_table('venue') as batch_op:
+        batch_op.add_column(sa.Column('genres', sa.String(), nullable=True))
+    with op.batch_alter_table('artist') as batch_op:
+        batch_op.add_column(sa.Column('genres', sa.String(), nullable=True))
+
+    # rebuild the comma-joined columns from the link tables
+    bind = op.get_bind()
+    for table, key in [('venue', 'venue_id'), ('artist', 'artist_id')]:
+        target = sa.table(table, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        link = sa.table(table + '_genre', sa.column(key, sa.Integer), sa.column('genre_id', sa.Integer))
+        rows = bind.execute(sa.select([link.c[key], genre.c.name])
+                            .select_from(link.join(genre, genre.c.id == link.c.genre_id))
+                            .order_by(link.c[key], genre.c.name))
+        names_by_id = {}
+        for id, name in rows.fetchall():
+            names_by_id.setdefault(id, []).append(name)
+        for id, names in names_by_id.items():
+            bind.execute(target.update().where(target.c.id == id).values(genres=','.join(names)))
+
+    if bind.dialect.name == 'postgresql':
+        op.create_index('ix_venue_genres_trgm', 'venue', ['genres'],
+                        postgresql_using='gin', postgresql_ops={'genres': 'gin_trgm_ops'})
+        op.create_index('ix_artist_genres_trgm', 'artist', ['genres'],
+                        postgresql_using='gin', postgresql_ops={'genres': 'gin_trgm_ops'})
+
+    op.drop_index('ix_artist_genre_genre_id', table_name='artist_genre')
+    op.drop_table('artist_genre')
+    op.drop_index('ix_venue_genre_genre_id', table_name='venue_genre')
+    op.drop_table('venue_genre')
+    op.drop_table('genre')
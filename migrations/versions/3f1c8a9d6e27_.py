@@ -0,0 +1,122 @@
+"""partition show by month of start_date
+
+Revision ID: 3f1c8a9d6e27
+Revises: 9b2d7e4c1a58
+Create Date: 2026-10-18 17:05:31.284417
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c8a9d6e27'
+down_revision = '9b2d7e4c1a58'
+branch_labels = None
+depends_on = None
+
+# month partitions are created from the first show through this many months
+# ahead; later months are added by `flask partitions create`
+MONTHS_AHEAD = 12
+INDEXES = [('ix_show_venue_id_start_date', 'venue_id, start_date'),
+           ('ix_show_artist_id_start_date', 'artist_id, start_date'),
+           ('ix_show_start_date_id', 'start_date, id'),
+           ('ix_show_updated_at_id', 'updated_at, id')]
+CONSTRAINTS = [('ex_show_venue_booking', 'venue_id'), ('ex_show_artist_booking', 'artist_id')]
+COLUMNS = 'id, venue_id, artist_id, start_date, end_date, updated_at'
+TABLE = """
+    CREATE TABLE %s (
+        id INTEGER NOT NULL DEFAULT nextval('show_id_seq'),
+        venue_id INTEGER REFERENCES venue (id),
+        artist_id INTEGER REFERENCES artist (id),
+        start_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        end_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        updated_at TIMESTAMP WITHOUT TIME ZONE
+    )"""
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def add_constraints(table, suffix=''):
+    for name, column in CONSTRAINTS:
+        op.execute('ALTER TABLE %s ADD CONSTRAINT %s%s EXCLUDE USING gist '
+                   '(%s WITH =, tsrange(start_date, end_date) WITH &&)' % (table, name, suffix, column))
+
+
+def detach_table(table):
+    # drops what names the table's indexes and constraints take, so the new
+    # table can be created under them
+    for name, _ in CONSTRAINTS:
+        op.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' % (table, name))
+    for name, _ in INDEXES:
+        op.execute('DROP INDEX IF EXISTS %s' % name)
+    op.execute('ALTER TABLE %s DROP CONSTRAINT show_pkey' % table)
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY NONE')
+
+
+def upgrade():
+    # the partition key has to be part of the primary key, so start_date can no
+    # longer be null (the end_date migration refuses to run while a show has none)
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('show') as batch_op:
+            batch_op.alter_column('start_date', existing_type=sa.DateTime(), nullable=False)
+        return
+
+    connection = op.get_bind()
+    op.execute('ALTER TABLE show RENAME TO show_unpartitioned')
+    detach_table('show_unpartitioned')
+
+    op.execute((TABLE % 'show') + ' PARTITION BY RANGE (start_date)')
+    op.execute('CREATE TABLE show_default PARTITION OF show DEFAULT')
+    now = datetime.utcnow()
+    first = connection.execute(sa.text('SELECT min(start_date) FROM show_unpartitioned')).scalar() or now
+    month, last = datetime(first.year, first.month, 1), datetime(now.year, now.month, 1)
+    for _ in range(MONTHS_AHEAD):
+        last = next_month(last)
+    months = []
+    while month <= last:
+        name = 'show_y%04dm%02d' % (month.year, month.month)
+        op.execute("CREATE TABLE %s PARTITION OF show FOR VALUES FROM ('%s') TO ('%s')"
+                   % (name, month.isoformat(' '), next_month(month).isoformat(' ')))
+        months.append((name, month))
+        month = next_month(month)
+
+    # rows are routed to their month; the indexes and constraints are built
+    # after the copy, once per partition
+    op.execute('INSERT INTO show (%s) SELECT %s FROM show_unpartitioned' % (COLUMNS, COLUMNS))
+    op.execute('ALTER TABLE show ADD PRIMARY KEY (id, start_date)')
+    for name, columns in INDEXES:
+        op.execute('CREATE INDEX %s ON show (%s)' % (name, columns))
+    add_constraints('show_default', '_default')
+    for name, month in months:
+        add_constraints(name, month.strftime('_y%Ym%m'))
+    op.execute('DROP TABLE show_unpartitioned')
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY show.id')
+    op.execute('ANALYZE show')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('show') as batch_op:
+            batch_op.alter_column('start_date', existing_type=sa.DateTime(), nullable=True)
+        return
+
+    # partitions detached by `flask partitions detach` are left where they are
+    op.execute('ALTER TABLE show RENAME TO show_partitioned')
+    op.execute('ALTER TABLE show_partitioned DROP CONSTRAINT show_pkey')
+    for name, _ in INDEXES:
+        op.execute('DROP INDEX IF EXISTS %s' % name)
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY NONE')
+    op.execute(TABLE % 'show')
+    op.execute('INSERT INTO show (%s) SELECT %s FROM show_partitioned' % (COLUMNS, COLUMNS))
+    op.execute('DROP TABLE show_partitioned')
+    op.execute('ALTER TABLE show ADD CONSTRAINT show_pkey PRIMARY KEY (id)')
+    op.execute('ALTER TABLE show ALTER COLUMN start_date DROP NOT NULL')
+    for name, columns in INDEXES:
+        op.execute('CREATE INDEX %s ON show (%s)' % (name, columns))
+    add_constraints('show')
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY show.id')
@@ -0,0 +1,42 @@
+"""outbox of post-write events
+
+Revision ID: 5b9e0d3a7c14
+Revises: e85b3d6f0c12
+Create Date: 2026-10-18 21:12:08.417296
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e0d3a7c14'
+down_revision = 'e85b3d6f0c12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=100), nullable=False),
+    sa.Column('topic', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('claim', sa.String(length=32), nullable=True),
+    sa.Column('claimed_until', sa.DateTime(), nullable=True),
+    sa.Column('done_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+    # only the pending events are indexed for the workers' claim
+    op.create_index('ix_outbox_pending', 'outbox', ['available_at', 'id'],
+                    postgresql_where=sa.text('done_at IS NULL'), sqlite_where=sa.text('done_at IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_outbox_pending', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,38 @@
+"""updated_at columns for incremental exports
+
+Revision ID: 6c0f3b9e2d41
+Revises: 23590a59b7ec
+Create Date: 2026-10-18 13:05:41.218370
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c0f3b9e2d41'
+down_revision = '23590a59b7ec'
+branch_labels = None
+depends_on = None
+
+TABLES = ['venue', 'artist', 'show']
+
+
+def upgrade():
+    # existing rows count as changed now, so the first --since export after
+    # the upgrade is a full one
+    now = datetime.utcnow()
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        target = sa.table(table, sa.column('updated_at', sa.DateTime))
+        op.execute(target.update().values(updated_at=now))
+        op.create_index('ix_%s_updated_at_id' % table, table, ['updated_at', 'id'])
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index('ix_%s_updated_at_id' % table, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
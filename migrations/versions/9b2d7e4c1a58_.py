@@ -0,0 +1,79 @@
+"""show end_date and the no-double-booking constraints
+
+Revision ID: 9b2d7e4c1a58
+Revises: 6c0f3b9e2d41
+Create Date: 2026-10-18 15:42:09.530112
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d7e4c1a58'
+down_revision = '6c0f3b9e2d41'
+branch_labels = None
+depends_on = None
+
+DEFAULT_MINUTES = 120
+CONSTRAINTS = [('ex_show_venue_booking', 'venue_id'), ('ex_show_artist_booking', 'artist_id')]
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    # a show without a start books nothing and cannot be given an end; the
+    # form and the import always required one, so any such rows were written
+    # by hand and are left for the operator to fix rather than dropped
+    dateless = [row[0] for row in op.get_bind().execute('SELECT id FROM show WHERE start_date IS NULL ORDER BY id')]
+    if dateless:
+        message = ('%d show(s) have no start_date (ids %s%s). Set their start_date, or delete them '
+                   '(DELETE FROM show WHERE start_date IS NULL), then run the upgrade again.'
+                   % (len(dateless), ', '.join(str(id) for id in dateless[:20]), ', ...' if len(dateless) > 20 else ''))
+        # flask db upgrade turns the error into a bare exit status, so log it first
+        logger.error(message)
+        raise RuntimeError(message)
+    op.add_column('show', sa.Column('end_date', sa.DateTime(), nullable=True))
+    # existing shows get the default duration, cut short where the venue or the
+    # artist has its next show sooner (ties broken by id, which leaves exact
+    # duplicates an empty range) so that the history satisfies the constraints
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("""
+            UPDATE show SET end_date = bounded.end_date
+            FROM (SELECT id, LEAST(start_date + interval '%d minutes',
+                                   LEAD(start_date) OVER (PARTITION BY venue_id ORDER BY start_date, id),
+                                   LEAD(start_date) OVER (PARTITION BY artist_id ORDER BY start_date, id)) AS end_date
+                  FROM show) AS bounded
+            WHERE show.id = bounded.id
+        """ % DEFAULT_MINUTES)
+    else:
+        op.execute("""
+            UPDATE show SET end_date = min(
+                strftime('%%Y-%%m-%%d %%H:%%M:%%f000', start_date, '+%d minutes'),
+                coalesce((SELECT min(later.start_date) FROM show AS later
+                          WHERE later.venue_id = show.venue_id
+                            AND (later.start_date > show.start_date
+                                 OR (later.start_date = show.start_date AND later.id > show.id))), '9999'),
+                coalesce((SELECT min(later.start_date) FROM show AS later
+                          WHERE later.artist_id = show.artist_id
+                            AND (later.start_date > show.start_date
+                                 OR (later.start_date = show.start_date AND later.id > show.id))), '9999'))
+        """ % DEFAULT_MINUTES)
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.alter_column('end_date', existing_type=sa.DateTime(), nullable=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # equality on an integer inside a GiST index needs btree_gist
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for name, column in CONSTRAINTS:
+            op.execute('ALTER TABLE show ADD CONSTRAINT %s EXCLUDE USING gist '
+                       '(%s WITH =, tsrange(start_date, end_date) WITH &&)' % (name, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, _ in CONSTRAINTS:
+            op.drop_constraint(name, 'show')
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.drop_column('end_date')
@@ -0,0 +1,42 @@
+"""trigram indexes for city/genre search
+
+Revision ID: ae1b2960274b
+Revises: d1e545aaee3d
+Create Date: 2026-10-18 10:02:17.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ae1b2960274b'
+down_revision = 'd1e545aaee3d'
+branch_labels = None
+depends_on = None
+
+# search.CatalogSearch matches name, city and genres with ILIKE '%term%'; on
+# Postgres each column gets a GIN trigram index so the OR is a BitmapOr of
+# index scans. Other databases use the in-process index instead.
+TRIGRAM_INDEXES = [
+    ('ix_venue_city_trgm', 'venue', 'city'),
+    ('ix_venue_genres_trgm', 'venue', 'genres'),
+    ('ix_artist_city_trgm', 'artist', 'city'),
+    ('ix_artist_genres_trgm', 'artist', 'genres'),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        op.create_index(name, table, [column],
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        op.drop_index(name, table_name=table)
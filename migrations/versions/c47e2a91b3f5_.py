@@ -0,0 +1,37 @@
+"""show_history: archived shows per venue and artist
+
+Revision ID: c47e2a91b3f5
+Revises: 3f1c8a9d6e27
+Create Date: 2026-10-18 18:21:46.907315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a91b3f5'
+down_revision = '3f1c8a9d6e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_history',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.Column('first_date', sa.DateTime(), nullable=False),
+    sa.Column('last_date', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'artist_id')
+    )
+    op.create_index('ix_show_history_venue_id_last_date', 'show_history', ['venue_id', 'last_date'])
+    op.create_index('ix_show_history_artist_id_last_date', 'show_history', ['artist_id', 'last_date'])
+
+
+def downgrade():
+    op.drop_index('ix_show_history_artist_id_last_date', table_name='show_history')
+    op.drop_index('ix_show_history_venue_id_last_date', table_name='show_history')
+    op.drop_table('show_history')
@@ -0,0 +1,45 @@
+"""index the hot lookup paths
+
+Revision ID: d1e545aaee3d
+Revises: 4a0f137119dc
+Create Date: 2026-10-18 09:12:40.118263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1e545aaee3d'
+down_revision = '4a0f137119dc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_show_venue_id_start_date', 'show', ['venue_id', 'start_date'])
+    op.create_index('ix_show_artist_id_start_date', 'show', ['artist_id', 'start_date'])
+    op.create_index('ix_show_start_date_id', 'show', ['start_date', 'id'])
+    op.create_index('ix_venue_state_city_name', 'venue', ['state', 'city', 'name', 'id'])
+    op.create_index('ix_artist_name_id', 'artist', ['name', 'id'])
+
+    # case-insensitive substring search (name ILIKE '%term%') can only use a
+    # trigram index; these are Postgres-only and not declared on the models
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_venue_name_trgm', 'venue', ['name'],
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_artist_name_trgm', 'artist', ['name'],
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_artist_name_trgm', table_name='artist')
+        op.drop_index('ix_venue_name_trgm', table_name='venue')
+
+    op.drop_index('ix_artist_name_id', table_name='artist')
+    op.drop_index('ix_venue_state_city_name', table_name='venue')
+    op.drop_index('ix_show_start_date_id', table_name='show')
+    op.drop_index('ix_show_artist_id_start_date', table_name='show')
+    op.drop_index('ix_show_venue_id_start_date', table_name='show')
@@ -0,0 +1,40 @@
+"""venue latitude/longitude and the spatial index
+
+Revision ID: e85b3d6f0c12
+Revises: c47e2a91b3f5
+Create Date: 2026-10-18 19:37:12.660581
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e85b3d6f0c12'
+down_revision = 'c47e2a91b3f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    # existing venues are located by `flask geocode-venues`
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        # kept in step with the coordinates by the database; the app only reads it
+        op.execute("""
+            ALTER TABLE venue ADD COLUMN location geography(Point, 4326) GENERATED ALWAYS AS (
+                CASE WHEN latitude IS NOT NULL AND longitude IS NOT NULL
+                     THEN ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography END) STORED
+        """)
+        op.execute('CREATE INDEX ix_venue_location ON venue USING gist (location)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_venue_location')
+        op.execute('ALTER TABLE venue DROP COLUMN location')
+    with op.batch_alter_table('venue') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,358 @@
+"""Transactional outbox: side effects of a write, run after its commit.
+
+A write handler records what has to happen next (``publish``) in the
+``outbox`` table, in the same transaction as the write. The rows commit or
+roll back with the entity, so an effect is never lost after a commit and
+never runs for a write that did not commit. There is no broker: the table
+is the queue, on Postgres as on SQLite. An event has two kinds of consumers:
+
+* a ``handler`` runs once per event, in whichever process claims it. It is
+  for durable effects (database writes, shared caches, notifications).
+  Worker threads (``start``) drain the table in batches, so a write request
+  only pays for its own insert.
+* ``listener``s run in every process, for the state a process keeps in
+  memory. A listener thread reads the events past the last one the process
+  has seen, whoever claimed them. Ids can commit out of order, so the ids
+  skipped over are read again for ``gap_seconds``. A listener that raises
+  is not run again; its ``resync`` (e.g. dropping the state) runs instead.
+
+``wake`` lets both start at once after a commit; other processes' events are
+picked up every ``poll_seconds``.
+
+A batch is claimed with a conditional UPDATE: ``FOR UPDATE SKIP LOCKED`` on
+Postgres, and SQLite serializes writers. The claim is a token plus a lease,
+so rows of a worker that died are claimed again once the lease ends. The
+events of a batch are passed to the topic's handler together. A handler
+that raises is retried with exponential backoff, up to ``max_attempts``, and
+then marked done with its error. A retried event keeps its idempotency
+``key``, which handlers with external effects should pass on so that a
+repeated delivery is recognised. A handler's own database writes commit with
+the events being marked done, so they happen once. Other effects have to be
+idempotent: an event runs again if its worker dies before marking it done.
+"""
+import json
+import logging
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox(object):
+    """Publish events in the write's transaction; drain them with handlers per topic."""
+
+    # most ids skipped over at once that are waited for
+    max_gap = 1000
+
+    def __init__(self, db, model, batch_size=100, max_attempts=8, backoff_seconds=1.0,
+                 max_backoff_seconds=600.0, lease_seconds=60, gap_seconds=60):
+        self.db = db
+        self.model = model
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.gap_seconds = gap_seconds
+        self.handlers = {}
+        self.listeners = {}
+        self.resyncs = {}
+        self.counts = Counter()
+        self._counts_lock = Lock()
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._threads = []
+        self._app = None
+        # listener state: last id seen, {skipped id: read until}
+        self._listening = None
+        self._listen = Event()
+        self._mark = None
+        self._gaps = {}
+        self._replay_lock = Lock()
+
+    def handler(self, topic):
+        """Register ``handler(events)`` for `topic`; events are (key, payload) pairs."""
+        def register(function):
+            self.handlers[topic] = function
+            return function
+        return register
+
+    def listener(self, topic, resync=None):
+        """Register ``listener(events)`` for `topic`, run in every process; events are (key, payload) pairs.
+
+        ``resync()`` runs when the listener raised, as its events are not read again.
+        """
+        def register(function):
+            self.listeners[topic] = function
+            self.resyncs[topic] = resync
+            return function
+        return register
+
+    def publish(self, topic, payload, key=None, connection=None):
+        """Add an event to the current transaction (of the session, or of `connection`); return its idempotency key."""
+        now = datetime.utcnow()
+        key = key or '%s:%s' % (topic, uuid.uuid4().hex)
+        event = dict(key=key, topic=topic, payload=json.dumps(payload, separators=(',', ':')),
+                     created_at=now, available_at=now)
+        if connection is None:
+            self.db.session.add(self.model(**event))
+        else:
+            connection.execute(self.model.__table__.insert().values(**event))
+        return key
+
+    def wake(self):
+        # after a commit: the workers pick the events up now; with no workers
+        # running, the request runs a batch itself
+        if self._threads:
+            self._wakeup.set()
+        else:
+            self.run_batch()
+        if self._listening is not None:
+            self._listen.set()
+        elif self.listeners:
+            self.replay()
+
+    # workers
+    # -------
+
+    def start(self, app, workers=2, poll_seconds=1.0):
+        """Start `workers` daemon threads draining the outbox, and the listener thread, in `app`'s context."""
+        if self._threads or self._listening is not None:
+            return
+        self._app = app
+        self._stopping.clear()
+        for number in range(workers):
+            thread = Thread(target=self._work, args=(poll_seconds,), name='outbox-%d' % number, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.listeners:
+            # the mark is set before this process builds any state
+            with app.app_context():
+                try:
+                    self.replay()
+                except Exception:
+                    logger.exception('outbox replay failed')
+                finally:
+                    self.db.session.remove()
+            self._listening = Thread(target=self._follow, args=(poll_seconds,), name='outbox-listener', daemon=True)
+            self._listening.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        self._listen.set()
+        for thread in self._threads + [thread for thread in [self._listening] if thread]:
+            thread.join(timeout)
+        self._threads = []
+        self._listening = None
+
+    def _work(self, poll_seconds):
+        with self._app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    handled = self.run_batch()
+                except Exception:
+                    logger.exception('outbox batch failed')
+                    self.db.session.rollback()
+                    handled = 0
+                finally:
+                    self.db.session.remove()
+                if not handled:
+                    self._wakeup.wait(poll_seconds)
+                    self._wakeup.clear()
+
+    def _follow(self, poll_seconds):
+        with self._app.app_context():
+            while not self._stopping.is_set():
+                self._listen.wait(poll_seconds)
+                self._listen.clear()
+                try:
+                    self.replay()
+                except Exception:
+                    logger.exception('outbox replay failed')
+                    self.db.session.rollback()
+                finally:
+                    self.db.session.remove()
+
+    # draining
+    # --------
+
+    def drain(self, limit=None):
+        """Run batches until none is due (or `limit` events ran); return the events run."""
+        handled = 0
+        while limit is None or handled < limit:
+            count = self.run_batch()
+            if not count:
+                break
+            handled += count
+        return handled
+
+    def run_batch(self):
+        """Claim up to batch_size due events, run their handlers; return how many were claimed."""
+        token = uuid.uuid4().hex
+        events = self._claim(token)
+        topics = OrderedDict()
+        for event in events:
+            topics.setdefault(event.topic, []).append(event)
+        for topic, batch in topics.items():
+            self._run(topic, batch, token)
+        return len(events)
+
+    def due_query(self, now):
+        """Ids of the next batch of due, unclaimed events (read through ix_outbox_pending)."""
+        db, model = self.db, self.model
+        return db.session.query(model.id) \
+            .filter(model.done_at.is_(None), model.available_at <= now,
+                    db.or_(model.claimed_until.is_(None), model.claimed_until < now)) \
+            .order_by(model.available_at, model.id) \
+            .limit(self.batch_size)
+
+    def _claim(self, token):
+        db, model = self.db, self.model
+        now = datetime.utcnow()
+        due = self.due_query(now).with_for_update(skip_locked=True)
+        # the claim conditions again: a row claimed since the subquery read it is left alone
+        claimed = db.session.query(model) \
+            .filter(model.id.in_(due), model.done_at.is_(None),
+                    db.or_(model.claimed_until.is_(None), model.claimed_until < now)) \
+            .update({model.claim: token, model.claimed_until: now + timedelta(seconds=self.lease_seconds),
+                     model.attempts: model.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return []
+        return db.session.query(model.id, model.key, model.topic, model.payload, model.attempts) \
+            .filter(model.claim == token).order_by(model.id).all()
+
+    def _run(self, topic, events, token):
+        db, model = self.db, self.model
+        ids = [event.id for event in events]
+        try:
+            handler = self.handlers.get(topic)
+            if handler is None and topic not in self.listeners:
+                raise LookupError('no handler for outbox topic %r' % topic)
+            if handler is not None:
+                handler([(event.key, json.loads(event.payload)) for event in events])
+            # in the handler's transaction: database writes of a handler
+            # commit together with the events being marked done
+            db.session.query(model).filter(model.id.in_(ids), model.claim == token) \
+                .update({model.done_at: datetime.utcnow(), model.claim: None, model.claimed_until: None,
+                         model.last_error: None}, synchronize_session=False)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            logger.warning('outbox %s: %d events failed: %r', topic, len(events), error)
+            self._failed(events, token, error)
+            return
+        self._count(topic, 'done', len(events))
+
+    def _failed(self, events, token, error):
+        db, model = self.db, self.model
+        now = datetime.utcnow()
+        for event in events:
+            retry = event.attempts < self.max_attempts
+            delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (event.attempts - 1))
+            db.session.query(model).filter(model.id == event.id, model.claim == token) \
+                .update({model.claim: None, model.claimed_until: None, model.last_error: repr(error)[:1000],
+                         model.available_at: now + timedelta(seconds=delay),
+                         model.done_at: None if retry else now}, synchronize_session=False)
+            if not retry:
+                logger.error('outbox %s: gave up on %s after %d attempts', event.topic, event.key, event.attempts)
+            self._count(event.topic, 'retried' if retry else 'abandoned')
+        db.session.commit()
+
+    # listening
+    # ---------
+
+    def replay(self):
+        """Run the listeners on the events this process has not seen yet; return how many were read.
+
+        The first call only sets the mark to the latest event: state built
+        after it comes from the database, which has the earlier writes.
+        """
+        db, model = self.db, self.model
+        with self._replay_lock:
+            if self._mark is None:
+                self._mark = db.session.query(db.func.max(model.id)).scalar() or 0
+                db.session.commit()
+                return 0
+            read = 0
+            while True:
+                now = datetime.utcnow()
+                self._gaps = {id: until for id, until in self._gaps.items() if until > now}
+                condition = model.id > self._mark
+                if self._gaps:
+                    condition = db.or_(condition, model.id.in_(list(self._gaps)))
+                events = db.session.query(model.id, model.key, model.topic, model.payload) \
+                    .filter(condition).order_by(model.id).limit(self.batch_size).all()
+                db.session.commit()
+                for event in events:
+                    self._gaps.pop(event.id, None)
+                    # ids skipped over may belong to transactions still open (a
+                    # jump past max_gap is a sequence that moved on, not a gap)
+                    if event.id - self._mark <= self.max_gap:
+                        until = now + timedelta(seconds=self.gap_seconds)
+                        self._gaps.update((id, until) for id in range(self._mark + 1, event.id))
+                    self._mark = max(self._mark, event.id)
+                topics = OrderedDict()
+                for event in events:
+                    if event.topic in self.listeners:
+                        topics.setdefault(event.topic, []).append((event.key, json.loads(event.payload)))
+                for topic, batch in topics.items():
+                    try:
+                        self.listeners[topic](batch)
+                    except Exception:
+                        logger.exception('outbox %s: listener failed on %d events', topic, len(batch))
+                        db.session.rollback()
+                        self._count(topic, 'resynced', len(batch))
+                        if self.resyncs[topic] is not None:
+                            self.resyncs[topic]()
+                    else:
+                        self._count(topic, 'applied', len(batch))
+                read += len(events)
+                if len(events) < self.batch_size:
+                    return read
+
+    def _count(self, topic, outcome, number=1):
+        with self._counts_lock:
+            self.counts[(topic, outcome)] += number
+
+    # maintenance
+    # -----------
+
+    def pending(self):
+        """{topic: (due events, events waiting for a retry)}."""
+        db, model = self.db, self.model
+        now = datetime.utcnow()
+        rows = db.session.query(model.topic, db.func.sum(db.case([(model.available_at <= now, 1)], else_=0)),
+                                db.func.sum(db.case([(model.available_at > now, 1)], else_=0))) \
+            .filter(model.done_at.is_(None)).group_by(model.topic)
+        return {topic: (int(due or 0), int(waiting or 0)) for topic, due, waiting in rows}
+
+    def abandoned(self, limit=20):
+        """The latest events given up on: (key, topic, attempts, done_at, last_error) rows."""
+        model = self.model
+        return self.db.session.query(model.key, model.topic, model.attempts, model.done_at, model.last_error) \
+            .filter(model.done_at.isnot(None), model.last_error.isnot(None)) \
+            .order_by(model.done_at.desc()).limit(limit).all()
+
+    def retry(self, keys=None):
+        """Make abandoned events (all, or those of `keys`) due again; return how many."""
+        model = self.model
+        query = self.db.session.query(model).filter(model.done_at.isnot(None), model.last_error.isnot(None))
+        if keys:
+            query = query.filter(model.key.in_(keys))
+        count = query.update({model.done_at: None, model.attempts: 0, model.available_at: datetime.utcnow()},
+                             synchronize_session=False)
+        self.db.session.commit()
+        return count
+
+    def prune(self, before):
+        """Delete the events handled before `before`, keeping abandoned ones; return how many."""
+        model = self.model
+        count = self.db.session.query(model) \
+            .filter(model.done_at < before, model.last_error.is_(None)) \
+            .delete(synchronize_session=False)
+        self.db.session.commit()
+        return count
@@ -0,0 +1,114 @@
+"""Monthly range partitions of the ``show`` table (Postgres).
+
+Migration 3f1c8a9d6e27 partitions ``show`` by range of ``start_date``. Each
+month is its own table (``show_y2030m01``), and ``show_default`` takes the
+start dates that have no month table yet. A query bounded on ``start_date``
+(the ``/shows?from=&to=`` window, a venue's upcoming shows) only reads the
+months it overlaps. The no-double-booking exclusion constraints are per
+partition, named ``ex_show_<resource>_booking_y<year>m<month>``.
+
+* ``create_partitions`` adds the month tables up to a date, moving their rows
+  out of the default partition.
+* ``detach_partitions`` detaches the months before a date from ``show``. It
+  can also move them to an archive schema and/or tablespace, where they stay
+  queryable as plain tables.
+
+Exclusion constraints cannot span partitions, so two concurrent bookings that
+straddle a month boundary are only caught by the application check.
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+PARENT = 'show'
+DEFAULT = 'show_default'
+RESOURCES = ['venue', 'artist']
+
+_month_name = re.compile(r'^show_y(\d{4})m(\d{2})$')
+_identifier = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+def month_of(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'show_y%04dm%02d' % (month.year, month.month)
+
+
+def add_booking_constraints(connection, table, suffix):
+    for resource in RESOURCES:
+        connection.execute('ALTER TABLE %s ADD CONSTRAINT ex_show_%s_booking%s EXCLUDE USING gist '
+                           '(%s_id WITH =, tsrange(start_date, end_date) WITH &&)'
+                           % (table, resource, suffix, resource))
+
+
+def is_partitioned(connection):
+    return connection.dialect.name == 'postgresql' and connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent)"),
+        parent=PARENT).scalar() is not None
+
+
+def month_partitions(connection):
+    """{month: table name} of the attached month partitions."""
+    names = connection.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = to_regclass(:parent)'), parent=PARENT)
+    months = {}
+    for name, in names:
+        match = _month_name.match(name)
+        if match:
+            months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def create_partition(connection, month):
+    # built detached and attached last, so the rows it takes over from the
+    # default partition move in the same transaction
+    name = partition_name(month)
+    bounds = {'lower': month, 'upper': next_month(month)}
+    connection.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (name, PARENT))
+    connection.execute(text('WITH moved AS (DELETE FROM %s WHERE start_date >= :lower AND start_date < :upper '
+                            'RETURNING *) INSERT INTO %s SELECT * FROM moved' % (DEFAULT, name)), **bounds)
+    add_booking_constraints(connection, name, month.strftime('_y%Ym%m'))
+    connection.execute(text("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+                            % (PARENT, name, bounds['lower'].isoformat(' '), bounds['upper'].isoformat(' '))))
+    return name
+
+
+def create_partitions(connection, through, start=None):
+    """Create the missing month partitions from `start` (default: this month) through `through`."""
+    existing = month_partitions(connection)
+    month = month_of(start or datetime.utcnow())
+    created = []
+    while month <= through:
+        if month not in existing:
+            created.append(create_partition(connection, month))
+        month = next_month(month)
+    return created
+
+
+def detach_partitions(connection, before, schema=None, tablespace=None):
+    """Detach the month partitions entirely before `before`; returns their (qualified) names."""
+    for identifier in [schema, tablespace]:
+        if identifier and not _identifier.match(identifier):
+            raise ValueError('not a plain identifier: %r' % identifier)
+    detached = []
+    for month, name in sorted(month_partitions(connection).items()):
+        if next_month(month) > before:
+            continue
+        connection.execute('ALTER TABLE %s DETACH PARTITION %s' % (PARENT, name))
+        if schema:
+            connection.execute('CREATE SCHEMA IF NOT EXISTS %s' % schema)
+            connection.execute('ALTER TABLE %s SET SCHEMA %s' % (name, schema))
+            name = '%s.%s' % (schema, name)
+        if tablespace:
+            connection.execute('ALTER TABLE %s SET TABLESPACE %s' % (name, tablespace))
+        detached.append(name)
+    return detached
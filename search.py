@@ -0,0 +1,192 @@
+"""Ranked name/city/genre search over venues and artists.
+
+On Postgres the match runs in the database against the pg_trgm GIN indexes
+(ILIKE '%term%' is served by a bitmap scan of them) and the genre link table.
+Other databases, such as the SQLite files used for local runs, fall back to an
+in-process trigram index that is built on first use and kept current with
+``reindex``/``remove``.
+"""
+from collections import defaultdict
+from threading import Lock
+
+
+def like_escape(term):
+    # make user input literal inside a LIKE pattern (escape character: '/')
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def rank(term, name):
+    # exact name, name prefix, name substring, then matches on the other fields
+    name = (name or '').lower()
+    if name == term:
+        return 0
+    if name.startswith(term):
+        return 1
+    if term in name:
+        return 2
+    return 3
+
+
+class TrigramIndex(object):
+    """In-process substring index: trigram -> ids, verified against the text."""
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, id, name, fields, tags=()):
+        self.remove(id)
+        name = (name or '').lower()
+        text = ' '.join([name] + [(field or '').lower() for field in fields] + [tag.lower() for tag in tags])
+        self.documents[id] = (name, text, frozenset(tags))
+        for trigram in trigrams(text):
+            self.postings[trigram].add(id)
+
+    def remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is not None:
+            for trigram in trigrams(document[1]):
+                self.postings[trigram].discard(id)
+
+    def search(self, term, tag=None):
+        # every document containing `term` contains all of its trigrams, so the
+        # posting intersection is a superset of the matches; terms shorter than
+        # a trigram check every document
+        term = term.lower()
+        keys = trigrams(term)
+        if keys:
+            candidates = set.intersection(*[self.postings.get(key, set()) for key in keys])
+        else:
+            candidates = self.documents.keys()
+        matches = []
+        for id in candidates:
+            name, text, tags = self.documents[id]
+            if term in text and (tag is None or tag in tags):
+                matches.append((rank(term, name), name, id))
+        matches.sort()
+        return [id for _, _, id in matches]
+
+
+class CatalogSearch(object):
+    """Search one catalog model on its name, extra text columns and tags.
+
+    `tags` is the (link table column, tag name column) pair of a many-to-many
+    tag such as the genres, e.g. ``(venue_genre.c.venue_id, Genre.name)``.
+    """
+
+    def __init__(self, db, model, fields, tags=None, limit=50):
+        self.db = db
+        self.model = model
+        self.fields = fields
+        self.tags = tags
+        self.limit = limit
+        self._index = None
+        self._lock = Lock()
+
+    @property
+    def in_database(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def search(self, term, columns=(), tag=None, ids=None):
+        """Return (total matches, up to `limit` ranked rows).
+
+        Rows carry ``id``, ``name`` and the extra `columns` (for example the
+        upcoming-show count), all fetched in a single query. `tag` restricts
+        the results to entities carrying that exact tag, `ids` to those ids (a
+        collection, or a query of ids when the search runs in the database).
+        """
+        term = term.strip()
+        if self.in_database:
+            return self._search_database(term, columns, tag, ids)
+        return self._search_index(term, columns, tag, ids)
+
+    def reindex(self, id):
+        if self._index is None:
+            return
+        row = self.db.session.query(self.model.id, self.model.name, *self._columns()) \
+            .filter(self.model.id == id).first()
+        tags = [name for _, name in self._tag_query().filter(self.tags[0] == id)] if self.tags else []
+        with self._lock:
+            if row is None:
+                self._index.remove(id)
+            else:
+                self._index.add(row[0], row[1], row[2:], tags)
+
+    def invalidate(self):
+        # drop the in-process index, it is rebuilt by the next search
+        with self._lock:
+            self._index = None
+
+    def remove(self, id):
+        if self._index is not None:
+            with self._lock:
+                self._index.remove(id)
+
+    def _columns(self):
+        return [getattr(self.model, field) for field in self.fields]
+
+    def _tag_query(self):
+        # (entity id, tag name) pairs, joined through the link table
+        link, name = self.tags
+        return self.db.session.query(link, name).select_from(link.table).join(name.class_)
+
+    def _search_database(self, term, columns, tag, ids):
+        db, model = self.db, self.model
+        pattern = '%' + like_escape(term) + '%'
+        match = [column.ilike(pattern, escape='/') for column in [model.name] + self._columns()]
+        if self.tags:
+            match.append(model.id.in_(
+                self._tag_query().with_entities(self.tags[0]).filter(self.tags[1].ilike(pattern, escape='/'))))
+        query = db.session.query(model.id, model.name, *columns).filter(db.or_(*match))
+        if tag is not None:
+            query = query.filter(model.id.in_(
+                self._tag_query().with_entities(self.tags[0]).filter(self.tags[1] == tag)))
+        if ids is not None:
+            query = query.filter(model.id.in_(ids if hasattr(ids, 'subquery') else list(ids)))
+        name_rank = db.case([
+            (db.func.lower(model.name) == term.lower(), 0),
+            (model.name.ilike(like_escape(term) + '%', escape='/'), 1),
+            (model.name.ilike(pattern, escape='/'), 2),
+        ], else_=3)
+        rows = query.add_columns(db.func.count().over().label('total')) \
+            .order_by(name_rank, db.func.similarity(model.name, term).desc(), model.name, model.id) \
+            .limit(self.limit) \
+            .all()
+        return (rows[0].total if rows else 0), rows
+
+    def _search_index(self, term, columns, tag, within):
+        with self._lock:
+            if self._index is None:
+                self._index = self._build()
+            ids = self._index.search(term, tag)
+        if within is not None:
+            within = set(within)
+            ids = [id for id in ids if id in within]
+        if not ids:
+            return 0, []
+        shown = ids[:self.limit]
+        rows = self.db.session.query(self.model.id, self.model.name, *columns) \
+            .filter(self.model.id.in_(shown)) \
+            .all()
+        position = {id: i for i, id in enumerate(shown)}
+        rows.sort(key=lambda row: position[row.id])
+        return len(ids), rows
+
+    def _build(self):
+        index = TrigramIndex()
+        tags = defaultdict(list)
+        if self.tags:
+            for id, name in self._tag_query().yield_per(1000):
+                tags[id].append(name)
+        rows = self.db.session.query(self.model.id, self.model.name, *self._columns()) \
+            .yield_per(1000)
+        for row in rows:
+            index.add(row[0], row[1], row[2:], tags.get(row[0], ()))
+        return index
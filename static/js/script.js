@@ -2,3 +2,50 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// "Venues near me": list the venues around the browser's position
+document.addEventListener('click', function (event) {
+  var link = event.target.closest && event.target.closest('a.near-me');
+  if (!link || !navigator.geolocation) return;
+  event.preventDefault();
+  navigator.geolocation.getCurrentPosition(function (position) {
+    window.location.href = link.getAttribute('data-url') + '?near=' +
+      position.coords.latitude.toFixed(5) + ',' + position.coords.longitude.toFixed(5);
+  });
+});
+
+// search-as-you-type: fill the search box's datalist from its autocomplete
+// URL; picking a suggestion opens that venue/artist
+(function () {
+  var pending = {};
+  document.addEventListener('input', function (event) {
+    var input = event.target;
+    var url = input.getAttribute && input.getAttribute('data-autocomplete');
+    if (!url) return;
+    var list = document.getElementById(input.getAttribute('list'));
+    var picked = list && Array.prototype.filter.call(list.options, function (option) {
+      return option.value === input.value;
+    })[0];
+    if (picked && event.inputType !== 'insertText' && event.inputType !== 'deleteContentBackward') {
+      window.location.href = picked.getAttribute('data-url');
+      return;
+    }
+    clearTimeout(pending[url]);
+    if (!input.value.trim()) return;
+    pending[url] = setTimeout(function () {
+      var term = input.value;
+      fetch(url + '?q=' + encodeURIComponent(term), {credentials: 'same-origin'})
+        .then(function (response) { return response.json(); })
+        .then(function (result) {
+          if (input.value !== term) return;
+          list.innerHTML = '';
+          result.data.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            option.setAttribute('data-url', suggestion.url);
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+})();
@@ -0,0 +1,132 @@
+"""Compiled-template cache and ``{% cache %}`` fragment caching.
+
+``configure_templates(app, page_cache)`` gives the Jinja environment
+
+* a bytecode cache under ``TEMPLATE_CACHE_DIR``, shared by the workers of
+  one host. ``flask compile-templates`` fills it at deploy, so a fresh worker
+  loads compiled templates instead of parsing every one of them cold.
+* the ``cache`` tag, which stores the rendered output of a fragment in a
+  per-process LRU::
+
+      {% cache 'show-tile', show.show_id, show.start_time, show.artist_name %}
+        ...
+      {% endcache %}
+
+      {% cache 'venue-header', venue.id, tags=('venues',) %}
+        ...
+      {% endcache %}
+
+  The key is the fragment name followed by the values it is built from, plus
+  the page-cache version of every tag in ``tags``. A fragment keyed on all the
+  values it shows never goes stale; one keyed on an id needs the tags whose
+  writes change it. Like the pages, fragments are neither read nor stored
+  when the page cache's ``bypass()`` is true (a user who just wrote). A
+  fragment with tags is not stored either when the page was read from a
+  replica (``from_replica()``), which may lag the write that bumped them; a
+  fragment keyed on its values holds what it shows, from wherever it came.
+"""
+import os
+import tempfile
+
+from flask import g, has_app_context
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from cache import LRUCache, NullCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that replaces its files atomically.
+
+    Workers write to the same directory, and a half-written file would fail
+    to load in another worker.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        super(SharedBytecodeCache, self).__init__(directory)
+
+    def dump_bytecode(self, bucket):
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as cached:
+            bucket.write_bytecode(cached)
+        os.replace(temporary, os.path.join(self.directory, self.pattern % bucket.key))
+
+
+class FragmentCache(object):
+
+    def __init__(self, page_cache, maxsize=10000, ttl=60):
+        self.page_cache = page_cache
+        self.fragments = LRUCache(maxsize, ttl)
+
+    @property
+    def enabled(self):
+        return self.fragments.maxsize > 0 and not isinstance(self.page_cache.backend, NullCache)
+
+    def tag_versions(self, tags):
+        # looked up once per request, not once per fragment
+        if not has_app_context():
+            return [self.page_cache.tag_version(tag) for tag in tags]
+        known = g.setdefault('_fragment_tag_versions', {})
+        for tag in tags:
+            if tag not in known:
+                known[tag] = self.page_cache.tag_version(tag)
+        return [known[tag] for tag in tags]
+
+    def render(self, key, tags, render):
+        if not self.enabled or self.page_cache.bypass():
+            return render()
+        key = '\0'.join([str(part) for part in key] + self.tag_versions(tags))
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = render()
+            if not (tags and self.page_cache.from_replica()):
+                self.fragments.set(key, fragment)
+        return fragment
+
+
+class FragmentCacheExtension(Extension):
+    """The ``{% cache name, value, ...[, tags=(...)] %}...{% endcache %}`` tag."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        tags = nodes.Tuple([], 'load')
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.test('name:tags') and parser.stream.look().test('assign'):
+                parser.stream.skip(2)
+                tags = parser.parse_expression()
+                break
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(key), tags]), [], [], body) \
+            .set_lineno(lineno)
+
+    def _render(self, key, tags, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        return cache.render(key, tags, caller)
+
+
+def configure_templates(app, page_cache):
+    if app.config['TEMPLATE_CACHE_DIR']:
+        app.jinja_env.bytecode_cache = SharedBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(page_cache, app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                                                 app.config['FRAGMENT_CACHE_TTL'])
+
+
+def compile_templates(app, extensions=('html',)):
+    """Load every template once, writing its bytecode to the cache; returns the names."""
+    environment = app.jinja_env
+    names = environment.list_templates(extensions=extensions)
+    for name in names:
+        environment.get_template(name)
+    return names
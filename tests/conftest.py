@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# the app's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def fyyur(tmp_path_factory):
+    """The app module, on an empty SQLite database of its own."""
+    os.environ['DATABASE_URL'] = 'sqlite:///%s' % (tmp_path_factory.mktemp('fyyur') / 'fyyur.db')
+    os.environ['FYYUR_TEMPLATE_CACHE_DIR'] = ''
+    import app as module
+    module.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with module.app.app_context():
+        module.db.create_all()
+    yield module
+    module.outbox.stop()
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import upcoming
+
+START = datetime(2035, 3, 1, 20)
+
+
+@pytest.fixture(scope='module')
+def venue_id(fyyur):
+    # a venue with one upcoming show; removed again after the module
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='ETag Hall', city='Austin', state='TX', genres=fyyur.genres_named(['Jazz']))
+        artist = fyyur.Artist(name='ETag Band', city='Austin', state='TX')
+        fyyur.db.session.add_all([venue, artist])
+        fyyur.db.session.flush()
+        fyyur.db.session.add(fyyur.Show(venue_id=venue.id, artist_id=artist.id, start_date=START,
+                                        end_date=START + timedelta(hours=2)))
+        fyyur.db.session.commit()
+        ids = venue.id, artist.id
+    fyyur.upcoming_counts.invalidate()
+    yield ids[0]
+    # other modules count the venues and artists
+    with fyyur.app.app_context():
+        fyyur.Show.query.filter_by(venue_id=ids[0]).delete()
+        fyyur.Artist.query.filter_by(id=ids[1]).delete()
+        # through the session, which also unlinks its genres
+        fyyur.db.session.delete(fyyur.Venue.query.get(ids[0]))
+        fyyur.db.session.commit()
+    fyyur.upcoming_counts.invalidate()
+
+
+@pytest.fixture
+def queries(fyyur):
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+    with fyyur.app.app_context():
+        engine = fyyur.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_a_repeated_request_is_answered_304_without_a_query(fyyur, venue_id, queries):
+    client = fyyur.app.test_client()
+    path = '/api/v1/venues/%d' % venue_id
+    first = client.get(path)
+    assert first.status_code == 200 and first.headers['ETag']
+    del queries[:]
+    again = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag'] and not again.data
+    assert queries == []
+
+
+def test_a_write_changes_the_etag(fyyur, venue_id):
+    reader, writer = fyyur.app.test_client(), fyyur.app.test_client()
+    path = '/api/v1/venues/%d' % venue_id
+    etag = reader.get(path).headers['ETag']
+    writer.post('/venues/%d/edit' % venue_id, data={
+        'name': 'ETag Hall Renamed', 'city': 'Austin', 'state': 'TX', 'address': 'a', 'phone': '1',
+        'genres': ['Jazz'], 'facebook_link': ''})
+    # the commit woke the listener thread; replay here instead of waiting for it
+    with fyyur.app.app_context():
+        fyyur.outbox.replay()
+    changed = reader.get(path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['data']['name'] == 'ETag Hall Renamed'
+
+
+def test_a_show_starting_changes_the_etag(fyyur, venue_id, monkeypatch):
+    client = fyyur.app.test_client()
+    path = '/api/v1/venues/%d' % venue_id
+    etag = client.get(path).headers['ETag']
+    crossing = fyyur.upcoming_counts.next_crossing()
+    assert crossing is not None and crossing <= START
+
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return crossing + timedelta(seconds=1)
+    monkeypatch.setattr(upcoming, 'datetime', Later)
+    try:
+        assert client.get(path, headers={'If-None-Match': etag}).status_code == 200
+    finally:
+        # the counts retired shows that are still upcoming
+        fyyur.upcoming_counts.invalidate()
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+# before any show the other modules write
+STARTS = [datetime(2001, month, 1, 20) for month in (1, 2, 3)]
+
+
+@pytest.fixture(scope='module')
+def ids(fyyur):
+    # a venue and an artist with three past shows; removed again after the module
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='Archive Hall', city='Austin', state='TX')
+        artist = fyyur.Artist(name='Archive Band', city='Austin', state='TX')
+        fyyur.db.session.add_all([venue, artist])
+        fyyur.db.session.flush()
+        fyyur.db.session.add_all([fyyur.Show(venue_id=venue.id, artist_id=artist.id, start_date=start,
+                                             end_date=start + timedelta(hours=2)) for start in STARTS])
+        fyyur.db.session.commit()
+        ids = venue.id, artist.id
+    yield ids
+    # other modules count the venues and artists
+    with fyyur.app.app_context():
+        fyyur.ShowHistory.query.filter_by(venue_id=ids[0]).delete()
+        fyyur.Show.query.filter_by(venue_id=ids[0]).delete()
+        fyyur.Artist.query.filter_by(id=ids[1]).delete()
+        fyyur.Venue.query.filter_by(id=ids[0]).delete()
+        fyyur.db.session.commit()
+
+
+def archive(fyyur, before):
+    result = fyyur.app.test_cli_runner(mix_stderr=False).invoke(args=['archive-shows', '--before', before])
+    assert result.exit_code == 0, result.stderr
+    return result.output
+
+
+def history(fyyur, venue_id):
+    with fyyur.app.app_context():
+        row = fyyur.ShowHistory.query.filter_by(venue_id=venue_id).one()
+        return row.shows, row.first_date, row.last_date
+
+
+def past_show_counts(fyyur, venue_id):
+    response = fyyur.app.test_client().get('/api/v1/venues/%d?fields=past_shows_count,archived_shows_count' % venue_id)
+    return response.get_json()['data']
+
+
+def test_archiving_twice_does_not_count_twice(fyyur, ids):
+    venue_id, _ = ids
+    assert archive(fyyur, '2001-02-15').startswith('2 shows before 2001-02-15 00:00 archived')
+    assert history(fyyur, venue_id) == (2, STARTS[0], STARTS[1])
+    assert archive(fyyur, '2001-02-15').startswith('0 shows')
+    assert history(fyyur, venue_id) == (2, STARTS[0], STARTS[1])
+    # a later run adds to the pair's row
+    assert archive(fyyur, '2001-04-01').startswith('1 shows')
+    assert history(fyyur, venue_id) == (3, STARTS[0], STARTS[2])
+
+
+def test_archived_shows_still_count_as_past(fyyur, ids):
+    venue_id, _ = ids
+    with fyyur.app.app_context():
+        assert fyyur.Show.query.filter_by(venue_id=venue_id).count() == 0
+    assert past_show_counts(fyyur, venue_id) == {'past_shows_count': 3, 'archived_shows_count': 3}
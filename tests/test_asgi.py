@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def venue_id(fyyur):
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                            genres=fyyur.genres_named(['Jazz']))
+        fyyur.db.session.add(venue)
+        fyyur.db.session.commit()
+        return venue.id
+
+
+@pytest.fixture(scope='module')
+def asgi(fyyur, venue_id):
+    import asgi as module
+    for database in module.databases.values():
+        asyncio.run(database.connect())
+    yield module
+    for database in module.databases.values():
+        asyncio.run(database.disconnect())
+
+
+def get(asgi, path, query_string=b''):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'query_string': query_string, 'root_path': '',
+             'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 1), 'server': ('localhost', 80)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+@pytest.mark.parametrize('path, query_string', [('/venues', b'genre=Jazz'), ('/artists', b''),
+                                                 ('/venues/%d', b''), ('/venues/999999', b'')])
+def test_async_views_render_the_flask_pages(asgi, venue_id, path, query_string):
+    path = path.replace('%d', str(venue_id))
+    status, headers, body = get(asgi, path, query_string)
+    flask = asgi.app.test_client().get(path, query_string=query_string.decode())
+    assert status == flask.status_code == 200
+    assert body.split() == flask.data.split()
+
+
+def test_async_listing_is_served_from_the_page_cache(asgi):
+    status, headers, first = get(asgi, '/venues', b'per_page=7')
+    assert headers['x-cache'] == 'MISS'
+    status, headers, second = get(asgi, '/venues', b'per_page=7')
+    assert headers['x-cache'] == 'HIT'
+    assert second == first
+
+
+def test_async_views_are_instrumented(asgi, venue_id):
+    status, headers, body = get(asgi, '/venues/%d' % venue_id)
+    assert headers['x-db-queries'] == '5'
+    assert headers['x-db-route'] == 'primary'
+    assert asgi.instrumentation.endpoints['show_venue'].queries >= 5
+
+
+def test_bad_cursor_goes_through_the_error_handler(asgi):
+    status, headers, body = get(asgi, '/artists', b'after=garbage')
+    assert status == 400
+
+
+def test_other_requests_go_to_the_flask_app(asgi):
+    status, headers, body = get(asgi, '/api/v1/venues')
+    assert status == 200
+    assert asgi.async_route({'method': 'GET', 'path': '/venues', 'query_string': b'near=1,2'}) is None
@@ -0,0 +1,126 @@
+import autocomplete
+from autocomplete import PrefixIndex, name_keys, normalize
+
+
+def index_of(names, **options):
+    index = PrefixIndex(**options)
+    index.load(enumerate(names, 1))
+    return index
+
+
+def test_normalize():
+    assert normalize('  The   Musical\tHop ') == 'the musical hop'
+    assert normalize(None) == ''
+
+
+def test_name_keys_start_at_each_word():
+    assert name_keys('The Musical Hop', 4, 32) == ['the musical hop', 'musical hop', 'hop']
+    assert name_keys('a b c d e f', 4, 32) == ['a b c d e f', 'b c d e f', 'c d e f', 'd e f']
+    assert name_keys('Park Square Live Music', 4, 6) == ['park s', 'square', 'live m', 'music']
+    assert name_keys('   ', 4, 32) == []
+
+
+def test_whole_name_matches_come_first():
+    index = index_of(['The Musical Hop', 'Hopscotch', 'Hip Hop Hall'])
+    assert index.suggest('hop', 10) == [(2, 'Hopscotch'), (1, 'The Musical Hop'), (3, 'Hip Hop Hall')]
+    assert index.suggest('HOP', 10) == index.suggest('  hop ', 10)
+
+
+def test_a_name_is_suggested_once():
+    index = index_of(['Hop Hop Hop'])
+    assert index.suggest('hop', 10) == [(1, 'Hop Hop Hop')]
+
+
+def test_limit():
+    index = index_of(['Band %02d' % number for number in range(20)])
+    assert [name for _, name in index.suggest('band', 3)] == ['Band 00', 'Band 01', 'Band 02']
+
+
+def test_add_and_remove_keep_the_arrays_sorted():
+    index = index_of(['Beta', 'Delta'])
+    index.add(3, 'Alpha')
+    index.add(4, 'Charlie')
+    assert index.starts[0] == sorted(index.starts[0])
+    index.add(1, 'Epsilon')
+    assert index.suggest('beta', 10) == []
+    assert index.suggest('eps', 10) == [(1, 'Epsilon')]
+    index.remove(3)
+    index.remove(3)
+    assert index.suggest('alpha', 10) == []
+    assert len(index) == 3
+
+
+def test_bound_leaves_names_out_and_marks_the_index_incomplete():
+    # 'one two' takes two keys, so only two such names fit in five entries
+    index = index_of(['one two', 'one three', 'one four'], max_entries=5)
+    assert index.entries <= 5
+    assert len(index) == 2
+    assert not index.complete
+    assert [id for id, _ in index.suggest('one', 10)] == [2, 1]
+
+
+def test_bound_is_enforced_by_add():
+    index = index_of(['alpha'], max_entries=2)
+    assert index.complete
+    index.add(2, 'beta')
+    assert index.complete and index.entries == 2
+    index.add(3, 'gamma')
+    assert not index.complete
+    assert index.suggest('gamma', 10) == []
+    # removing a name frees its entries for the next one
+    index.remove(1)
+    index.add(4, 'delta')
+    assert index.suggest('delta', 10) == [(4, 'delta')]
+    assert index.entries == 2
+
+
+def test_long_names_are_cut_to_the_key_length():
+    index = index_of(['a' * 50], key_length=8)
+    assert index.starts[0] == ['a' * 8]
+    # a longer prefix is cut the same way
+    assert index.suggest('a' * 20, 10) == [(1, 'a' * 50)]
+
+
+class Names(object):
+    """The slice of a db the index build uses: session.query(...).yield_per(n)."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.session = self
+        self.builds = 0
+
+    def query(self, *columns):
+        return self
+
+    def yield_per(self, count):
+        self.builds += 1
+        return iter(list(self.rows))
+
+
+class Model(object):
+    id = name = None
+
+
+def test_autocomplete_rebuilds_after_max_age(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(autocomplete.time, 'time', lambda: now[0])
+    db = Names([(1, 'Alpha')])
+    names = autocomplete.Autocomplete(db, Model, max_age=60)
+    assert names.suggest('al') == [(1, 'Alpha')]
+    db.rows.append((2, 'Alto'))
+    now[0] += 30
+    assert names.suggest('al') == [(1, 'Alpha')]
+    now[0] += 31
+    assert names.suggest('al') == [(1, 'Alpha'), (2, 'Alto')]
+    assert db.builds == 2
+
+
+def test_autocomplete_without_max_age_keeps_its_index(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(autocomplete.time, 'time', lambda: now[0])
+    db = Names([(1, 'Alpha')])
+    names = autocomplete.Autocomplete(db, Model, max_age=0)
+    names.suggest('al')
+    now[0] += 10 ** 6
+    names.suggest('al')
+    assert db.builds == 1
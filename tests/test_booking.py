@@ -0,0 +1,173 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from booking import MAX_SHOW_DURATION, IntervalIndex, lock_bookings, overlapping
+
+EIGHT = datetime(2030, 1, 1, 20)
+
+
+def hours(number):
+    return timedelta(hours=number)
+
+
+def test_empty_index_has_no_overlap():
+    assert IntervalIndex().overlapping('venue', EIGHT, EIGHT + hours(2)) is None
+
+
+def test_overlap_on_either_side():
+    index = IntervalIndex()
+    index.add('venue', EIGHT, EIGHT + hours(2), 'show')
+    assert index.overlapping('venue', EIGHT - hours(1), EIGHT + hours(1)) == 'show'
+    assert index.overlapping('venue', EIGHT + hours(1), EIGHT + hours(3)) == 'show'
+    assert index.overlapping('venue', EIGHT + timedelta(minutes=30), EIGHT + hours(1)) == 'show'
+    assert index.overlapping('venue', EIGHT - hours(1), EIGHT + hours(3)) == 'show'
+
+
+def test_adjacent_intervals_do_not_overlap():
+    # [start, end) is half-open: a show may start when the previous one ends
+    index = IntervalIndex()
+    index.add('venue', EIGHT, EIGHT + hours(2), 'show')
+    assert index.overlapping('venue', EIGHT + hours(2), EIGHT + hours(4)) is None
+    assert index.overlapping('venue', EIGHT - hours(2), EIGHT) is None
+
+
+def test_boundaries_one_microsecond_inside():
+    index = IntervalIndex()
+    index.add('venue', EIGHT, EIGHT + hours(2), 'show')
+    tick = timedelta(microseconds=1)
+    assert index.overlapping('venue', EIGHT + hours(2) - tick, EIGHT + hours(4)) == 'show'
+    assert index.overlapping('venue', EIGHT - hours(2), EIGHT + tick) == 'show'
+
+
+def test_keys_are_separate():
+    index = IntervalIndex()
+    index.add(('venue', 1), EIGHT, EIGHT + hours(2), 'show')
+    assert index.overlapping(('venue', 2), EIGHT, EIGHT + hours(2)) is None
+    assert index.overlapping(('artist', 1), EIGHT, EIGHT + hours(2)) is None
+
+
+def test_longest_show_is_found_from_its_end():
+    # the lookup window reaches back max_duration from the start
+    index = IntervalIndex()
+    index.add('venue', EIGHT, EIGHT + MAX_SHOW_DURATION, 'long')
+    end = EIGHT + MAX_SHOW_DURATION
+    assert index.overlapping('venue', end - hours(1), end + hours(1)) == 'long'
+    assert index.overlapping('venue', end, end + hours(1)) is None
+
+
+def test_custom_max_duration_bounds_the_window():
+    index = IntervalIndex(max_duration=hours(3))
+    index.add('venue', EIGHT, EIGHT + hours(3), 'show')
+    assert index.overlapping('venue', EIGHT + hours(2), EIGHT + hours(4)) == 'show'
+
+
+def test_finds_the_overlap_among_many():
+    index = IntervalIndex()
+    for day in range(30):
+        start = EIGHT + timedelta(days=day)
+        index.add('venue', start, start + hours(2), day)
+    # added out of order, still kept sorted by start
+    index.add('venue', EIGHT - timedelta(days=1), EIGHT - timedelta(days=1) + hours(2), -1)
+    assert index.overlapping('venue', EIGHT + timedelta(days=12, hours=1), EIGHT + timedelta(days=12, hours=5)) == 12
+    assert index.overlapping('venue', EIGHT - timedelta(days=1, hours=1), EIGHT - timedelta(hours=23)) == -1
+    assert index.overlapping('venue', EIGHT + timedelta(days=12, hours=3), EIGHT + timedelta(days=13)) is None
+
+
+def test_same_start_keeps_both():
+    index = IntervalIndex()
+    index.add('venue', EIGHT, EIGHT, 'empty')
+    index.add('venue', EIGHT, EIGHT + hours(1), 'show')
+    assert index.overlapping('venue', EIGHT, EIGHT + hours(1)) == 'show'
+
+
+# against the app's database
+# ---------------------------------------------------------------------------------------
+
+BOOKED = datetime(2031, 6, 1, 20)
+
+
+@pytest.fixture(scope='module')
+def booked(fyyur):
+    # a venue and two artists, the first of them playing there from BOOKED for
+    # two hours; removed again after the module
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='Booking Hall', city='Austin', state='TX')
+        artists = [fyyur.Artist(name='Booking Band %d' % number, city='Austin', state='TX') for number in (1, 2)]
+        fyyur.db.session.add_all([venue] + artists)
+        fyyur.db.session.flush()
+        show = fyyur.Show(venue_id=venue.id, artist_id=artists[0].id, start_date=BOOKED, end_date=BOOKED + hours(2))
+        fyyur.db.session.add(show)
+        fyyur.db.session.commit()
+        ids = {'venue': venue.id, 'artists': [artist.id for artist in artists], 'show': show.id}
+    yield ids
+    # other modules count the venues and artists
+    with fyyur.app.app_context():
+        fyyur.Show.query.filter_by(venue_id=ids['venue']).delete()
+        fyyur.Artist.query.filter(fyyur.Artist.id.in_(ids['artists'])).delete(synchronize_session=False)
+        fyyur.Venue.query.filter_by(id=ids['venue']).delete()
+        fyyur.db.session.commit()
+
+
+def shows_at(fyyur, venue_id):
+    with fyyur.app.app_context():
+        return fyyur.Show.query.filter_by(venue_id=venue_id).count()
+
+
+def test_overlapping_query(fyyur, booked):
+    def found(start, end):
+        with fyyur.app.app_context():
+            query = fyyur.db.session.query(fyyur.Show.id).filter(fyyur.Show.venue_id == booked['venue'])
+            return [row.id for row in overlapping(query, fyyur.Show.start_date, fyyur.Show.end_date, start, end)]
+    assert found(BOOKED + hours(1), BOOKED + hours(3)) == [booked['show']]
+    assert found(BOOKED - hours(1), BOOKED + timedelta(minutes=1)) == [booked['show']]
+    assert found(BOOKED + hours(2), BOOKED + hours(4)) == []
+    assert found(BOOKED - hours(2), BOOKED) == []
+
+
+def test_double_booking_is_rejected_with_the_conflicting_show(fyyur, booked):
+    response = fyyur.app.test_client().post('/shows/create', data={
+        'venue_id': booked['venue'], 'artist_id': booked['artists'][1],
+        'start_time': (BOOKED + hours(1)).strftime('%Y-%m-%d %H:%M:%S')})
+    assert response.status_code == 409
+    assert b'The venue is already booked from 2031-06-01 20:00 to 2031-06-01 22:00' in response.data
+    assert b'(show %d)' % booked['show'] in response.data
+    assert shows_at(fyyur, booked['venue']) == 1
+
+
+def test_lock_bookings_takes_the_sqlite_write_lock(fyyur):
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+    path = fyyur.app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    with fyyur.app.app_context():
+        event.listen(fyyur.db.engine, 'before_cursor_execute', record)
+        try:
+            lock_bookings(fyyur.db.session, [('venue', 1)])
+            # the transaction is open now, so a second call has nothing to do
+            lock_bookings(fyyur.db.session)
+            other = sqlite3.connect(path, timeout=0)
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                other.execute('BEGIN IMMEDIATE')
+            other.close()
+        finally:
+            fyyur.db.session.rollback()
+            event.remove(fyyur.db.engine, 'before_cursor_execute', record)
+    assert statements == ['BEGIN IMMEDIATE']
+
+
+def test_import_rejects_a_double_booking_within_the_batch(fyyur, booked, tmp_path):
+    day = BOOKED + timedelta(days=1)
+    rows = ['venue_id,artist_id,start_time,duration']
+    rows += ['%d,%d,%s,120' % (booked['venue'], artist, (day + hours(offset)).strftime('%Y-%m-%d %H:%M'))
+             for artist, offset in zip(booked['artists'], [0, 1])]
+    path, errors = tmp_path / 'shows.csv', tmp_path / 'errors.txt'
+    path.write_text('\n'.join(rows) + '\n')
+    result = fyyur.app.test_cli_runner(mix_stderr=False).invoke(
+        args=['import-data', 'shows', str(path), '--errors', str(errors)])
+    assert result.exit_code == 0, result.output
+    assert errors.read_text() == '3\tthe venue is already booked at that time by line 2\n'
+    assert shows_at(fyyur, booked['venue']) == 2
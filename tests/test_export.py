@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+# later than any row the other modules write
+CHANGED = [datetime(2040, 1, 1, hour) for hour in (10, 11, 12)]
+
+
+@pytest.fixture(scope='module')
+def venue_ids(fyyur):
+    # three venues changed at CHANGED; removed again after the module
+    with fyyur.app.app_context():
+        venues = [fyyur.Venue(name='Export Hall %d' % number, city='Austin', state='TX', updated_at=changed)
+                  for number, changed in enumerate(CHANGED)]
+        fyyur.db.session.add_all(venues)
+        fyyur.db.session.commit()
+        ids = [venue.id for venue in venues]
+    yield ids
+    # other modules count the venues
+    with fyyur.app.app_context():
+        fyyur.Venue.query.filter(fyyur.Venue.id.in_(ids)).delete(synchronize_session=False)
+        fyyur.db.session.commit()
+
+
+def export(client, since=None):
+    response = client.get('/export/venues', query_string=dict(format='jsonl', **({'since': since} if since else {})))
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.data.decode().splitlines()], response.headers['X-Next-Since']
+
+
+def test_since_returns_the_rows_changed_from_then_on(fyyur, venue_ids):
+    client = fyyur.app.test_client()
+    everything, _ = export(client)
+    assert set(venue_ids) <= {row['id'] for row in everything}
+    # >= since: the row stamped at since itself is included
+    rows, _ = export(client, CHANGED[1].isoformat())
+    assert [row['id'] for row in rows] == venue_ids[1:]
+    rows, _ = export(client, (CHANGED[1] + timedelta(microseconds=1)).isoformat())
+    assert [row['id'] for row in rows] == venue_ids[2:]
+    assert client.get('/export/venues', query_string={'since': 'yesterday-ish'}).status_code == 400
+
+
+def test_next_since_round_trip(fyyur, venue_ids):
+    client = fyyur.app.test_client()
+    _, next_since = export(client)
+    overlap = timedelta(seconds=fyyur.app.config['EXPORT_OVERLAP_SECONDS'])
+    assert next_since == (CHANGED[-1] - overlap).isoformat()
+    # the next export repeats the rows of the overlap window...
+    rows, again = export(client, next_since)
+    assert [row['id'] for row in rows] == venue_ids[2:]
+    assert again == next_since
+    # ...and has every row changed after this one
+    with fyyur.app.app_context():
+        fyyur.Venue.query.filter_by(id=venue_ids[0]).update({'updated_at': CHANGED[-1] + timedelta(hours=1)})
+        fyyur.db.session.commit()
+    rows, later = export(client, next_since)
+    assert [row['id'] for row in rows] == [venue_ids[2], venue_ids[0]]
+    assert later == (CHANGED[-1] + timedelta(hours=1) - overlap).isoformat()
@@ -0,0 +1,101 @@
+import heapq
+import math
+import random
+
+import pytest
+
+from geo import EARTH_RADIUS_KM, GridIndex, haversine_km, parse_point
+
+
+def brute_within(points, latitude, longitude, radius):
+    return sorted((haversine_km(latitude, longitude, *point), id) for id, point in points.items()
+                  if haversine_km(latitude, longitude, *point) <= radius)
+
+
+def grid(points, cell_degrees=0.25):
+    index = GridIndex(cell_degrees)
+    for id, (latitude, longitude) in points.items():
+        index.add(id, latitude, longitude)
+    return index
+
+
+def test_within_matches_a_scan():
+    rng = random.Random(1)
+    points = {id: (rng.uniform(36, 39), rng.uniform(-124, -120)) for id in range(2000)}
+    index = grid(points)
+    for _ in range(20):
+        latitude, longitude = rng.uniform(36, 39), rng.uniform(-124, -120)
+        assert sorted(index.within(latitude, longitude, 25)) == brute_within(points, latitude, longitude, 25)
+
+
+def test_nearest_matches_a_scan():
+    rng = random.Random(2)
+    points = {id: (rng.uniform(-60, 60), rng.uniform(-180, 180)) for id in range(500)}
+    index = grid(points, 1.0)
+    for _ in range(10):
+        latitude, longitude = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        expected = heapq.nsmallest(5, brute_within(points, latitude, longitude, math.inf))
+        assert index.nearest(latitude, longitude, 5) == expected
+
+
+def test_within_crosses_the_antimeridian():
+    points = {1: (-17.8, 179.9), 2: (-17.8, -179.9), 3: (-17.8, 170.0)}
+    index = grid(points)
+    found = sorted(id for _, id in index.within(-17.8, 179.99, 50))
+    assert found == [1, 2]
+    found = sorted(id for _, id in index.within(-17.8, -179.99, 50))
+    assert found == [1, 2]
+
+
+def test_longitude_180_and_minus_180_are_one_place():
+    index = grid({1: (0.0, 180.0), 2: (0.0, -180.0)})
+    assert sorted(id for _, id in index.within(0.0, 179.999, 1)) == [1, 2]
+
+
+def test_within_near_a_pole_covers_every_longitude():
+    points = {1: (89.9, 0.0), 2: (89.9, 90.0), 3: (89.9, -135.0), 4: (89.0, 180.0)}
+    index = grid(points)
+    found = sorted(id for _, id in index.within(89.95, 45.0, 30))
+    assert found == [1, 2, 3]
+    assert sorted(id for _, id in index.within(90.0, 0.0, 200)) == [1, 2, 3, 4]
+    assert sorted(id for _, id in index.within(-90.0, 0.0, 200)) == []
+
+
+def test_radius_beyond_the_earth_is_clamped():
+    # the bounding box stops at the poles and at a full turn of longitude
+    points = {1: (0.0, 0.0), 2: (0.0, 180.0), 3: (89.0, 0.0), 4: (-89.0, 90.0)}
+    index = grid(points)
+    assert sorted(id for _, id in index.within(0.0, 0.0, 10 * EARTH_RADIUS_KM)) == [1, 2, 3, 4]
+    assert sorted(id for _, id in index.nearest(0.0, 0.0, 10)) == [1, 2, 3, 4]
+
+
+def test_nearest_stops_at_its_radius():
+    index = grid({1: (0.0, 0.0), 2: (0.0, 1.0)})
+    assert [id for _, id in index.nearest(0.0, 0.0, 5, radius_km=50)] == [1]
+    assert index.nearest(10.0, 10.0, 5, radius_km=50) == []
+
+
+def test_nearest_limit():
+    index = grid({id: (0.0, id * 0.01) for id in range(10)})
+    assert [id for _, id in index.nearest(0.0, 0.0, 3)] == [0, 1, 2]
+
+
+def test_add_moves_and_remove_forgets():
+    index = grid({1: (10.0, 10.0)})
+    index.add(1, 20.0, 20.0)
+    assert index.within(10.0, 10.0, 10) == []
+    assert [id for _, id in index.within(20.0, 20.0, 10)] == [1]
+    index.remove(1)
+    index.remove(1)
+    assert len(index) == 0 and not index.cells
+
+
+@pytest.mark.parametrize('value', ['91,0', '0,181', '-90.5,0', 'x,y', '1', '1,2,3'])
+def test_parse_point_rejects(value):
+    with pytest.raises(ValueError):
+        parse_point(value)
+
+
+def test_parse_point():
+    assert parse_point('37.77,-122.42') == (37.77, -122.42)
+    assert parse_point('-90,180') == (-90.0, 180.0)
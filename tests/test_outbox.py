@@ -0,0 +1,269 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from outbox import Outbox
+
+
+@pytest.fixture
+def env(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///%s' % (tmp_path / 'outbox.db'),
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db = SQLAlchemy(app)
+
+    class Event(db.Model):
+        __tablename__ = 'outbox'
+        id = db.Column(db.Integer, primary_key=True)
+        key = db.Column(db.String(100), nullable=False, unique=True)
+        topic = db.Column(db.String(50), nullable=False)
+        payload = db.Column(db.Text(), nullable=False)
+        created_at = db.Column(db.DateTime(), nullable=False)
+        available_at = db.Column(db.DateTime(), nullable=False)
+        attempts = db.Column(db.Integer, nullable=False, default=0)
+        claim = db.Column(db.String(32))
+        claimed_until = db.Column(db.DateTime())
+        done_at = db.Column(db.DateTime())
+        last_error = db.Column(db.Text())
+
+    with app.app_context():
+        db.create_all()
+        yield db, Event, Outbox(db, Event, max_attempts=3, backoff_seconds=10, max_backoff_seconds=15)
+
+
+def publish(db, outbox, topic, payload=None, key=None):
+    key = outbox.publish(topic, payload or {}, key=key)
+    db.session.commit()
+    return key
+
+
+def event(db, model, key):
+    return db.session.query(model).filter_by(key=key).one()
+
+
+def make_due(db, model):
+    db.session.query(model).update({model.available_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_handler_runs_once_and_marks_done(env):
+    db, model, outbox = env
+    calls = []
+    outbox.handler('greet')(calls.append)
+    key = publish(db, outbox, 'greet', {'name': 'x'})
+    assert outbox.drain() == 1
+    assert outbox.drain() == 0
+    assert calls == [[(key, {'name': 'x'})]]
+    row = event(db, model, key)
+    assert row.done_at is not None and row.attempts == 1 and row.claim is None
+    assert outbox.counts[('greet', 'done')] == 1
+
+
+def test_events_of_a_topic_are_batched(env):
+    db, model, outbox = env
+    calls = []
+    outbox.handler('greet')(calls.append)
+    keys = [publish(db, outbox, 'greet', {'number': number}) for number in range(3)]
+    outbox.drain()
+    assert [[key for key, _ in batch] for batch in calls] == [keys]
+
+
+def test_failure_is_retried_with_exponential_backoff(env):
+    db, model, outbox = env
+    failures = []
+
+    @outbox.handler('flaky')
+    def flaky(events):
+        if len(failures) < 2:
+            failures.append(events)
+            raise RuntimeError('boom')
+
+    key = publish(db, outbox, 'flaky')
+    started = datetime.utcnow()
+    assert outbox.run_batch() == 1
+    row = event(db, model, key)
+    assert row.done_at is None and row.attempts == 1 and 'boom' in row.last_error
+    # backoff_seconds * 2 ** (attempts - 1): 10s after the first failure
+    assert timedelta(seconds=9) < row.available_at - started < timedelta(seconds=11)
+    # not due before then
+    assert outbox.run_batch() == 0
+
+    make_due(db, model)
+    outbox.run_batch()
+    db.session.expire_all()
+    row = event(db, model, key)
+    # 20s, capped at max_backoff_seconds
+    assert row.attempts == 2
+    assert timedelta(seconds=14) < row.available_at - datetime.utcnow() < timedelta(seconds=16)
+
+    make_due(db, model)
+    outbox.run_batch()
+    db.session.expire_all()
+    row = event(db, model, key)
+    assert row.done_at is not None and row.last_error is None and row.attempts == 3
+    assert outbox.counts[('flaky', 'retried')] == 2 and outbox.counts[('flaky', 'done')] == 1
+
+
+def test_gives_up_after_max_attempts_and_retry_revives(env):
+    db, model, outbox = env
+
+    @outbox.handler('broken')
+    def broken(events):
+        raise RuntimeError('always')
+
+    key = publish(db, outbox, 'broken')
+    for _ in range(3):
+        make_due(db, model)
+        outbox.run_batch()
+    db.session.expire_all()
+    row = event(db, model, key)
+    assert row.done_at is not None and row.attempts == 3 and 'always' in row.last_error
+    assert [abandoned.key for abandoned in outbox.abandoned()] == [key]
+    assert outbox.pending() == {}
+    make_due(db, model)
+    assert outbox.run_batch() == 0
+
+    assert outbox.retry([key]) == 1
+    assert outbox.pending() == {'broken': (1, 0)}
+    db.session.expire_all()
+    assert event(db, model, key).attempts == 0
+
+
+def test_unknown_topic_is_an_error(env):
+    db, model, outbox = env
+    key = publish(db, outbox, 'nobody')
+    outbox.run_batch()
+    assert 'no handler' in event(db, model, key).last_error
+
+
+def test_claimed_event_waits_for_its_lease(env):
+    db, model, outbox = env
+    calls = []
+    outbox.handler('greet')(calls.append)
+    key = publish(db, outbox, 'greet')
+    # a worker that died holding the claim
+    db.session.query(model).update({model.claim: 'dead', model.claimed_until: datetime.utcnow() + timedelta(seconds=60)})
+    db.session.commit()
+    assert outbox.run_batch() == 0
+    db.session.query(model).update({model.claimed_until: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert outbox.run_batch() == 1
+    assert len(calls) == 1 and event(db, model, key).done_at is not None
+
+
+def test_handler_writes_commit_with_the_event(env):
+    db, model, outbox = env
+
+    @outbox.handler('chain')
+    def chain(events):
+        outbox.publish('greet', {}, key='greet:from-chain')
+
+    outbox.handler('greet')(lambda events: None)
+    publish(db, outbox, 'chain')
+    assert outbox.drain() == 2
+    assert event(db, model, 'greet:from-chain').done_at is not None
+
+
+def test_prune_keeps_the_abandoned(env):
+    db, model, outbox = env
+    outbox.handler('greet')(lambda events: None)
+    publish(db, outbox, 'greet')
+    publish(db, outbox, 'nobody')
+    outbox.max_attempts = 1
+    outbox.drain()
+    assert outbox.prune(datetime.utcnow() + timedelta(seconds=1)) == 1
+    assert [row.topic for row in db.session.query(model)] == ['nobody']
+
+
+def test_listener_replays_every_event_once(env):
+    db, model, outbox = env
+    seen = []
+    outbox.listener('greet')(lambda events: seen.extend(payload['number'] for _, payload in events))
+    publish(db, outbox, 'greet', {'number': 0})
+    # the first replay only sets the mark: earlier events are not replayed
+    assert outbox.replay() == 0
+    for number in range(1, 4):
+        publish(db, outbox, 'greet', {'number': number})
+    assert outbox.replay() == 3
+    assert outbox.replay() == 0
+    assert seen == [1, 2, 3]
+    # claimed by a worker (here or in another process) or not, a listener sees it
+    outbox.drain()
+    publish(db, outbox, 'greet', {'number': 4})
+    outbox.drain()
+    outbox.replay()
+    assert seen == [1, 2, 3, 4]
+
+
+def test_listener_rereads_ids_committed_out_of_order(env):
+    db, model, outbox = env
+    seen = []
+    outbox.listener('greet')(lambda events: seen.extend(payload['number'] for _, payload in events))
+    outbox.replay()
+    now = datetime.utcnow()
+    # id 2 commits first, id 1 (a transaction still open) after the replay
+    db.session.add(model(id=2, key='two', topic='greet', payload='{"number": 2}', created_at=now, available_at=now))
+    db.session.commit()
+    outbox.replay()
+    assert seen == [2]
+    db.session.add(model(id=1, key='one', topic='greet', payload='{"number": 1}', created_at=now, available_at=now))
+    db.session.commit()
+    outbox.replay()
+    assert seen == [2, 1]
+    outbox.replay()
+    assert seen == [2, 1]
+
+
+def test_skipped_ids_are_given_up_after_gap_seconds(env):
+    db, model, outbox = env
+    outbox.listener('greet')(lambda events: None)
+    outbox.replay()
+    now = datetime.utcnow()
+    db.session.add(model(id=5, key='five', topic='greet', payload='{}', created_at=now, available_at=now))
+    db.session.commit()
+    outbox.replay()
+    assert sorted(outbox._gaps) == [1, 2, 3, 4]
+    outbox.gap_seconds = 0
+    outbox._gaps = dict.fromkeys(outbox._gaps, datetime.utcnow() - timedelta(seconds=1))
+    outbox.replay()
+    assert outbox._gaps == {}
+
+
+def test_failing_listener_resyncs(env):
+    db, model, outbox = env
+    resyncs = []
+
+    @outbox.listener('greet', resync=lambda: resyncs.append(True))
+    def failing(events):
+        raise RuntimeError('stale')
+
+    outbox.replay()
+    publish(db, outbox, 'greet')
+    publish(db, outbox, 'greet')
+    assert outbox.replay() == 2
+    assert resyncs == [True]
+    assert outbox.counts[('greet', 'resynced')] == 2
+    # not read again
+    assert outbox.replay() == 0
+
+
+def test_listened_topic_needs_no_handler(env):
+    db, model, outbox = env
+    outbox.listener('greet')(lambda events: None)
+    key = publish(db, outbox, 'greet')
+    outbox.drain()
+    row = event(db, model, key)
+    assert row.done_at is not None and row.last_error is None
+
+
+def test_wake_without_workers_runs_both(env):
+    db, model, outbox = env
+    handled, heard = [], []
+    outbox.handler('greet')(handled.append)
+    outbox.listener('greet')(heard.append)
+    outbox.replay()
+    publish(db, outbox, 'greet')
+    outbox.wake()
+    assert len(handled) == 1 and len(heard) == 1
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+from flask import session
+
+from database import LAST_WRITE_KEY
+
+VENUE_FORM = {'city': 'San Francisco', 'state': 'CA', 'address': 'a', 'phone': '1',
+              'genres': ['Jazz'], 'facebook_link': ''}
+
+
+@pytest.fixture(scope='module')
+def venue_id(fyyur):
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='Cache Hall', city='San Francisco', state='CA',
+                            genres=fyyur.genres_named(['Jazz']))
+        fyyur.db.session.add(venue)
+        fyyur.db.session.commit()
+        return venue.id
+
+
+def test_a_write_reaches_the_cached_listing(fyyur, venue_id):
+    reader, writer = fyyur.app.test_client(), fyyur.app.test_client()
+    assert reader.get('/venues?per_page=100').headers['X-Cache'] == 'MISS'
+    assert reader.get('/venues?per_page=100').headers['X-Cache'] == 'HIT'
+    writer.post('/venues/%d/edit' % venue_id, data=dict(VENUE_FORM, name='Cache Hall Renamed'))
+    # the commit woke the listener thread; replay here instead of waiting for it
+    with fyyur.app.app_context():
+        fyyur.outbox.replay()
+    page = reader.get('/venues?per_page=100')
+    assert page.headers['X-Cache'] == 'MISS'
+    assert b'Cache Hall Renamed' in page.data
+    assert reader.get('/venues?per_page=100').headers['X-Cache'] == 'HIT'
+
+
+def test_the_writer_bypasses_the_cache(fyyur, venue_id):
+    writer = fyyur.app.test_client()
+    writer.post('/venues/%d/edit' % venue_id, data=dict(VENUE_FORM, name='Cache Hall'))
+    assert 'X-Cache' not in writer.get('/venues?per_page=100').headers
+    with fyyur.app.test_request_context('/venues'):
+        assert not fyyur.page_cache.bypass()
+        session[LAST_WRITE_KEY] = time.time() - fyyur.app.config['DB_READ_AFTER_WRITE_SECONDS'] - 1
+        assert not fyyur.page_cache.bypass()
+        session[LAST_WRITE_KEY] = time.time()
+        assert fyyur.page_cache.bypass()
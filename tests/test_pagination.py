@@ -0,0 +1,70 @@
+import base64
+import json
+from datetime import datetime
+
+import dateutil.parser
+import pytest
+from werkzeug.exceptions import BadRequest
+
+
+def token(value):
+    return base64.urlsafe_b64encode(value if isinstance(value, bytes) else json.dumps(value).encode()).decode()
+
+
+@pytest.fixture(scope='module')
+def artists(fyyur):
+    with fyyur.app.app_context():
+        fyyur.db.session.add_all([fyyur.Artist(name='Artist %02d' % number, city='Austin', state='TX')
+                                  for number in range(25)])
+        fyyur.db.session.commit()
+    return fyyur
+
+
+def test_cursor_round_trip(fyyur):
+    values = [datetime(2030, 1, 1, 20, 30), 'O\'Neil "Jazz" Trio', None, 42]
+    parsers = [dateutil.parser.parse, str, str, int]
+    assert fyyur.decode_cursor(fyyur.encode_cursor(values), parsers) == values
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    token(b'not json'),
+    token(['Artist 01']),
+    token(['Artist 01', 1, 'extra']),
+    token(['Artist 01', 'one']),
+    token(['Artist 01', [1]]),
+    token(5),
+    token({'name': 'Artist 01', 'id': 1}),
+    token({'Artist 01': 0, '1': 0}),
+])
+def test_malformed_cursor_is_a_bad_request(fyyur, cursor):
+    with pytest.raises(BadRequest):
+        fyyur.decode_cursor(cursor, [str, int])
+
+
+def test_malformed_date_cursor_is_a_bad_request(fyyur):
+    with pytest.raises(BadRequest):
+        fyyur.decode_cursor(token(['someday', 1]), [dateutil.parser.parse, int])
+
+
+@pytest.mark.parametrize('url', ['/artists?after=garbage', '/artists?before=garbage',
+                                 '/api/v1/artists?after=' + token(['Artist 01']),
+                                 '/api/v1/shows?before=' + token(['someday', 1])])
+def test_malformed_cursor_in_a_request_is_a_400(artists, url):
+    assert artists.app.test_client().get(url).status_code == 400
+
+
+def test_walking_the_cursors_visits_every_row_once(artists):
+    client = artists.app.test_client()
+    url, names = '/api/v1/artists?per_page=10&fields=id,name', []
+    while url:
+        page = client.get(url).get_json()
+        names += [artist['name'] for artist in page['data']]
+        url = page['next']
+    assert names == ['Artist %02d' % number for number in range(25)]
+    # and back from the last page
+    page = client.get('/api/v1/artists?per_page=10&fields=id,name&after=' +
+                      artists.encode_cursor(['Artist 19', 20])).get_json()
+    assert [artist['name'] for artist in page['data']] == ['Artist 20', 'Artist 21', 'Artist 22', 'Artist 23', 'Artist 24']
+    page = client.get(page['prev']).get_json()
+    assert [artist['name'] for artist in page['data']] == ['Artist %02d' % number for number in range(10, 20)]
@@ -0,0 +1,42 @@
+import shutil
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def venue_id(fyyur):
+    with fyyur.app.app_context():
+        venue = fyyur.Venue(name='Replica Hall', city='Austin', state='TX')
+        fyyur.db.session.add(venue)
+        fyyur.db.session.commit()
+        return venue.id
+
+
+@pytest.fixture
+def replica(fyyur, venue_id, tmp_path):
+    # a copy of the database as replica_1, for one test
+    path = fyyur.app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    shutil.copy(path, str(tmp_path / 'replica.db'))
+    binds = fyyur.app.config['SQLALCHEMY_BINDS']
+    fyyur.app.config['SQLALCHEMY_BINDS'] = dict(binds or {}, replica_1='sqlite:///%s' % (tmp_path / 'replica.db'))
+    yield venue_id
+    fyyur.app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def test_detail_pages_read_the_replica(fyyur, replica):
+    response = fyyur.app.test_client().get('/venues/%d' % replica)
+    assert response.headers['X-DB-Route'] == 'replica_1'
+
+
+def test_page_cache_misses_read_the_primary(fyyur, replica):
+    client = fyyur.app.test_client()
+    miss = client.get('/venues?per_page=3&replica')
+    assert (miss.headers['X-Cache'], miss.headers['X-DB-Route']) == ('MISS', 'primary')
+    assert client.get('/venues?per_page=3&replica').headers['X-Cache'] == 'HIT'
+
+
+def test_tagged_fragments_from_a_replica_are_not_stored(fyyur, replica):
+    fragments = fyyur.app.jinja_env.fragment_cache.fragments
+    fragments.clear()
+    fyyur.app.test_client().get('/venues/%d' % replica)
+    assert not any(key.startswith('venue-header') for key in fragments._entries)
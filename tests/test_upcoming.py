@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import upcoming
+from upcoming import UpcomingShowCounts
+
+NOW = datetime(2030, 1, 1, 20)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # upcoming's datetime.now() and time.time(), both moved by clock.advance()
+    class Clock(object):
+        now = NOW
+        time = 1000.0
+
+        def advance(self, **delta):
+            self.now += timedelta(**delta)
+            self.time += timedelta(**delta).total_seconds()
+
+    clock = Clock()
+
+    class Now(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock.now
+    monkeypatch.setattr(upcoming, 'datetime', Now)
+    monkeypatch.setattr(upcoming.time, 'time', lambda: clock.time)
+    return clock
+
+
+def counts_of(shows, **options):
+    # shows: [(start, venue id, artist id)]; counts the loads
+    loads = []
+
+    def load(now):
+        loads.append(now)
+        return [show for show in shows if show[0] > now]
+    return UpcomingShowCounts(load, **options), loads
+
+
+def test_counts_per_venue_and_artist(clock):
+    counts, loads = counts_of([(NOW + timedelta(hours=1), 1, 10), (NOW + timedelta(hours=2), 1, 11),
+                               (NOW - timedelta(hours=1), 2, 10)])
+    assert counts.venues([1, 2, 3]) == {1: 2, 2: 0, 3: 0}
+    assert counts.artists([10, 11]) == {10: 1, 11: 1}
+    assert counts.next_crossing() == NOW + timedelta(hours=1)
+    assert len(loads) == 1
+
+
+def test_a_show_moves_from_upcoming_to_past(clock):
+    # max_age=0: no periodic reload
+    counts, loads = counts_of([(NOW + timedelta(hours=1), 1, 10), (NOW + timedelta(hours=2), 1, 10)], max_age=0)
+    assert counts.venues([1]) == {1: 2}
+    clock.advance(hours=1)
+    # its start is not upcoming any more
+    assert counts.venues([1]) == {1: 1}
+    assert counts.artists([10]) == {10: 1}
+    assert counts.next_crossing() == NOW + timedelta(hours=2)
+    clock.advance(hours=1)
+    assert counts.venues([1]) == {1: 0}
+    assert counts.next_crossing() is None
+    # retired from the heap, not reloaded
+    assert len(loads) == 1
+
+
+def test_counts_are_reloaded_after_max_age(clock):
+    shows = [(NOW + timedelta(hours=1), 1, 10)]
+    counts, loads = counts_of(shows, max_age=60)
+    counts.venues([1])
+    shows.append((NOW + timedelta(hours=3), 1, 10))
+    clock.advance(seconds=30)
+    assert counts.venues([1]) == {1: 1}
+    clock.advance(seconds=31)
+    assert counts.venues([1]) == {1: 2}
+    assert len(loads) == 2
+
+
+def test_show_added(clock):
+    counts, loads = counts_of([])
+    # nothing loaded yet: the load will have it
+    counts.show_added(1, 10, NOW + timedelta(hours=1))
+    assert counts.venues([1]) == {1: 0}
+    counts.show_added(1, 10, NOW + timedelta(hours=1))
+    assert counts.venues([1]) == {1: 1} and counts.artists([10]) == {10: 1}
+    assert counts.next_crossing() == NOW + timedelta(hours=1)
+    # already started
+    counts.show_added(2, 10, NOW - timedelta(minutes=1))
+    assert counts.venues([2]) == {2: 0}
+
+
+def test_show_added_skips_writes_the_load_has_seen(clock):
+    counts, loads = counts_of([])
+    written_at = clock.time
+    clock.advance(seconds=1)
+    counts.venues([1])
+    # written before the load: it already counted the show
+    counts.show_added(1, 10, NOW + timedelta(hours=1), written_at)
+    assert counts.venues([1]) == {1: 0}
+    # written after it
+    counts.show_added(1, 10, NOW + timedelta(hours=1), clock.time + 1)
+    assert counts.venues([1]) == {1: 1}
+
+
+def test_invalidate_reloads_on_next_read(clock):
+    shows = [(NOW + timedelta(hours=1), 1, 10)]
+    counts, loads = counts_of(shows)
+    assert counts.venues([1]) == {1: 1}
+    shows.pop()
+    assert counts.venues([1]) == {1: 1}
+    counts.invalidate()
+    assert len(loads) == 1
+    assert counts.venues([1]) == {1: 0}
+    assert len(loads) == 2
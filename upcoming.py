@@ -0,0 +1,90 @@
+"""Per-venue and per-artist upcoming show counts, maintained in memory.
+
+A count only changes when a show is added or removed, or when a show's start
+time passes. The store loads every upcoming show once (a range scan of
+``ix_show_start_date_id``), keeps them in a heap ordered by start time and, on
+each read, retires the shows whose start has since passed -- so listing pages
+look counts up in O(rows displayed) without scanning ``show``.
+
+Show inserts are applied with ``show_added`` by the outbox worker that runs
+their event; anything else (deletes, other workers' writes) is picked up by
+``invalidate`` or by the periodic reload every `max_age` seconds.
+"""
+import heapq
+import time
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+
+
+class UpcomingShowCounts(object):
+
+    def __init__(self, load, max_age=60):
+        # load(now) -> query of (start_date, venue_id, artist_id) of the shows after now
+        self.load = load
+        self.max_age = max_age
+        self._lock = Lock()
+        self._loaded_at = None
+        self._venues = Counter()
+        self._artists = Counter()
+        self._pending = []
+
+    def venues(self, ids):
+        """{venue id: number of upcoming shows} for the given ids."""
+        return self._counts('_venues', ids)
+
+    def artists(self, ids):
+        """{artist id: number of upcoming shows} for the given ids."""
+        return self._counts('_artists', ids)
+
+    def next_crossing(self):
+        """Start time of the next upcoming show, when the counts next change by themselves."""
+        with self._lock:
+            self._refresh()
+            return self._pending[0][0] if self._pending else None
+
+    def show_added(self, venue_id, artist_id, start_date, written_at=None):
+        # written_at: time.time() of the write; a load since then has the show already
+        with self._lock:
+            if self._loaded_at is None or start_date <= datetime.now():
+                return
+            if written_at is not None and self._loaded_at >= written_at:
+                return
+            self._venues[venue_id] += 1
+            self._artists[artist_id] += 1
+            heapq.heappush(self._pending, (start_date, venue_id, artist_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _counts(self, attribute, ids):
+        with self._lock:
+            self._refresh()
+            # looked up after the refresh, a reload replaces the counters
+            counter = getattr(self, attribute)
+            return {id: counter.get(id, 0) for id in ids}
+
+    def _refresh(self):
+        now = datetime.now()
+        if self._loaded_at is None or (self.max_age and time.time() - self._loaded_at > self.max_age):
+            self._load(now)
+            return
+        while self._pending and self._pending[0][0] <= now:
+            _, venue_id, artist_id = heapq.heappop(self._pending)
+            self._retire(self._venues, venue_id)
+            self._retire(self._artists, artist_id)
+
+    def _load(self, now):
+        pending = [tuple(row) for row in self.load(now)]
+        heapq.heapify(pending)
+        self._pending = pending
+        self._venues = Counter(venue_id for _, venue_id, _ in pending)
+        self._artists = Counter(artist_id for _, _, artist_id in pending)
+        self._loaded_at = time.time()
+
+    @staticmethod
+    def _retire(counter, id):
+        counter[id] -= 1
+        if counter[id] <= 0:
+            del counter[id]